@@ -0,0 +1,345 @@
+# coding=utf-8
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Copyright 2014 Yandex LLC
+# All Rights Reserved.
+#
+# Author : Alexis Wilpert
+#
+#
+# Build of optimized G2P FSTs. The grammars are compiled with thraxcompiler in dependency order; the compiled FARs are
+# kept in a cache keyed by the content hash of every .grm file and of the files it imports, so that only the changed
+# grammars (and the ones importing them) are compiled again. The rules of the chain (--rules) are then extracted and
+# adjacent rules are composed as long as the composed machine stays below --max_states states; every resulting FST is
+# determinized (as an acceptor over label pairs), minimized and arc-sorted. Finally, the test sentences are transduced
+# with the chain of single rules and with the optimized chain, as the strings the transcriber sends to the G2P FSTs:
+# the outputs must be identical, and the time per sentence of both chains is reported. Needs Thrax, the OpenFst command
+# line tools and transduce (src/) in PATH
+
+
+import os
+import re
+import sys
+import time
+import shutil
+import hashlib
+import optparse
+import subprocess
+import tempfile
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+GRAMMARS_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(GRAMMARS_DIR)
+DICTIONARIES_DIR = os.path.join(PACKAGE_DIR, 'dictionaries')
+RULES = 'READ,INFL,PALT,DIPH,VOWL,CONS,CROS,SYLL,WRIT'
+sys.path.insert(0, os.path.join(PACKAGE_DIR, 'scripts'))
+
+import tts_transcriber
+from tts_transcriber import to_utf8, from_utf8, GEN_POS, SIL
+
+import_statement = re.compile(r"^\s*import\s+'([^']+)'\s+as\s+\w+\s*;", re.MULTILINE)
+fst_info_line = re.compile(r'^(.*?\S)\s{2,}(\S.*)$')
+
+
+def run(command, **kwargs):
+    dev_null = open(os.devnull, 'wb')
+    try:
+        subprocess.check_call(command, stdout=dev_null, stderr=dev_null, **kwargs)
+    finally:
+        dev_null.close()
+
+
+def get_imports(grm_file):
+    with open(grm_file) as fp:
+        contents = fp.read()
+    return [os.path.join(os.path.dirname(grm_file), imported) for imported in import_statement.findall(contents)]
+
+
+def get_grammar_hash(grm_file, hashes):
+    """
+    hash of a grammar file and of all grammar files it imports (directly or not)
+    """
+
+    if grm_file not in hashes:
+        h = hashlib.sha1()
+        with open(grm_file, 'rb') as fp:
+            h.update(fp.read())
+        for imported in get_imports(grm_file):
+            h.update(get_grammar_hash(imported, hashes))
+        hashes[grm_file] = h.hexdigest()
+    return hashes[grm_file]
+
+
+def compile_grammar(grm_file, cache_dir, hashes, compiled):
+    """
+    compile a grammar file to a FAR next to it (after its imports), unless the FAR of the same sources is in the cache.
+    compiled maps every grammar already handled to 'compiled' or 'cached'
+    """
+
+    if grm_file in compiled:
+        return
+    for imported in get_imports(grm_file):
+        compile_grammar(imported, cache_dir, hashes, compiled)
+    name = os.path.splitext(os.path.basename(grm_file))[0]
+    far_file = os.path.splitext(grm_file)[0] + '.far'
+    cached_far_file = os.path.join(cache_dir, '{0}-{1}.far'.format(name, get_grammar_hash(grm_file, hashes)))
+    if os.path.exists(cached_far_file):
+        shutil.copyfile(cached_far_file, far_file)
+        compiled[grm_file] = 'cached'
+    else:
+        sys.stdout.write('Compiling ' + os.path.basename(grm_file) + '\n')
+        run(['thraxcompiler', '--input_grammar=' + os.path.basename(grm_file),
+             '--output_far=' + os.path.basename(far_file)], cwd=os.path.dirname(grm_file))
+        tmp_file_name = cached_far_file + '.' + str(os.getpid())
+        shutil.copyfile(far_file, tmp_file_name)
+        os.rename(tmp_file_name, cached_far_file)
+        compiled[grm_file] = 'compiled'
+
+
+def get_fst_info(fst_file):
+    """
+    fstinfo output as a dictionary (e.g. '# of states' -> '123', 'cyclic' -> 'y')
+    """
+
+    info = {}
+    for line in subprocess.Popen(['fstinfo', fst_file], stdout=subprocess.PIPE).communicate()[0].splitlines():
+        match = fst_info_line.match(line.strip())
+        if match:
+            info[match.group(1)] = match.group(2)
+    return info
+
+
+def optimize_fst(in_file, out_file, work_dir):
+    """
+    remove the epsilons, determinize and minimize as an acceptor over label pairs (not for cyclic weighted machines,
+    which might not be determinizable) and sort the arcs by input label
+    """
+
+    tmp_file = os.path.join(work_dir, 'optimized.tmp')
+    run(['fstrmepsilon', in_file, tmp_file + '.0'])
+    info = get_fst_info(tmp_file + '.0')
+    step = 0
+    if not (info.get('weighted') == 'y' and info.get('cyclic') == 'y'):
+        codex = tmp_file + '.codex'
+        run(['fstencode', '--encode_labels', tmp_file + '.0', codex, tmp_file + '.1'])
+        run(['fstdeterminize', tmp_file + '.1', tmp_file + '.2'])
+        run(['fstminimize', tmp_file + '.2', tmp_file + '.3'])
+        run(['fstencode', '--decode', tmp_file + '.3', codex, tmp_file + '.4'])
+        step = 4
+    run(['fstarcsort', '--sort_type=ilabel', tmp_file + '.' + str(step), out_file])
+
+
+def compose_fsts(first_file, second_file, out_file, work_dir):
+    sorted_file = os.path.join(work_dir, 'sorted.tmp')
+    composed_file = os.path.join(work_dir, 'composed.tmp')
+    run(['fstarcsort', '--sort_type=ilabel', second_file, sorted_file])
+    run(['fstcompose', first_file, sorted_file, composed_file])
+    optimize_fst(composed_file, out_file, work_dir)
+
+
+def precompose(rules, rules_dir, output_dir, max_states, work_dir):
+    """
+    compose adjacent rules of the chain as long as the composed (optimized) machine has at most max_states states.
+    Returns the list of (rules, FST file) of the optimized chain
+    """
+
+    groups = []
+    group = [rules[0]]
+    group_file = os.path.join(work_dir, 'group.fst')
+    optimize_fst(os.path.join(rules_dir, rules[0]), group_file, work_dir)
+    for rule in rules[1:] + [None]:
+        if rule is not None:
+            candidate_file = os.path.join(work_dir, 'candidate.fst')
+            try:
+                compose_fsts(group_file, os.path.join(rules_dir, rule), candidate_file, work_dir)
+                states = int(get_fst_info(candidate_file).get('# of states', max_states + 1))
+            except subprocess.CalledProcessError:
+                states = None
+            if states is not None and states <= max_states:
+                group.append(rule)
+                os.rename(candidate_file, group_file)
+                continue
+        out_file = os.path.join(output_dir, '_'.join(group))
+        shutil.copyfile(group_file, out_file)
+        info = get_fst_info(out_file)
+        sys.stdout.write('{0}: {1} states, {2} arcs\n'.format(' @ '.join(group), info.get('# of states'),
+                                                             info.get('# of arcs')))
+        groups.append((group, out_file))
+        if rule is not None:
+            group = [rule]
+            optimize_fst(os.path.join(rules_dir, rule), group_file, work_dir)
+    return groups
+
+
+def read_lines_to_transcribe(log_file, lexica):
+    """
+    strings sent to the G2P FSTs for the test sentences, made by get_line_to_transcribe from the tokenized sentences
+    of the log, with its POS tags and its stress strings in place of the stress prediction (so that the SIL and POS
+    tokens and the word separators are the ones of the transcriber)
+    """
+
+    lex_entries, homograph_entries, user_entries, yo_words = lexica
+    sentences = []
+    word = None
+    for line in open(log_file):
+        tag, _, value = line.rstrip('\n').partition('\t')
+        value = to_utf8(value)
+        if tag == '[NORM]':
+            sentences.append((value, [], {}))
+        elif not sentences:
+            continue
+        elif tag == '[WORD]':
+            word = value
+            sentences[-1][1].append(GEN_POS)
+        elif tag == '[POSP]' and value != 'NULL':
+            sentences[-1][1][-1] = value
+        elif tag == '[STRS]' and word != SIL:
+            sentences[-1][2][word] = value
+    lines_to_transcribe = []
+    for tokenized_sentence, tags, stress_strings in sentences:
+        line_to_transcribe = tts_transcriber.get_line_to_transcribe(
+            None, user_entries, lex_entries, homograph_entries, yo_words, None, stress_predictions=stress_strings,
+            tokenized_sentence=tokenized_sentence, pos_predictions={tokenized_sentence: tags})
+        if line_to_transcribe:
+            lines_to_transcribe.append(from_utf8(line_to_transcribe))
+    return lines_to_transcribe
+
+
+def transduce(chain, input_file, output_file):
+    start_time = time.time()
+    run(['transduce', '--fst=' + ','.join(chain), input_file, output_file])
+    return time.time() - start_time
+
+
+def measure_chain(chain, lines, passes, work_dir):
+    """
+    outputs of a chain of FSTs for the lines and its time per line, without the time needed for loading the FSTs
+    """
+
+    empty_file = os.path.join(work_dir, 'empty.txt')
+    input_file = os.path.join(work_dir, 'input.txt')
+    output_file = os.path.join(work_dir, 'output.txt')
+    open(empty_file, 'w').close()
+    with open(input_file, 'w') as out_file:
+        for _ in range(passes):
+            out_file.write('\n'.join(lines) + '\n')
+    loading_time = transduce(chain, empty_file, output_file)
+    total_time = transduce(chain, input_file, output_file)
+    with open(output_file) as fp:
+        outputs = fp.read().splitlines()[:len(lines)]
+    return outputs, max(total_time - loading_time, 0) / (passes * len(lines))
+
+
+def main():
+    options_parser = optparse.OptionParser()
+    options_parser.add_option('--grammar', default=os.path.join(GRAMMARS_DIR, 'g2p.grm'),
+                              help='Grammar file exporting the rules')
+    options_parser.add_option('--rules', default=RULES, help='Chain of rules, in order (default: %default)')
+    options_parser.add_option('--max_states', type='int', default=100000,
+                              help='Largest number of states of a composed machine (default: %default)')
+    options_parser.add_option('--cache_dir', default=os.path.join(GRAMMARS_DIR, 'build_cache'),
+                              help='Directory of the compiled FARs (default: %default)')
+    options_parser.add_option('--output_dir', default=os.path.join(GRAMMARS_DIR, 'optimized'),
+                              help='Directory of the optimized FSTs (default: %default)')
+    options_parser.add_option('--log', default=os.path.join(PACKAGE_DIR, 'test', 'rus_sentences.txt.log'),
+                              help='Transcription log of the test sentences')
+    options_parser.add_option('--dictionary', '-l',
+                              default=os.path.join(DICTIONARIES_DIR, 'tts-dict-simple.pruned.txt'),
+                              help='Simple dictionary used for the log (default: %default)')
+    options_parser.add_option('--homographs', '-a', default=os.path.join(DICTIONARIES_DIR, 'tts-dict-homographs.txt'),
+                              help='Homographs used for the log (default: %default)')
+    options_parser.add_option('--user', '-u', help='User lexicon used for the log (OPT)')
+    options_parser.add_option('--yo_list', '-y', default=os.path.join(DICTIONARIES_DIR, 'tts-dict-yo-list.txt'),
+                              help='List of words that contain the letter <yo> used for the log (default: %default)')
+    options_parser.add_option('--passes', type='int', default=5,
+                              help='Passes over the test sentences for measuring the time per sentence')
+    options_parser.add_option('--no_check', action='store_true', default=False,
+                              help='Do not compare the optimized chain with the chain of single rules')
+    options_parser.add_option('--output', '-o', help='Write the results as JSON to this file (OPT)')
+    options, arguments = options_parser.parse_args()
+
+    grm_file = os.path.abspath(options.grammar)
+    rules = options.rules.replace(' ', '').split(',')
+    for directory in [options.cache_dir, options.output_dir]:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    work_dir = tempfile.mkdtemp(prefix='g2p-build-')
+    results = {'rules': rules}
+    failed = False
+    try:
+        start_time = time.time()
+        compiled = {}
+        compile_grammar(grm_file, options.cache_dir, {}, compiled)
+        results['grammars_compiled'] = sorted(os.path.basename(grm) for grm in compiled
+                                              if compiled[grm] == 'compiled')
+        results['grammars_cached'] = sorted(os.path.basename(grm) for grm in compiled if compiled[grm] == 'cached')
+        results['compilation_time'] = time.time() - start_time
+        sys.stdout.write('{0} grammars compiled, {1} taken from the cache\n'.format(
+            len(results['grammars_compiled']), len(results['grammars_cached'])))
+
+        start_time = time.time()
+        rules_dir = os.path.join(work_dir, 'rules')
+        os.makedirs(rules_dir)
+        run(['farextract', '--filename_prefix=' + rules_dir + os.sep, os.path.splitext(grm_file)[0] + '.far'])
+        groups = precompose(rules, rules_dir, options.output_dir, options.max_states, work_dir)
+        results['optimized_chain'] = ['_'.join(group) for group, _ in groups]
+        results['optimization_time'] = time.time() - start_time
+        optimized_chain = [out_file for _, out_file in groups]
+        sys.stdout.write('Optimized chain (-g): ' + ','.join(optimized_chain) + '\n')
+
+        if not options.no_check:
+            lines = read_lines_to_transcribe(options.log, tts_transcriber.load_lexica(
+                options.dictionary, options.homographs, options.user, options.yo_list))
+            single_outputs, single_time = measure_chain([os.path.join(rules_dir, rule) for rule in rules], lines,
+                                                        options.passes, work_dir)
+            optimized_outputs, optimized_time = measure_chain(optimized_chain, lines, options.passes, work_dir)
+            mismatches = 0
+            for line, single_output, optimized_output in zip(lines, single_outputs, optimized_outputs):
+                if single_output != optimized_output:
+                    mismatches += 1
+                    if mismatches <= 10:
+                        sys.stderr.write('Different output for {0}:\n  {1}\n  {2}\n'.format(
+                            line, single_output, optimized_output))
+            mismatches += abs(len(single_outputs) - len(optimized_outputs))
+            results.update({'sentences': len(lines),
+                            'mismatches': mismatches,
+                            'single_rules_ms_per_sentence': 1000 * single_time,
+                            'optimized_ms_per_sentence': 1000 * optimized_time,
+                            'speedup': single_time / optimized_time if optimized_time else None})
+            sys.stdout.write('{0} sentences, {1} different outputs\n'.format(len(lines), mismatches))
+            sys.stdout.write('time per sentence: {0:.3f} ms with single rules, {1:.3f} ms optimized'.format(
+                1000 * single_time, 1000 * optimized_time))
+            if optimized_time:
+                sys.stdout.write(' ({0:.1f}x)'.format(single_time / optimized_time))
+            sys.stdout.write('\n')
+            failed = mismatches > 0
+    except (OSError, subprocess.CalledProcessError) as e:
+        sys.stderr.write('[ERROR] ' + str(e) + '\n')
+        failed = True
+    finally:
+        shutil.rmtree(work_dir)
+    if options.output:
+        with open(options.output, 'w') as out_file:
+            json.dump(results, out_file, indent=2)
+    if failed:
+        sys.exit(1)
+
+
+# call the main() function to start the program.
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# coding=utf-8
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Copyright 2014 Yandex LLC
+# All Rights Reserved.
+#
+# Author : Alexis Wilpert
+#
+#
+# Stand-in POS tagger for tests of the POS tagger interface of tts_transcriber.py (--pos_tagger), guessing the POS of
+# every token from its ending. It can be used as an in-process callable (python:standin_pos_tagger.tag_sentences) or
+# as a tagger process (python standin_pos_tagger.py)
+
+
+
+import sys
+import time
+import optparse
+
+
+def to_utf8(string):  # string enters Python
+    try:
+        string = string.decode('ascii')
+    except UnicodeError:
+        string = string.decode('utf-8')
+    return string
+
+
+GEN_POS = 'x/'
+
+# (ending, tag) pairs, the first matching ending wins
+tagged_endings = [(to_utf8(ending), tag) for ending, tag in [
+    ('ться', 'vrb/inf'), ('тся', 'vrb/prs'), ('ать', 'vrb/inf'), ('ять', 'vrb/inf'), ('еть', 'vrb/inf'),
+    ('ить', 'vrb/inf'), ('ала', 'vrb/pst/fem'), ('ила', 'vrb/pst/fem'), ('ало', 'vrb/pst/neu'),
+    ('ило', 'vrb/pst/neu'), ('али', 'vrb/pst/pl'), ('или', 'vrb/pst/pl'), ('ал', 'vrb/pst/msc'),
+    ('ил', 'vrb/pst/msc'), ('ого', 'adj/gen'), ('его', 'adj/gen'), ('ому', 'adj/dat'), ('ему', 'adj/dat'),
+    ('ыми', 'adj/ins/pl'), ('ими', 'adj/ins/pl'), ('ый', 'adj/nom/msc'), ('ий', 'adj/nom/msc'),
+    ('ая', 'adj/nom/fem'), ('яя', 'adj/nom/fem'), ('ое', 'adj/nom/neu'), ('ее', 'adj/nom/neu'),
+    ('ые', 'adj/nom/pl'), ('ие', 'adj/nom/pl'), ('ых', 'adj/gen/pl'), ('их', 'adj/gen/pl')]]
+min_stem_length = 2  # letters before the ending, shorter words (pronouns, prepositions...) get GEN_POS
+
+
+def tag_token(token):
+    for ending, tag in tagged_endings:
+        if token.endswith(ending) and len(token) - len(ending) >= min_stem_length:
+            return tag
+    return GEN_POS
+
+
+def tag_sentences(sentences):
+    """
+    tags of a batch of sentences (lists of unicode tokens): one list of POS[/feature...] tags per sentence
+    """
+
+    return [[tag_token(token) for token in tokens] for tokens in sentences]
+
+
+def main():
+    options_parser = optparse.OptionParser()
+    options_parser.add_option('--delay', type='float', default=0,
+                              help='Seconds to wait before answering every batch, to test the timeout (OPT)')
+    options, _ = options_parser.parse_args()
+    # one batch per line: sentences separated by tabs, tokens by spaces
+    for line in iter(sys.stdin.readline, ''):
+        sentences = [sentence.split(' ') for sentence in to_utf8(line.rstrip('\n')).split('\t')]
+        if options.delay > 0:
+            time.sleep(options.delay)
+        sys.stdout.write('\t'.join(' '.join(tags) for tags in tag_sentences(sentences)) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -29,6 +29,35 @@ import optparse
 import subprocess
 import logging
 import hashlib
+import tempfile
+import time
+import bisect
+import collections
+import threading
+import multiprocessing
+import io
+import mmap
+import array
+import struct
+import zlib
+import ctypes
+import shlex
+import importlib
+
+try:
+    import anydbm as dbm
+except ImportError:
+    import dbm
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
 
 try:
     import simplejson as json
@@ -45,6 +74,21 @@ class NullHandler(logging.Handler):
 logging.getLogger('nullLogger').addHandler(NullHandler())
 
 SCRIPT_VERSION = "1.3"
+STATS_INTERVAL = 10  # seconds between two writes of the statistics file during a run
+PROCESS_TIMEOUT = 60  # seconds a supervised process has to answer a request, see SupervisedProcess
+PROCESS_RETRIES = 2  # restarts of a supervised process for one request before giving up on it
+G2P_SENTINEL = 'SIL'  # request sent after every request to transduce, to detect missing or extra output lines
+SNAPSHOT_MAGIC = 'RUSLEXS\0'
+SNAPSHOT_VERSION = 1
+STRESS_LEXICON_MAGIC = 'RUSSTRS\0'
+STRESS_LEXICON_VERSION = 1
+MANIFEST_VERSION = 1
+CHECKPOINT_VERSION = 1
+CHECKPOINT_INTERVAL = 60  # seconds between two checkpoints of a run, see TranscriptionCheckpoint
+ALIGNED_MAGIC = 'RUSALGN\0'
+ALIGNED_VERSION = 1
+POS_BATCH_SIZE = 100  # sentences sent to the POS tagger in one request, see PosTagger
+POS_TIMEOUT = 10  # seconds the POS tagger has to tag a batch before its sentences fall back to GEN_POS
 GEN_POS = 'x/'
 SIL = 'SIL'
 
@@ -65,10 +109,19 @@ def from_utf8(string):  # string leaves Python
     return string
 
 
+valid_cyr_phono = re.compile(to_utf8('^[а-яА-ЯёЁ+-]+$'))
+valid_ascii_phono = re.compile('^[a-zA-Z@_-]+$')
+vowels = re.compile(to_utf8('[еиюяаоуэыё]'))
+yo_letter = to_utf8('ё')
+ye_letter = to_utf8('е')
+# letters and phones that are vowels, and markers of the strings sent to the G2P FSTs (see get_g2p_contexts)
+g2p_context_vowels = frozenset(to_utf8('аеёиоуыэюяaeiouEIU@'))
+g2p_pos_markers = ('ADJ', 'VERB')
+g2p_word_marker = 'WUD'
+
+
 def is_valid_transcription(phono):
     is_valid = True
-    valid_cyr_phono = re.compile(to_utf8('^[а-яА-ЯёЁ+-]+$'))
-    valid_ascii_phono = re.compile('^[a-zA-Z@_-]+$')
     valid_cyr = valid_cyr_phono.match(phono)
     valid_ascii = valid_ascii_phono.match(phono)
     if not valid_cyr and not valid_ascii:
@@ -77,8 +130,8 @@ def is_valid_transcription(phono):
 
 
 def word_is_monosyllabic(word):
-    vowels_in_word = re.findall(re.compile(to_utf8('[еиюяаоуэыё]')), word)
-    if len(vowels_in_word) == 1 and not to_utf8('ё') in word:
+    vowels_in_word = vowels.findall(word)
+    if len(vowels_in_word) == 1 and not yo_letter in word:
         return vowels_in_word[0]
     else:
         return None
@@ -91,26 +144,813 @@ def print_feats_list(lst):
     return ret_str[:-1]
 
 
+class TranscriptionStats(object):
+    """
+    statistics of the transcription: number of calls, total and maximum time and a histogram of the durations of every
+    stage, number of words resolved by every source and other counters. get_summary() can be called at any time, also
+    while transcribing
+    """
+
+    # upper bounds (in seconds) of the histogram buckets, the last bucket has no upper bound
+    histogram_bounds = [1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0]
+    histogram_labels = ['<10us', '<100us', '<1ms', '<10ms', '<100ms', '<1s', '>=1s']
+
+    def __init__(self):
+        super(TranscriptionStats, self).__init__()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.stages = {}  # stage -> [calls, total time, maximum time, histogram]
+        self.sources = collections.defaultdict(int)
+        self.counters = collections.defaultdict(int)
+        self.start()
+
+    def start(self):
+        """
+        start measuring the elapsed time (and the sentences per second) from now
+        """
+
+        self.start_time = time.time()
+        self.last_write_time = self.start_time
+
+    def add_time(self, stage, duration):
+        with self.lock:
+            stage_stats = self.stages.get(stage)
+            if stage_stats is None:
+                stage_stats = self.stages[stage] = [0, 0.0, 0.0, [0] * len(self.histogram_labels)]
+            stage_stats[0] += 1
+            stage_stats[1] += duration
+            stage_stats[2] = max(stage_stats[2], duration)
+            stage_stats[3][bisect.bisect_right(self.histogram_bounds, duration)] += 1
+
+    def count_source(self, source):
+        with self.lock:
+            self.sources[source] += 1
+
+    def count(self, counter, num=1):
+        with self.lock:
+            self.counters[counter] += num
+
+    def pop_state(self):
+        """
+        return the statistics collected until now and start from zero (used by the worker processes of --jobs)
+        """
+
+        with self.lock:
+            state = (self.stages, dict(self.sources), dict(self.counters))
+            self.stages = {}
+            self.sources = collections.defaultdict(int)
+            self.counters = collections.defaultdict(int)
+        return state
+
+    def merge(self, state):
+        stages, sources, counters = state
+        with self.lock:
+            for stage, (calls, total_time, max_time, histogram) in stages.items():
+                stage_stats = self.stages.setdefault(stage, [0, 0.0, 0.0, [0] * len(self.histogram_labels)])
+                stage_stats[0] += calls
+                stage_stats[1] += total_time
+                stage_stats[2] = max(stage_stats[2], max_time)
+                stage_stats[3] = [n1 + n2 for n1, n2 in zip(stage_stats[3], histogram)]
+            for source, num in sources.items():
+                self.sources[source] += num
+            for counter, num in counters.items():
+                self.counters[counter] += num
+
+    def get_summary(self):
+        with self.lock:
+            elapsed_time = time.time() - self.start_time
+            stages = {}
+            for stage, (calls, total_time, max_time, histogram) in self.stages.items():
+                stages[stage] = {'calls': calls,
+                                 'total_s': round(total_time, 6),
+                                 'mean_ms': round(1000 * total_time / calls, 4),
+                                 'max_ms': round(1000 * max_time, 4),
+                                 'histogram': dict((label, n) for label, n in zip(self.histogram_labels, histogram)
+                                                   if n)}
+            return {'elapsed_s': round(elapsed_time, 3),
+                    'sentences_per_s': round(self.counters.get('sentences', 0) / max(elapsed_time, 1e-9), 2),
+                    'stages': stages,
+                    'sources': dict(self.sources),
+                    'counters': dict(self.counters)}
+
+    def write(self, stats_file):
+        """
+        write the summary as JSON. The file is replaced atomically, so that it can be read at any time
+        """
+
+        tmp_file = stats_file + '.tmp'
+        with open(tmp_file, 'w') as out_file:
+            json.dump(self.get_summary(), out_file, indent=2, sort_keys=True)
+            out_file.write('\n')
+        os.rename(tmp_file, stats_file)
+        self.last_write_time = time.time()
+
+    def write_periodically(self, stats_file):
+        if stats_file and time.time() - self.last_write_time >= STATS_INTERVAL:
+            self.write(stats_file)
+
+
+# statistics of the transcriptions done by this process
+transcription_stats = TranscriptionStats()
+
+
+class SupervisedProcessFailure(Exception):
+    pass
+
+
+class SupervisedProcess(object):
+    """
+    child process answering every request line with one line (Phonetisaurus, transduce), under supervision: every
+    request must be answered within timeout seconds (0 for no limit), and the output is checked to stay in step with
+    the requests, either with a sentinel request sent after every request (whose reply, learnt at startup, must follow
+    exactly one reply line) or with check_reply(request, reply) (extra lines that fail the check are skipped). When the
+    process does not answer in time, exits or gets out of step, it is restarted and the requests in flight are sent
+    again; a request is given up (with '' as reply) after retries restarts. The last lines written by the process to
+    stderr are kept and reported at every restart. Requests can be pipelined: send() any number of them, then
+    receive() their replies in the same order
+    """
+
+    def __init__(self, command, name, timeout=PROCESS_TIMEOUT, retries=PROCESS_RETRIES, sentinel=None,
+                 check_reply=None, stderr_lines=20):
+        super(SupervisedProcess, self).__init__()
+        self.command = command
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.sentinel = sentinel
+        self.sentinel_reply = None
+        self.check_reply = check_reply
+        self.in_flight = collections.deque()
+        self.stderr_tail = collections.deque(maxlen=stderr_lines)
+        self.process = None
+        self.lines = None
+        self.readers = []
+        self.start()
+
+    @staticmethod
+    def _read_output(stream, lines):
+        for line in iter(stream.readline, ''):
+            lines.put(line)
+        lines.put(None)  # the process has exited
+
+    @staticmethod
+    def _read_errors(stream, stderr_tail):
+        for line in iter(stream.readline, ''):
+            stderr_tail.append(line)
+
+    def start(self):
+        """
+        start the process (raises OSError if it cannot be run). The first time, the reply to the sentinel is learnt
+        """
+
+        self.process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stdin=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+        # every process has its own queue, so that the lines of a killed process are not read any more
+        self.lines = queue.Queue()
+        self.readers = []
+        for read, stream, lines in [(self._read_output, self.process.stdout, self.lines),
+                                    (self._read_errors, self.process.stderr, self.stderr_tail)]:
+            reader = threading.Thread(target=read, args=(stream, lines))
+            reader.daemon = True
+            reader.start()
+            self.readers.append(reader)
+        if self.sentinel is not None and self.sentinel_reply is None:
+            self._write(self.sentinel)
+            self.sentinel_reply = self._read_line(self._get_deadline())
+            if not self.sentinel_reply:
+                # an empty reply cannot be told from a failed request
+                sys.stderr.write('[WARNING] {0} does not transcribe the sentinel, out of step output will not be '
+                                 'detected\n'.format(self.name))
+                self.sentinel = None
+
+    def restart(self, reason):
+        transcription_stats.count(self.name + '_restarts')
+        sys.stderr.write('[WARNING] {0} {1}, restarting it\n'.format(self.name, reason))
+        for line in self.stderr_tail:
+            sys.stderr.write('[WARNING] {0} stderr: {1}'.format(self.name, line))
+        self.stderr_tail.clear()
+        self.terminate()
+        try:
+            self.start()
+        except OSError:
+            raise SupervisedProcessFailure('could not be restarted')
+        for line in self.in_flight:
+            self._write(line)
+
+    def _write(self, line):
+        try:
+            self.process.stdin.write(from_utf8(line) + '\n')
+            if self.sentinel is not None and self.sentinel_reply is not None:
+                self.process.stdin.write(self.sentinel + '\n')
+            self.process.stdin.flush()
+        except IOError:
+            pass  # the process has exited, which is found out when reading its reply
+
+    def _get_deadline(self):
+        if self.timeout > 0:
+            return time.time() + self.timeout
+        return None
+
+    def _read_line(self, deadline):
+        try:
+            if deadline is None:
+                line = self.lines.get()
+            else:
+                line = self.lines.get(timeout=max(deadline - time.time(), 0))
+        except queue.Empty:
+            transcription_stats.count(self.name + '_timeouts')
+            raise SupervisedProcessFailure('did not answer within {0} seconds'.format(self.timeout))
+        if line is None:
+            self.process.wait()
+            raise SupervisedProcessFailure('exited with code {0}'.format(self.process.returncode))
+        return line.strip()
+
+    def _read_reply(self, request):
+        deadline = self._get_deadline()
+        if self.sentinel is not None:
+            replies = []
+            if from_utf8(request).strip() == self.sentinel:
+                # the reply to the request itself is the sentinel reply as well
+                replies.append(self._read_line(deadline))
+            line = self._read_line(deadline)
+            while line != self.sentinel_reply:
+                replies.append(line)
+                line = self._read_line(deadline)
+            if len(replies) != 1:
+                transcription_stats.count(self.name + '_desyncs')
+                raise SupervisedProcessFailure('answered {0} lines instead of 1'.format(len(replies)))
+            return replies[0]
+        reply = self._read_line(deadline)
+        if self.check_reply is not None:
+            while not self.check_reply(request, reply):
+                transcription_stats.count(self.name + '_desyncs')
+                reply = self._read_line(deadline)
+        return reply
+
+    def send(self, request):
+        self.in_flight.append(request)
+        self._write(request)
+
+    def receive(self):
+        """
+        reply to the oldest request in flight
+        """
+
+        attempts = 0
+        while True:
+            try:
+                reply = self._read_reply(self.in_flight[0])
+                self.in_flight.popleft()
+                return reply
+            except SupervisedProcessFailure as failure:
+                attempts += 1
+                give_up = attempts > self.retries
+                if give_up:
+                    self.in_flight.popleft()
+                    transcription_stats.count(self.name + '_failed_requests')
+                    failure = '{0} (giving up the request after {1} restarts)'.format(failure, self.retries)
+                self.restart(str(failure))
+                if give_up:
+                    return ''
+
+    def request(self, request):
+        self.send(request)
+        return self.receive()
+
+    def terminate(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        # the readers end at the end of the output of the killed process; they must not be left running when the
+        # interpreter exits
+        for reader in self.readers:
+            reader.join(1)
+
+
+class InProcessTransducer(object):
+    """
+    G2P FSTs applied in this process by libutf8transducer.so (built in src/, see Utf8TransducerC.h) instead of a
+    transduce child process. ctypes releases the GIL during the calls to the library, so several threads can transcribe
+    in parallel with one InProcessTransducer object each (the calls on one object are serialized by the library)
+    """
+
+    def __init__(self, options_g2p_fst, library_file):
+        super(InProcessTransducer, self).__init__()
+        self.library = ctypes.CDLL(library_file)
+        self.library.utf8transducer_new.restype = ctypes.c_void_p
+        self.library.utf8transducer_append_fst.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+        self.library.utf8transducer_transduce_many.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_char_p),
+                                                               ctypes.c_int, ctypes.POINTER(ctypes.c_void_p)]
+        self.library.utf8transducer_free_results.argtypes = [ctypes.POINTER(ctypes.c_void_p), ctypes.c_int]
+        self.library.utf8transducer_message.argtypes = [ctypes.c_void_p]
+        self.library.utf8transducer_message.restype = ctypes.c_char_p
+        self.library.utf8transducer_delete.argtypes = [ctypes.c_void_p]
+        self.handle = self.library.utf8transducer_new()
+        if not self.handle:
+            raise TransducerInitializationError
+        for g2p_fst in options_g2p_fst.replace(' ', '').split(','):
+            if self.library.utf8transducer_append_fst(self.handle, from_utf8(g2p_fst)):
+                sys.stderr.write('[ERROR] ' + self.library.utf8transducer_message(self.handle) + '\n')
+                self.close()
+                raise TransducerInitializationError
+
+    def transduce_many(self, strings):
+        """
+        output of the G2P FSTs for every string ('' if it could not be transduced), in one call to the library. The
+        strings are passed as transduce reads them from its input line: the trailing word separator is kept, since the
+        word-final rules of the grammars need it
+        """
+
+        strings_num = len(strings)
+        if not strings_num:
+            return []
+        texts = (ctypes.c_char_p * strings_num)(*[from_utf8(string).rstrip('\n') for string in strings])
+        results = (ctypes.c_void_p * strings_num)()
+        self.library.utf8transducer_transduce_many(self.handle, texts, strings_num, results)
+        transcriptions = [ctypes.string_at(result).strip() if result else '' for result in results]
+        self.library.utf8transducer_free_results(results, strings_num)
+        return transcriptions
+
+    def transduce(self, str_to_transcribe):
+        return self.transduce_many([str_to_transcribe])[0]
+
+    def close(self):
+        if self.handle:
+            self.library.utf8transducer_delete(self.handle)
+            self.handle = None
+
+
 def get_g2p_transcription(str_to_transcribe, p):
     result = ''
     if p:
-        print >> p.stdin, from_utf8(str_to_transcribe)
-        result = p.stdout.readline().strip()
+        start_time = time.time()
+        if isinstance(p, InProcessTransducer):
+            result = p.transduce(str_to_transcribe)
+        elif isinstance(p, SupervisedProcess):
+            result = p.request(str_to_transcribe)
+        else:
+            print >> p.stdin, from_utf8(str_to_transcribe)
+            result = p.stdout.readline().strip()
+        transcription_stats.add_time('g2p', time.time() - start_time)
     return result
 
 
+class G2PPipeline(object):
+    """
+    pipelined access to the transduce process: sentences are written to the process as soon as they are ready while a
+    reader thread collects the results, so that the preparation of the next sentences overlaps with the application of
+    the G2P FSTs. At most window sentences are kept in flight; finished sentences are returned in input order. With an
+    InProcessTransducer, the sentences of the window are transduced together in one call instead; with a
+    SupervisedProcess, the supervisor reads the results
+    """
+
+    def __init__(self, g2p_process, window=16):
+        super(G2PPipeline, self).__init__()
+        self.g2p_process = g2p_process
+        self.window = max(window, 1)
+        self.pending = collections.deque()
+        self.ready = collections.deque()
+        self.in_process = isinstance(g2p_process, InProcessTransducer)
+        self.supervised = isinstance(g2p_process, SupervisedProcess)
+        self.unsent = []
+        self.results = queue.Queue()
+        if not self.in_process and not self.supervised:
+            self.reader = threading.Thread(target=self._read_results)
+            self.reader.daemon = True
+            self.reader.start()
+
+    def _read_results(self):
+        for line in iter(self.g2p_process.stdout.readline, ''):
+            self.results.put(line.strip())
+        self.results.put(None)  # the process has exited
+
+    def _get_result(self):
+        if not self.ready and self.in_process:
+            self.ready.extend(self.g2p_process.transduce_many(self.unsent))
+            self.unsent = []
+        if self.ready:
+            return self.ready.popleft()
+        if self.supervised:
+            return self.g2p_process.receive()
+        return self.results.get()
+
+    def _pop(self):
+        str_to_transcribe, data = self.pending.popleft()
+        result = ''
+        if str_to_transcribe:
+            start_time = time.time()
+            result = self._get_result()
+            transcription_stats.add_time('g2p', time.time() - start_time)  # waiting time only
+            if result is None:
+                self.results.put(None)
+                result = ''
+        return data, result
+
+    def submit(self, str_to_transcribe, data=None):
+        """
+        send a string to the transduce process (empty strings are not sent, but keep their place in the output order)
+        and return the list of (data, result) pairs of the sentences that left the window
+        """
+
+        if str_to_transcribe:
+            if self.in_process:
+                self.unsent.append(str_to_transcribe)
+            elif self.supervised:
+                self.g2p_process.send(str_to_transcribe)
+            else:
+                print >> self.g2p_process.stdin, from_utf8(str_to_transcribe)
+        self.pending.append((str_to_transcribe, data))
+        finished = []
+        while len(self.pending) > self.window:
+            finished.append(self._pop())
+        return finished
+
+    def flush(self):
+        finished = []
+        while self.pending:
+            finished.append(self._pop())
+        return finished
+
+    def transcribe_now(self, str_to_transcribe):
+        """
+        transcribe a string without waiting for its turn: the results of the sentences in flight are kept until they
+        leave the window
+        """
+
+        if self.in_process:
+            return get_g2p_transcription(str_to_transcribe, self.g2p_process)
+        if self.supervised:
+            in_flight = len([s for s, _ in self.pending if s]) - len(self.ready)
+            for _ in range(in_flight):
+                self.ready.append(self.g2p_process.receive())
+            return get_g2p_transcription(str_to_transcribe, self.g2p_process)
+        print >> self.g2p_process.stdin, from_utf8(str_to_transcribe)
+        start_time = time.time()
+        in_flight = len([s for s, _ in self.pending if s]) - len(self.ready)
+        for _ in range(in_flight):
+            result = self.results.get()
+            self.ready.append(result)
+            if result is None:
+                self.results.put(None)
+                break
+        result = self.results.get()
+        transcription_stats.add_time('g2p', time.time() - start_time)
+        if result is None:
+            self.results.put(None)
+            result = ''
+        return result
+
+
+def get_stress_prediction_command(stress_prediction_file, input_file='/dev/stdin'):
+    return ['phonetisaurus-g2p-omega', '--decoder_type=fst_phi', '--model=' + stress_prediction_file, '--isfile',
+            '--input=' + input_file]
+
+
+def is_stress_prediction_reply(word, reply):
+    # Phonetisaurus repeats the word at the beginning of its output line
+    return reply.split(None, 1)[:1] == [from_utf8(word).strip()]
+
+
 def get_stress_prediction(word, stress_prediction_model):
     in_pat = re.compile(r'^[^ ]+\s+[\d.]+\s+(.+)$')
     result = ''
     if stress_prediction_model:
-        print >> stress_prediction_model.stdin, from_utf8(word)
-        result = stress_prediction_model.stdout.readline().strip()
+        start_time = time.time()
+        if isinstance(stress_prediction_model, SupervisedProcess):
+            result = stress_prediction_model.request(word)
+        else:
+            print >> stress_prediction_model.stdin, from_utf8(word)
+            result = stress_prediction_model.stdout.readline().strip()
+        transcription_stats.add_time('stress_prediction', time.time() - start_time)
     m = in_pat.match(result)
     if m:
         result = to_utf8(m.group(1).replace(' ', '').replace('|', '').strip())
     return result
 
 
+def get_stress_predictions(words, stress_prediction_file, scores=False):
+    """
+    predict the stress of a list of words in one single Phonetisaurus run, passing the words to it in a temporary
+    file instead of word by word through the pipe of the stress prediction process. Returns a dictionary that maps every
+    word to its predicted stress string (to a (stress string, score) pair with scores, the score being the cost of the
+    prediction: the lower, the more confident). Words for which Phonetisaurus did not return anything are not in the
+    dictionary
+    """
+
+    out_pat = re.compile(r'^([^\s]+)\s+([\d.]+)\s+(.+)$')
+    predictions = {}
+    if not words:
+        return predictions
+    start_time = time.time()
+    words_file = tempfile.NamedTemporaryFile(suffix='.words', delete=False)
+    try:
+        for word in words:
+            words_file.write(from_utf8(word) + '\n')
+        words_file.close()
+        dev_null = open(os.devnull, 'wb')
+        try:
+            p = subprocess.Popen(get_stress_prediction_command(stress_prediction_file, words_file.name),
+                                 stdout=subprocess.PIPE, stderr=dev_null)
+        except OSError:
+            raise PhonetisaurusInitializationError
+        for line in p.stdout:
+            m = out_pat.match(line.strip())
+            if m:
+                stress_str = to_utf8(m.group(3).replace(' ', '').replace('|', '').strip())
+                if scores:
+                    stress_str = (stress_str, float(m.group(2)))
+                predictions[to_utf8(m.group(1))] = stress_str
+        p.wait()
+        dev_null.close()
+    finally:
+        os.unlink(words_file.name)
+    transcription_stats.add_time('batch_stress_prediction', time.time() - start_time)
+    transcription_stats.count('batch_predicted_words', len(words))
+    return predictions
+
+
+class PersistentCache(object):
+    """
+    bounded LRU dictionary kept in memory, optionally backed by a database on disk that is consulted when an entry is
+    not found in memory. Subclasses define how the values are stored in the database. Empty values (the reply of a
+    supervised process that gave up a request, see SupervisedProcess) are never stored, and are misses when found
+    """
+
+    name = 'cache'
+
+    def __init__(self, file_name=None, max_size=100000):
+        super(PersistentCache, self).__init__()
+        self.file_name = file_name
+        self.db = None
+        if file_name:
+            if not os.path.isdir(os.path.dirname(file_name)):
+                os.makedirs(os.path.dirname(file_name))
+            self.db = dbm.open(file_name, 'c')
+        self.max_size = max_size
+        self.lru = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.new_entries = 0
+
+    def encode_value(self, value):
+        return from_utf8(value)
+
+    def decode_value(self, value):
+        return to_utf8(value)
+
+    def _remember(self, key, value):
+        self.lru[key] = value
+        if len(self.lru) > self.max_size:
+            self.lru.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self.lru or (self.db is not None and from_utf8(key) in self.db)
+
+    def get(self, key, default=None):
+        value = self.lru.pop(key, None)
+        if value is None and self.db is not None:
+            db_key = from_utf8(key)
+            if db_key in self.db:
+                value = self.decode_value(self.db[db_key])
+        if value is None or value == '':
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._remember(key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        if value == '':
+            return
+        if self.db is not None:
+            db_key = from_utf8(key)
+            if db_key not in self.db:
+                self.new_entries += 1
+            self.db[db_key] = self.encode_value(value)
+        elif key not in self.lru:
+            self.new_entries += 1
+        self._remember(key, value)
+
+    def update(self, entries):
+        for key, value in entries.items():
+            self[key] = value
+
+    def get_stats(self):
+        return '{0}: {1} hits, {2} misses, {3} new entries'.format(self.name, self.hits, self.misses,
+                                                                   self.new_entries)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+
+
+class StressPredictionCache(PersistentCache):
+    """
+    persistent cache of stress predictions (word -> predicted stress string). The entries are stored on disk in a
+    database named after the content hash of the stress prediction model, so that replacing the model automatically
+    starts a new cache
+    """
+
+    name = 'stress prediction cache'
+
+    def __init__(self, cache_dir, model_hash, max_size=100000):
+        super(StressPredictionCache, self).__init__(os.path.join(cache_dir, 'stress-' + model_hash + '.db'),
+                                                    max_size)
+
+
+class SentenceCache(PersistentCache):
+    """
+    cache of sentence transcriptions (tokenized sentence -> (log messages, sentence transcription), followed by the
+    words of the aligned output when it is written, see get_aligned_words). The log messages are the ones written after
+    the tokenization of the sentence. The optional database on disk is named after the
+    combined hash of all resources (see get_combined_hash), so that any change of the lexica, models or FSTs starts a
+    new cache
+    """
+
+    name = 'sentence cache'
+
+    def __init__(self, cache_dir=None, resources_hash=None, max_size=10000):
+        file_name = None
+        if cache_dir:
+            file_name = os.path.join(cache_dir, 'sentences-' + resources_hash + '.db')
+        super(SentenceCache, self).__init__(file_name, max_size)
+
+    def encode_value(self, value):
+        return json.dumps(value)
+
+    def decode_value(self, value):
+        value = json.loads(value)
+        messages, sentence_transcription = value[:2]
+        return ([from_utf8(msg) for msg in messages], from_utf8(sentence_transcription)) + tuple(value[2:])
+
+
+def split_pos_marker(token):
+    for marker in g2p_pos_markers:
+        if token.startswith(marker):
+            return marker, token[len(marker):]
+    return '', token
+
+
+def get_g2p_contexts(tokens):
+    """
+    context of every token of a line to transcribe that the G2P rules can see across word boundaries: (left context,
+    right context, index of the first token, index after the last token the contexts are taken from). The left context
+    is the end of the previous word from its last vowel on (with the stress mark before it), the right context the
+    beginning of the next word up to its first vowel; words without vowels are included entirely and the context goes
+    on with the word after them. A context stops at SIL or at the sentence boundary ([BOS], [EOS])
+    """
+
+    heads = []
+    tails = []
+    for token in tokens:
+        marker, text = split_pos_marker(token)
+        # the function word marker contains a vowel letter
+        vowel_positions = [i for i, char in enumerate(text.replace(g2p_word_marker, ' ' * len(g2p_word_marker)))
+                           if char in g2p_context_vowels]
+        if token == SIL or not vowel_positions:
+            heads.append(None)
+            tails.append(None)
+        else:
+            heads.append(marker + text[:vowel_positions[0] + 1])
+            last_vowel = vowel_positions[-1]
+            if last_vowel > 0 and text[last_vowel - 1] == '+':
+                last_vowel -= 1
+            tails.append(marker + text[last_vowel:])
+    contexts = []
+    for i in range(len(tokens)):
+        left = []
+        first = i - 1
+        while first >= 0:
+            if tokens[first] == SIL or tails[first] is not None:
+                left.append(tails[first] or SIL)
+                break
+            left.append(tokens[first])
+            first -= 1
+        else:
+            left.append('[BOS]')
+            first = 0
+        right = []
+        last = i + 1
+        while last < len(tokens):
+            if tokens[last] == SIL or heads[last] is not None:
+                right.append(heads[last] or SIL)
+                break
+            right.append(tokens[last])
+            last += 1
+        else:
+            right.append('[EOS]')
+            last = len(tokens) - 1
+        contexts.append((' '.join(reversed(left)), ' '.join(right), first, last + 1))
+    return contexts
+
+
+class G2PWordCache(PersistentCache):
+    """
+    cache of the output of the G2P FSTs for every word of the lines to transcribe. The key of a word is its stress
+    string together with its left and right context (see get_g2p_contexts), which covers everything the cross-word
+    rules of the grammars depend on, so that the output of a sentence put together from the cache is the same as the
+    one of the whole sentence. Only the part of a sentence with words not found in the cache (and their contexts) is
+    sent to the FSTs. The optional database on disk is named after the hash of the G2P FSTs (see get_g2p_hash)
+    """
+
+    name = 'G2P word cache'
+
+    def __init__(self, cache_dir=None, g2p_hash=None, max_size=100000):
+        file_name = None
+        if cache_dir:
+            file_name = os.path.join(cache_dir, 'g2p-words-' + g2p_hash + '.db')
+        super(G2PWordCache, self).__init__(file_name, max_size)
+
+    @staticmethod
+    def get_keys(tokens, contexts):
+        return [left + '\t' + token + '\t' + right for token, (left, right, _, _) in zip(tokens, contexts)]
+
+    def prepare(self, line_to_transcribe):
+        """
+        look up the words of a line to transcribe. Returns the string to be sent to the G2P FSTs ('' if all words are
+        cached) and the data needed by complete() to put the G2P output of the line together
+        """
+
+        tokens = line_to_transcribe.split()
+        contexts = get_g2p_contexts(tokens)
+        keys = self.get_keys(tokens, contexts)
+        outputs = [self.get(key) for key in keys]
+        missing = [i for i, output in enumerate(outputs) if output is None]
+        if not missing:
+            transcription_stats.count('g2p_cached_sentences')
+            return '', (tokens, keys, outputs, 0, 0)
+        first = min(contexts[i][2] for i in missing)
+        last = max(contexts[i][3] for i in missing)
+        transcription_stats.count('g2p_transduced_words', last - first)
+        return ' '.join(tokens[first:last]) + ' ', (tokens, keys, outputs, first, last)
+
+    def complete(self, g2p_data, g2p_result):
+        """
+        G2P output of the whole line from the cached words and the G2P output of the string returned by prepare(), or
+        None if this output does not have one word per word sent
+        """
+
+        tokens, keys, outputs, first, last = g2p_data
+        span_outputs = g2p_result.split()
+        if len(span_outputs) == last - first:
+            span_tokens = tokens[first:last]
+            # the words of the span that have the same contexts as in the whole line
+            for i, (key, output) in enumerate(zip(self.get_keys(span_tokens, get_g2p_contexts(span_tokens)),
+                                                  span_outputs)):
+                if key == keys[first + i]:
+                    if outputs[first + i] is None:
+                        self[key] = output
+                    outputs[first + i] = output
+        if None in outputs:
+            return None
+        return from_utf8(' '.join(outputs))
+
+
+def read_dictionary(options_dictionary, log_errors=False):
+    """
+    generator returning the (ortho, phono) pairs of a simple dictionary file
+    """
+
+    errors_found = False
+    if log_errors:
+        log_file_name = options_dictionary + '.log'
+        log_file = open(log_file_name, 'w')
+    else:
+        log_file_name = ''
+        log_file = None
+    sys.stdout.write('Loading lexicon: ' + options_dictionary + '\n')
+    dictionary_line = re.compile(r'^([^\s]+)\t([^\s]+)')
+    line_num = 0
+    for line in open(options_dictionary, 'r'):
+        line_num += 1
+        line = line.strip()
+        if not line.startswith('#'):  # ignore line comments
+            m = dictionary_line.match(line)
+            if m:
+                ortho = to_utf8(m.group(1))
+                # if there is more than one transcription, just take arbitrarily the first one
+                # this can happen in very few cases (mostly in the so called "hyphen-homographs")
+                phono = to_utf8(m.group(2)).replace(' ', '').split(',')[0]
+                if not is_valid_transcription(phono) and log_errors:
+                    log_file.write("[WARNING] transcription not valid in line: " + str(line_num) + '\n')
+                    errors_found = True
+                yield ortho, phono
+            else:
+                if line:  # ignore empty lines
+                    sys.stderr.write('[ERROR] cannot parse line number: ' + str(line_num) + '\n')
+    if errors_found and log_errors:
+        sys.stderr.write('\nErrors found while reading dictionary file\n')
+        sys.stderr.write('Review log file "' + log_file_name + '" and correct the errors\n')
+        log_file.close()
+        sys.exit(1)
+    else:
+        if log_errors:
+            log_file.close()
+            os.unlink(log_file_name)
+
+
 class LexEntries(object):
     def __init__(self):
         super(LexEntries, self).__init__()
@@ -118,42 +958,8 @@ class LexEntries(object):
 
     def load_dictionary(self, options_dictionary, log_errors=False):
         self.lex_entries = {}  # reload entries
-        errors_found = False
-        if log_errors:
-            log_file_name = options_dictionary + '.log'
-            log_file = open(log_file_name, 'w')
-        else:
-            log_file_name = ''
-            log_file = None
-        sys.stdout.write('Loading lexicon: ' + options_dictionary + '\n')
-        dictionary_line = re.compile(r'^([^\s]+)\t([^\s]+)')
-        line_num = 0
-        for line in open(options_dictionary, 'r'):
-            line_num += 1
-            line = line.strip()
-            if not line.startswith('#'):  # ignore line comments
-                m = dictionary_line.match(line)
-                if m:
-                    ortho = to_utf8(m.group(1))
-                    # if there is more than one transcription, just take arbitrarily the first one
-                    # this can happen in very few cases (mostly in the so called "hyphen-homographs")
-                    phono = to_utf8(m.group(2)).replace(' ', '').split(',')[0]
-                    if not is_valid_transcription(phono) and log_errors:
-                        log_file.write("[WARNING] transcription not valid in line: " + str(line_num) + '\n')
-                        errors_found = True
-                    self.lex_entries[ortho] = LexEntry(ortho, phono)
-                else:
-                    if line:  # ignore empty lines
-                        sys.stderr.write('[ERROR] cannot parse line number: ' + str(line_num) + '\n')
-        if errors_found and log_errors:
-            sys.stderr.write('\nErrors found while reading dictionary file\n')
-            sys.stderr.write('Review log file "' + log_file_name + '" and correct the errors\n')
-            log_file.close()
-            sys.exit(1)
-        else:
-            if log_errors:
-                log_file.close()
-                os.unlink(log_file_name)
+        for ortho, phono in read_dictionary(options_dictionary, log_errors):
+            self.lex_entries[ortho] = LexEntry(ortho, phono)
 
     def get_transcription(self, ortho, pos_feats=GEN_POS):
         if ortho in self.lex_entries:
@@ -185,6 +991,60 @@ class LexEntry(object):
         return self.pos_feats_phono.get(pos_feats)
 
 
+def read_homographs(options_homographs, log_errors=False):
+    """
+    generator returning the (freq, ortho, pos, feats, phono, lex) tuples of a homographs file
+    """
+
+    sys.stdout.write('Loading homographs dictionary...\n')
+    errors_found = False
+    if log_errors:
+        log_file_name = options_homographs + '.log'
+        log_file = open(log_file_name, 'w')
+    else:
+        log_file_name = ''
+        log_file = None
+    dictionary_line1 = re.compile(r'^(\d+)\s+([^\s]+)\s+([^(]+)\(([^)]*)\)\s+\[([^]]+)](?:\s+LEX(\d))?$')
+    line_num = 0
+    for line in open(options_homographs, 'r'):
+        line_num += 1
+        line = line.strip()
+        m1 = dictionary_line1.match(line)
+        if m1:
+            freq = m1.group(1)
+            ortho = to_utf8(m1.group(2))
+            pos = m1.group(3).lower()
+            feats = m1.group(4).replace(' ', '').split(',')
+            raw_phono = to_utf8(m1.group(5))
+            # check that the transcription contains valid characters
+            for single_phono in raw_phono.replace(' ', '').split(','):
+                if not is_valid_transcription(single_phono) and log_errors:
+                    log_file.write("[WARNING] transcription not valid in line: " + str(line_num) + '\n')
+                    errors_found = True
+            transcriptions = raw_phono.replace(' ', '').split(',')
+            # we take the first transcription in the list (transcriptions are ordered by relevance)
+            phono = transcriptions[0]
+            lex = m1.group(6)
+            if pos not in HomographEntries.valid_pos or HomographEntries.invalid_feat_found(feats) and log_errors:
+                log_file.write('invalid tags found in line:\t' + str(line_num) + '\n')
+                errors_found = True
+            else:
+                yield freq, ortho, pos, feats, phono, lex
+        else:
+            if log_errors:
+                log_file.write('error while parsing line:\t' + str(line_num) + '\n')
+                errors_found = True
+    if errors_found and log_errors:
+        sys.stderr.write('\nErrors found while reading homographs file\n')
+        sys.stderr.write('Review log file "' + log_file_name + '" and correct the errors\n')
+        log_file.close()
+        sys.exit(1)
+    else:
+        if log_errors:
+            log_file.close()
+            os.unlink(log_file_name)
+
+
 class HomographEntries(object):
     valid_pos = {"adj": True, "adv": True, "cnj": True, "dee": True,
                  "inj": True, "inv": True, "nn": True, "num": True,
@@ -225,90 +1085,90 @@ class HomographEntries(object):
     def __init__(self):
         super(HomographEntries, self).__init__()
         self.homograph_entries = {}
+        # disambiguation index: ortho -> (different_transcriptions_found, {pos: [(feats_mask, feats, phono)]},
+        # (phono, feats) of the fallback when the disambiguation fails). Built by load_homographs for all entries,
+        # and on first lookup for entries coming from elsewhere (compact and snapshot lexica)
+        self.disambiguation_index = {}
+        # bit of every feature in the feature masks (the empty feature of "()" tags counts as a feature)
+        self.feat_bits = dict((feat, 1 << bit) for bit, feat in enumerate([''] + sorted(HomographEntries.valid_feats)))
+        self.parsed_pos_feats = {}
 
     def load_homographs(self, options_homographs, log_errors=False):
-        sys.stdout.write('Loading homographs dictionary...\n')
-        errors_found = False
-        if log_errors:
-            log_file_name = options_homographs + '.log'
-            log_file = open(log_file_name, 'w')
-        else:
-            log_file_name = ''
-            log_file = None
-        dictionary_line1 = re.compile(r'^(\d+)\s+([^\s]+)\s+([^(]+)\(([^)]*)\)\s+\[([^]]+)](?:\s+LEX(\d))?$')
-        line_num = 0
-        for line in open(options_homographs, 'r'):
-            line_num += 1
-            line = line.strip()
-            m1 = dictionary_line1.match(line)
-            if m1:
-                freq = m1.group(1)
-                ortho = to_utf8(m1.group(2))
-                pos = m1.group(3).lower()
-                feats = m1.group(4).replace(' ', '').split(',')
-                raw_phono = to_utf8(m1.group(5))
-                # check that the transcription contains valid characters
-                for single_phono in raw_phono.replace(' ', '').split(','):
-                    if not is_valid_transcription(single_phono) and log_errors:
-                        log_file.write("[WARNING] transcription not valid in line: " + str(line_num) + '\n')
-                        errors_found = True
-                transcriptions = raw_phono.replace(' ', '').split(',')
-                # we take the first transcription in the list (transcriptions are ordered by relevance)
-                phono = transcriptions[0]
-                lex = m1.group(6)
-                if pos not in HomographEntries.valid_pos or HomographEntries.invalid_feat_found(feats) and log_errors:
-                    log_file.write('invalid tags found in line:\t' + str(line_num) + '\n')
-                    errors_found = True
-                else:
-                    if ortho in self.homograph_entries:
-                        homograph_entry = self.homograph_entries.get(ortho)
-                        homograph_entry.update_entry(freq, pos, feats, phono, lex)
-                        self.homograph_entries[ortho] = homograph_entry
-                    else:
-                        self.homograph_entries[ortho] = HomographEntry(freq, ortho, pos, feats, phono, lex)
+        for freq, ortho, pos, feats, phono, lex in read_homographs(options_homographs, log_errors):
+            if ortho in self.homograph_entries:
+                homograph_entry = self.homograph_entries.get(ortho)
+                homograph_entry.update_entry(freq, pos, feats, phono, lex)
+                self.homograph_entries[ortho] = homograph_entry
             else:
-                if log_errors:
-                    log_file.write('error while parsing line:\t' + str(line_num) + '\n')
-                    errors_found = True
-        if errors_found and log_errors:
-            sys.stderr.write('\nErrors found while reading homographs file\n')
-            sys.stderr.write('Review log file "' + log_file_name + '" and correct the errors\n')
-            log_file.close()
-            sys.exit(1)
-        else:
-            if log_errors:
-                log_file.close()
-                os.unlink(log_file_name)
+                self.homograph_entries[ortho] = HomographEntry(freq, ortho, pos, feats, phono, lex)
+        self.disambiguation_index = {}
+        for ortho, homograph_entry in self.homograph_entries.items():
+            self.disambiguation_index[ortho] = self.get_disambiguation_entry(homograph_entry)
+
+    def get_feats_mask(self, feats):
+        mask = 0
+        for feat in feats:
+            if feat not in self.feat_bits:
+                # only with unchecked tags (see read_homographs); the masks of parsed POS tags must be recomputed
+                self.feat_bits[feat] = 1 << len(self.feat_bits)
+                self.parsed_pos_feats = {}
+            mask |= self.feat_bits[feat]
+        return mask
+
+    def get_disambiguation_entry(self, homograph_entry):
+        pos_buckets = {}
+        for idx, (pos, feats) in enumerate(homograph_entry.get_pos_feats()):
+            pos_buckets.setdefault(pos, []).append((self.get_feats_mask(feats), feats, homograph_entry.get_phono(idx)))
+        return (homograph_entry.different_transcriptions_found, pos_buckets,
+                homograph_entry.get_most_frequent_phono())
+
+    def parse_pos_feats(self, pos_feats):
+        """
+        (POS, features, features mask) of a POS[/feature...] tag
+        """
+
+        if pos_feats not in self.parsed_pos_feats:
+            pos_feats_list = pos_feats.split('/')
+            target_feats = pos_feats_list[1:]
+            target_mask = 0
+            for feat in target_feats:
+                target_mask |= self.feat_bits.get(feat, 0)
+            self.parsed_pos_feats[pos_feats] = (pos_feats_list[0], target_feats, target_mask)
+        return self.parsed_pos_feats[pos_feats]
 
     def get_transcription(self, ortho, pos_feats):
         phono = ''
         best_feats = []
-        if ortho in self.homograph_entries:
-            homograph_entry = self.homograph_entries.get(ortho)
+        index_entry = self.disambiguation_index.get(ortho)
+        if index_entry is None and ortho in self.homograph_entries:
+            index_entry = self.get_disambiguation_entry(self.homograph_entries.get(ortho))
+            self.disambiguation_index[ortho] = index_entry
+        if index_entry is not None:
+            different_transcriptions_found, pos_buckets, most_frequent = index_entry
             if pos_feats:
-                pos_feats_list = pos_feats.split('/')
-                target_pos = pos_feats_list[0]
-                target_feats = pos_feats_list[1:]
-                idx = 0
-                feats_phono = []
-                matched_pos = ''
-                for pos, feats in homograph_entry.get_pos_feats():
-                    if pos == target_pos:
-                        feats_phono.append((feats, homograph_entry.get_phono(idx)))
-                        matched_pos = pos
-                    idx += 1
-                if feats_phono:
-                    if not homograph_entry.different_transcriptions_found:
-                        phono = feats_phono[0][1]
+                target_pos, target_feats, target_mask = self.parse_pos_feats(pos_feats)
+                candidates = pos_buckets.get(target_pos)
+                if candidates:
+                    if not different_transcriptions_found:
+                        phono = candidates[0][2]
                         best_feats = ['NOT_HOMOGRAPH (getting single transcription)']
-                    elif len(feats_phono) == 1:
-                        phono = feats_phono[0][1]
-                        best_feats = [matched_pos]
+                    elif len(candidates) == 1:
+                        phono = candidates[0][2]
+                        best_feats = [target_pos]
                     else:
-                        phono, best_feats = HomographEntries.get_phono_from_intersection(target_feats, feats_phono)
+                        # first candidate with the most features in common (see get_phono_from_intersection)
+                        best_intersection = 0
+                        for feats_mask, feats, candidate_phono in candidates:
+                            intersection = bin(feats_mask & target_mask).count('1')
+                            if intersection > best_intersection:
+                                phono = candidate_phono
+                                best_feats = feats
+                                best_intersection = intersection
+                        if best_intersection:
+                            best_feats = list(set(target_feats) & set(best_feats))
             # values in case disambiguation below was not successful
             if not phono:
-                phono, best_feats = homograph_entry.get_most_frequent_phono()
+                phono, best_feats = most_frequent[0], list(most_frequent[1])
         return phono, best_feats
 
 
@@ -367,77 +1227,677 @@ class HomographEntry(object):
             return self.phono[most_frequent_idx], ["FREQ"]
 
 
-sil_punct_symbols = ',;:'
-other_punct_symbols = to_utf8('.?"!\'«»')
+# codes of the transcriptions encoded relative to their word (see encode_phono)
+PHONO_SAME_AS_ORTHO = -1
+PHONO_EXPLICIT = -2 ** 31
 
 
-def tokenize_sentence(sentence, yo_words, tlog):
-    russian_input = re.compile(to_utf8('[а-яА-ЯёЁ{0}]+').format(sil_punct_symbols + other_punct_symbols + ' -'))
-    m = russian_input.match(sentence)
-    if m:
-        tokenized_sentence = sentence.lower()
+def encode_phono(ortho, phono):
+    """
+    encode a transcription relative to its word: PHONO_SAME_AS_ORTHO, position p >= 0 of the stress mark ('+' inserted
+    in the word) or -2 - p for a letter <yo> restored at position p. Returns None for any other transcription
+    """
+
+    if phono == ortho:
+        return PHONO_SAME_AS_ORTHO
+    pos = phono.find('+')
+    if pos >= 0 and phono[:pos] + phono[pos + 1:] == ortho:
+        return pos
+    pos = phono.find(to_utf8('ё'))
+    if pos >= 0 and phono[:pos] + to_utf8('е') + phono[pos + 1:] == ortho:
+        return -2 - pos
+    return None
+
+
+def decode_phono(ortho, code):
+    if code == PHONO_SAME_AS_ORTHO:
+        return ortho
+    elif code >= 0:
+        return ortho[:code] + '+' + ortho[code:]
+    else:
+        pos = -2 - code
+        return ortho[:pos] + to_utf8('ё') + ortho[pos + 1:]
+
+
+class CompactLexEntries(LexEntries):
+    """
+    low-memory variant of LexEntries. The words of a loaded dictionary are kept in one sorted UTF-8 string table with
+    offsets, and their transcriptions as codes relative to the word (see encode_phono). Only the transcriptions that
+    cannot be encoded are kept as strings. Entries added with add_entry are kept as LexEntry objects
+    """
+
+    def __init__(self):
+        super(CompactLexEntries, self).__init__()
+        self.orthos = ''
+        self.offsets = array.array('I', [0])
+        self.codes = array.array('i')
+        self.explicit_phonos = {}
+
+    def load_dictionary(self, options_dictionary, log_errors=False):
+        self.lex_entries = {}  # reload entries
+        entries = {}
+        for ortho, phono in read_dictionary(options_dictionary, log_errors):
+            entries[ortho] = phono
+        orthos = []
+        self.offsets = array.array('I', [0])
+        self.codes = array.array('i')
+        self.explicit_phonos = {}
+        for idx, ortho in enumerate(sorted(entries, key=from_utf8)):
+            phono = entries.pop(ortho)
+            code = encode_phono(ortho, phono)
+            if code is None:
+                code = PHONO_EXPLICIT
+                self.explicit_phonos[idx] = phono
+            orthos.append(from_utf8(ortho))
+            self.offsets.append(self.offsets[-1] + len(orthos[-1]))
+            self.codes.append(code)
+        self.orthos = ''.join(orthos)
+
+    def find_entry(self, ortho):
+        key = from_utf8(ortho)
+        lo = 0
+        hi = len(self.codes)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.orthos[self.offsets[mid]:self.offsets[mid + 1]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.codes) and self.orthos[self.offsets[lo]:self.offsets[lo + 1]] == key:
+            return lo
+        return -1
+
+    def get_transcription(self, ortho, pos_feats=GEN_POS):
+        if ortho in self.lex_entries:
+            return super(CompactLexEntries, self).get_transcription(ortho, pos_feats)
+        idx = self.find_entry(ortho)
+        if idx < 0:
+            return ''
+        if pos_feats != GEN_POS:  # loaded entries have only the generic POS (see LexEntry.get_phono)
+            return None
+        if idx in self.explicit_phonos:
+            return self.explicit_phonos[idx]
+        return decode_phono(ortho, self.codes[idx])
+
+    def has_entry(self, ortho):
+        return ortho in self.lex_entries or self.find_entry(ortho) >= 0
+
+    def get_entries_num(self):
+        return len(self.codes) + len([ortho for ortho in self.lex_entries if self.find_entry(ortho) < 0])
+
+
+class CompactHomographEntry(object):
+    """
+    low-memory variant of HomographEntry with the same interface: one tuple (freq, pos, feats, phono, lex) per variant,
+    with the transcription encoded relative to the word whenever possible (see encode_phono)
+    """
+
+    __slots__ = ('ortho', 'variants', 'different_transcriptions_found')
+
+    def __init__(self, freq, ortho, pos, feats, phono, lex):
+        self.ortho = ortho
+        self.variants = ()
+        self.different_transcriptions_found = False
+        self.add_variant(freq, pos, feats, phono, lex)
+
+    def add_variant(self, freq, pos, feats, phono, lex):
+        code = encode_phono(self.ortho, phono)
+        self.variants += ((freq, pos, feats, phono if code is None else code, lex),)
+
+    def update_entry(self, freq, pos, feats, phono, lex):
+        if phono not in [self.get_phono(idx) for idx in range(len(self.variants))]:
+            self.different_transcriptions_found = True
+        self.add_variant(freq, pos, feats, phono, lex)
+
+    def get_pos_feats(self):
+        return [(variant[1], variant[2]) for variant in self.variants]
+
+    def get_phono(self, idx):
+        phono = self.variants[idx][3]
+        if isinstance(phono, int):
+            return decode_phono(self.ortho, phono)
+        return phono
+
+    def get_most_frequent_phono(self):
+        lex = [variant[4] for variant in self.variants]
+        if "1" in lex:
+            return self.get_phono(lex.index("1")), ["LEX1"]
+        elif len(self.variants) == 1:
+            return self.get_phono(0), ["SINGLETON"]
+        else:
+            most_frequent_idx = HomographEntry.get_highest_freq_idx([variant[0] for variant in self.variants])
+            return self.get_phono(most_frequent_idx), ["FREQ"]
+
+
+class CompactHomographEntries(HomographEntries):
+    """
+    low-memory variant of HomographEntries: CompactHomographEntry objects, with the POS and feature tags shared among
+    all entries
+    """
+
+    def load_homographs(self, options_homographs, log_errors=False):
+        tags = {}
+        for freq, ortho, pos, feats, phono, lex in read_homographs(options_homographs, log_errors):
+            pos = tags.setdefault(pos, pos)
+            feats = tuple(feats)
+            feats = tags.setdefault(feats, feats)
+            if ortho in self.homograph_entries:
+                self.homograph_entries[ortho].update_entry(freq, pos, feats, phono, lex)
+            else:
+                self.homograph_entries[ortho] = CompactHomographEntry(freq, ortho, pos, feats, phono, lex)
+
+
+class SnapshotTable(object):
+    """
+    read-only dictionary-like view (ortho -> entry) of one lexicon table of a memory-mapped lexica snapshot. The table
+    is an open addressing hash table over the UTF-8 encoded words (see write_snapshot_table). Entries are decoded on
+    first access, and kept afterwards
+    """
+
+    def __init__(self, mm, offset, decode_entry):
+        super(SnapshotTable, self).__init__()
+        self.mm = mm
+        self.entries_num, self.slots_num = struct.unpack_from('<II', mm, offset)
+        self.slots_offset = offset + 8
+        self.offsets_offset = self.slots_offset + 4 * self.slots_num
+        self.records_offset = self.offsets_offset + 4 * (self.entries_num + 1)
+        self.decode_entry = decode_entry
+        self.decoded_entries = {}
+
+    def find_record(self, ortho):
+        if not self.slots_num:
+            return None
+        key = from_utf8(ortho)
+        mask = self.slots_num - 1
+        slot = zlib.crc32(key) & mask
+        while True:
+            record_idx, = struct.unpack_from('<I', self.mm, self.slots_offset + 4 * slot)
+            if not record_idx:
+                return None
+            start, end = struct.unpack_from('<II', self.mm, self.offsets_offset + 4 * (record_idx - 1))
+            record_key, value = self.mm[self.records_offset + start:self.records_offset + end].split('\t', 1)
+            if record_key == key:
+                return value
+            slot = (slot + 1) & mask
+
+    def get(self, ortho, default=None):
+        if ortho in self.decoded_entries:
+            entry = self.decoded_entries[ortho]
+        else:
+            value = self.find_record(ortho)
+            entry = None
+            if value is not None:
+                entry = self.decode_entry(ortho, value)
+            self.decoded_entries[ortho] = entry
+        if entry is None:
+            return default
+        return entry
+
+    def __contains__(self, ortho):
+        return self.get(ortho) is not None
+
+    def __len__(self):
+        return self.entries_num
+
+
+def write_snapshot_table(out_file, records):
+    """
+    write a list of (word, value) pairs (UTF-8 encoded) as a snapshot table: number of entries and of hash slots,
+    hash slots (record index + 1, 0 for an empty slot), record offsets and records ('word \\t value')
+    """
+
+    slots_num = 1
+    while slots_num < 2 * len(records):
+        slots_num *= 2
+    if not records:
+        slots_num = 0
+    slots = [0] * slots_num
+    offsets = [0]
+    blob = []
+    for record_idx, (key, value) in enumerate(records):
+        slot = zlib.crc32(key) & (slots_num - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (slots_num - 1)
+        slots[slot] = record_idx + 1
+        blob.append(key + '\t' + value)
+        offsets.append(offsets[-1] + len(blob[-1]))
+    out_file.write(struct.pack('<II', len(records), slots_num))
+    out_file.write(struct.pack('<%dI' % slots_num, *slots))
+    out_file.write(struct.pack('<%dI' % len(offsets), *offsets))
+    out_file.write(''.join(blob))
+
+
+def decode_lex_entry(ortho, value):
+    return LexEntry(ortho, to_utf8(value))
+
+
+def decode_homograph_entry(ortho, value):
+    freq, phono, pos_feats, lex = json.loads(value)
+    homograph_entry = HomographEntry(freq[0], ortho, pos_feats[0][0], pos_feats[0][1], phono[0], lex[0])
+    for idx in range(1, len(freq)):
+        homograph_entry.update_entry(freq[idx], pos_feats[idx][0], pos_feats[idx][1], phono[idx], lex[idx])
+    return homograph_entry
+
+
+def get_snapshot_sources(hash_dict, general_lexicon=None, homographs_lexicon=None, user_lexicon=None, yo_list=None):
+    sources = {}
+    for name, lexicon in [('simple', general_lexicon), ('homographs', homographs_lexicon), ('user', user_lexicon),
+                          ('yo', yo_list)]:
+        if lexicon:
+            sources[name] = [os.path.realpath(lexicon), hash_dict[os.path.realpath(lexicon)]]
+        else:
+            sources[name] = None
+    # same representation as the one read back from the snapshot header
+    return json.loads(json.dumps(sources))
+
+
+def read_snapshot_header(snapshot_file):
+    if not os.path.exists(snapshot_file):
+        return None
+    with open(snapshot_file, 'rb') as fp:
+        if fp.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            return None
+        version, header_len = struct.unpack('<II', fp.read(8))
+        if version != SNAPSHOT_VERSION:
+            return None
+        header = json.loads(fp.read(header_len))
+        header['data_offset'] = len(SNAPSHOT_MAGIC) + 8 + header_len
+        return header
+
+
+def compile_lexica_snapshot(snapshot_file, sources, general_lexicon=None, homographs_lexicon=None, user_lexicon=None,
+                            yo_list=None):
+    """
+    load the lexica from their source files and write them to a binary snapshot file. The header of the snapshot
+    contains the hashes of the source files, used to decide whether the snapshot has to be rebuilt
+    """
+
+    sys.stdout.write('Compiling lexica snapshot: ' + snapshot_file + '\n')
+    lex_entries, homograph_entries, user_entries, yo_words = load_lexica(general_lexicon, homographs_lexicon,
+                                                                         user_lexicon, yo_list)
+    tables = []
+    invalid_entries = {}
+    for name, entries in [('simple', lex_entries), ('user', user_entries), ('yo', yo_words)]:
+        records = []
+        invalid_entries[name] = 0
+        for ortho in sorted(entries.lex_entries):
+            phono = entries.get_transcription(ortho)
+            if not is_valid_transcription(phono):
+                invalid_entries[name] += 1
+            records.append((from_utf8(ortho), from_utf8(phono)))
+        tables.append((name, records))
+    records = []
+    invalid_entries['homographs'] = 0
+    for ortho in sorted(homograph_entries.homograph_entries):
+        homograph_entry = homograph_entries.homograph_entries[ortho]
+        for phono in homograph_entry.phono:
+            if not is_valid_transcription(phono):
+                invalid_entries['homographs'] += 1
+        records.append((from_utf8(ortho), json.dumps([homograph_entry.freq, homograph_entry.phono,
+                                                      homograph_entry.pos_feats, homograph_entry.lex])))
+    tables.append(('homographs', records))
+    for name in sorted(invalid_entries):
+        if invalid_entries[name]:
+            sys.stderr.write('[WARNING] {0} transcriptions not valid in lexicon: {1}\n'.format(
+                invalid_entries[name], sources[name][0]))
+
+    # the offsets of the tables are relative to the end of the header
+    tables_data = io.BytesIO()
+    table_offsets = {}
+    for name, records in tables:
+        table_offsets[name] = tables_data.tell()
+        write_snapshot_table(tables_data, records)
+    header = json.dumps({'sources': sources, 'tables': table_offsets, 'invalid_entries': invalid_entries})
+    tmp_file_name = snapshot_file + '.' + str(os.getpid())
+    with open(tmp_file_name, 'wb') as out_file:
+        out_file.write(SNAPSHOT_MAGIC)
+        out_file.write(struct.pack('<II', SNAPSHOT_VERSION, len(header)))
+        out_file.write(header)
+        out_file.write(tables_data.getvalue())
+    os.rename(tmp_file_name, snapshot_file)
+
+
+def update_lexica_snapshot(snapshot_file, hash_dict, general_lexicon=None, homographs_lexicon=None, user_lexicon=None,
+                           yo_list=None):
+    """
+    rebuild the lexica snapshot if it does not exist, if it was written by another version of the snapshot format,
+    or if any of the source lexica changed
+    """
+
+    sources = get_snapshot_sources(hash_dict, general_lexicon, homographs_lexicon, user_lexicon, yo_list)
+    header = read_snapshot_header(snapshot_file)
+    if header is None or header['sources'] != sources:
+        compile_lexica_snapshot(snapshot_file, sources, general_lexicon, homographs_lexicon, user_lexicon, yo_list)
+
+
+def get_snapshot_hashes(snapshot_file):
+    """
+    hashes of the source lexica of a snapshot, as kept in its header (used instead of hashing the lexica when the
+    snapshot is attached)
+    """
+
+    header = read_snapshot_header(snapshot_file)
+    if header is None:
+        raise SnapshotNotFound(snapshot_file)
+    return dict((from_utf8(source[0]), from_utf8(source[1])) for source in header['sources'].values() if source)
+
+
+def load_lexica_snapshot(snapshot_file):
+    """
+    memory-map a lexica snapshot. The returned lexica answer the lookups directly from the mapped file. The file is
+    mapped read-only and shared, so all processes mapping the same snapshot share one copy of it in memory
+    """
+
+    sys.stdout.write('Loading lexica snapshot: ' + snapshot_file + '\n')
+    header = read_snapshot_header(snapshot_file)
+    if header is None:
+        raise SnapshotNotFound(snapshot_file)
+    with open(snapshot_file, 'rb') as fp:
+        mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    tables = dict((name, header['data_offset'] + offset) for name, offset in header['tables'].items())
+    lex_entries = LexEntries()
+    lex_entries.lex_entries = SnapshotTable(mm, tables['simple'], decode_lex_entry)
+    user_entries = LexEntries()
+    user_entries.lex_entries = SnapshotTable(mm, tables['user'], decode_lex_entry)
+    yo_words = LexEntries()
+    yo_words.lex_entries = SnapshotTable(mm, tables['yo'], decode_lex_entry)
+    homograph_entries = HomographEntries()
+    homograph_entries.homograph_entries = SnapshotTable(mm, tables['homographs'], decode_homograph_entry)
+    return lex_entries, homograph_entries, user_entries, yo_words
+
+
+def decode_stress_lexicon_entry(ortho, value):
+    score, stress_str = value.split('\t', 1)
+    return to_utf8(stress_str), float(score)
+
+
+def read_stress_lexicon_header(stress_lexicon_file):
+    if not os.path.exists(stress_lexicon_file):
+        return None
+    with open(stress_lexicon_file, 'rb') as fp:
+        if fp.read(len(STRESS_LEXICON_MAGIC)) != STRESS_LEXICON_MAGIC:
+            return None
+        version, header_len = struct.unpack('<II', fp.read(8))
+        if version != STRESS_LEXICON_VERSION:
+            return None
+        header = json.loads(fp.read(header_len))
+        header['data_offset'] = len(STRESS_LEXICON_MAGIC) + 8 + header_len
+        return header
+
+
+def compile_stress_lexicon(stress_lexicon_file, words_file, stress_prediction_file, model_hash, lexica, max_score=None):
+    """
+    predict the stress of all words of words_file (one word per line, anything after the word is ignored) in one
+    Phonetisaurus run, and write the predictions with their scores to a compiled stress lexicon (a snapshot table, see
+    write_snapshot_table, after a header with the hash of the model). The words are tokenized as in the sentences
+    (lowercase, <yo> restored); the words found in the lexica (lex_entries, homograph_entries, user_entries, yo_words)
+    and the predictions with a score above max_score (None for no limit) are left out
+    """
+
+    sys.stdout.write('Compiling stress lexicon: ' + stress_lexicon_file + '\n')
+    lex_entries, homograph_entries, user_entries, yo_words = lexica
+    words = get_oov_words((line.split(None, 1)[0] for line in open(words_file, 'r') if line.strip()), user_entries,
+                          lex_entries, homograph_entries, yo_words)
+    predictions = get_stress_predictions(sorted(words), stress_prediction_file, scores=True)
+    records = []
+    for word in sorted(predictions):
+        stress_str, score = predictions[word]
+        if max_score is not None and score > max_score:
+            continue
+        records.append((from_utf8(word), '{0!r}\t{1}'.format(score, from_utf8(stress_str))))
+    tables_data = io.BytesIO()
+    write_snapshot_table(tables_data, records)
+    header = json.dumps({'model': [os.path.realpath(stress_prediction_file), model_hash], 'max_score': max_score,
+                         'words': len(words), 'entries': len(records)})
+    tmp_file_name = stress_lexicon_file + '.' + str(os.getpid())
+    with open(tmp_file_name, 'wb') as out_file:
+        out_file.write(STRESS_LEXICON_MAGIC)
+        out_file.write(struct.pack('<II', STRESS_LEXICON_VERSION, len(header)))
+        out_file.write(header)
+        out_file.write(tables_data.getvalue())
+    os.rename(tmp_file_name, stress_lexicon_file)
+    sys.stdout.write('{0} words, {1} predictions stored, {2} above the score limit, {3} without prediction\n'.format(
+        len(words), len(records), len(predictions) - len(records), len(words) - len(predictions)))
+
+
+class StressLexicon(object):
+    """
+    memory-mapped compiled stress lexicon (see compile_stress_lexicon), looked up before the stress prediction model.
+    Predictions with a score above max_score (None for no limit) are not taken: these words are predicted live
+    """
+
+    def __init__(self, stress_lexicon_file, max_score=None):
+        super(StressLexicon, self).__init__()
+        header = read_stress_lexicon_header(stress_lexicon_file)
+        if header is None:
+            raise StressLexiconNotFound(stress_lexicon_file)
+        self.model_hash = header['model'][1]
+        self.max_score = max_score
+        with open(stress_lexicon_file, 'rb') as fp:
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.entries = SnapshotTable(mm, header['data_offset'], decode_stress_lexicon_entry)
+
+    def get_transcription(self, word):
+        entry = self.entries.get(word)
+        if entry is None or self.max_score is not None and entry[1] > self.max_score:
+            return None
+        return entry[0]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+sil_punct_symbols = ',;:'
+other_punct_symbols = to_utf8('.?"!\'«»')
+# compiled once for tokenize_sentence
+russian_input = re.compile(to_utf8('[а-яА-ЯёЁ{0}]+').format(sil_punct_symbols + other_punct_symbols + ' -'))
+# the ignored punctuation symbols are deleted and the remaining ones surrounded with whitespace by translate()
+ignored_punct_table = dict((ord(sym), None) for sym in other_punct_symbols)
+sil_punct_table = dict((ord(sym), to_utf8(' {0} ').format(sym)) for sym in sil_punct_symbols)
+whitespace = re.compile(r'\s+')
+multiple_spaces = re.compile(r'  +')
+transcription_error = '**ERROR, COULD NOT TRANSCRIBE**'
+
+
+def tokenize_sentence(sentence, yo_words, tlog, stats=transcription_stats):
+    start_time = time.time()
+    tokenized_sentence = ''
+    if russian_input.match(sentence):
         # delete (to be ignored in the transcription) some of the punctuation symbols
-        for sym in other_punct_symbols:
-            tokenized_sentence = tokenized_sentence.replace(sym, '')
+        tokenized_sentence = sentence.lower().translate(ignored_punct_table)
         # map syntactic hyphen to comma (",") to avoid conflicts with the lexical hyphen
         tokenized_sentence = tokenized_sentence.replace(' - ', ' , ')
-        # normalize remaining punctuation symbols (surround them with whitespace)
-        tokenized_sentence = re.sub(r'([{0}])'.format(sil_punct_symbols), r' \1 ', tokenized_sentence)
-        # normalize whitespace
-        tokenized_sentence = re.sub(r'\s+', r' ', tokenized_sentence)
+        # normalize remaining punctuation symbols (surround them with whitespace) and whitespace
+        tokenized_sentence = whitespace.sub(' ', tokenized_sentence.translate(sil_punct_table))
         # find yo words and restore them
-        tokenized_sent_with_restored_yo = ''
-        word_pos = 0
-        for word in tokenized_sentence.split(' '):
+        words = tokenized_sentence.split(' ')
+        for word_pos, word in enumerate(words):
             # a word containing 'ё' is supposed to be correctly written. Otherwise, we check if the word could have
             # been written with the letter 'ё' and if yes, we restore then the "correct" spelling
-            if (not to_utf8('ё') in word) and \
-                    (to_utf8('е') in word) and \
-                    yo_words.has_entry(word):
+            if ye_letter in word and yo_letter not in word and yo_words.has_entry(word):
                 word = yo_words.get_transcription(word)
                 tlog.info('[YOWR]\t%s', from_utf8(word))
-            tokenized_sent_with_restored_yo += word + ' '
-            word_pos += 1
-    else:
-        tokenized_sent_with_restored_yo = ''
-    return tokenized_sent_with_restored_yo.strip()
+                words[word_pos] = word
+                if stats:
+                    stats.count_source('yo_restoration')
+        tokenized_sentence = ' '.join(words).strip()
+    if stats:
+        stats.add_time('tokenization', time.time() - start_time)
+    return tokenized_sentence
 
 
-def get_pos_prediction(tokenized_sentence):
-    pos_predictor_available = False
+class PosTaggerInitializationError(Exception):
+    def __init__(self, pos_tagger):
+        sys.stderr.write('[ERROR] could not initialize POS tagger: ' + pos_tagger + '\n')
+
+
+class PosTagger(object):
+    """
+    POS tagger kept warm for the whole run, tagging batches of tokenized sentences. pos_tagger is either
+    'python:MODULE.FUNCTION', a callable of this process taking a list of sentences (every sentence a list of unicode
+    tokens) and returning one list of POS[/feature...] tags per sentence, or the command line of an external tagger
+    process. The process gets one request line per batch (sentences separated by tabs, tokens by spaces, UTF-8) and
+    answers with one line of tags in the same layout. A batch that is not tagged within timeout seconds (0 for no
+    limit), or whose tags do not match its tokens, falls back to GEN_POS; a hanging process is restarted for the next
+    batch, a hanging callable is not called again until it returns
+    """
+
+    def __init__(self, pos_tagger, batch_size=POS_BATCH_SIZE, timeout=POS_TIMEOUT):
+        super(PosTagger, self).__init__()
+        self.name = pos_tagger
+        self.batch_size = max(batch_size, 1)
+        self.timeout = timeout
+        self.function = None
+        self.process = None
+        self.busy = None  # thread of a call of the callable that did not return in time
+        try:
+            if pos_tagger.startswith('python:'):
+                module_name, function_name = pos_tagger[len('python:'):].rsplit('.', 1)
+                self.function = getattr(importlib.import_module(module_name), function_name)
+            else:
+                self.process = SupervisedProcess(shlex.split(pos_tagger), 'pos_tagger', timeout, retries=0)
+        except (ImportError, AttributeError, ValueError, OSError):
+            raise PosTaggerInitializationError(pos_tagger)
+
+    def _call_function(self, sentences):
+        if self.busy is not None and self.busy.is_alive():
+            return None
+        result = []
+
+        def call():
+            try:
+                result.append(self.function(sentences))
+            except Exception as e:
+                sys.stderr.write('[WARNING] POS tagger failed: {0}\n'.format(e))
+                result.append(None)
+
+        thread = threading.Thread(target=call)
+        thread.daemon = True
+        thread.start()
+        thread.join(self.timeout if self.timeout > 0 else None)
+        if thread.is_alive():
+            transcription_stats.count('pos_tagger_timeouts')
+            self.busy = thread
+            return None
+        return result[0]
+
+    def _call_process(self, sentences):
+        if self.process is None:
+            return None
+        try:
+            reply = self.process.request('\t'.join(' '.join(tokens) for tokens in sentences))
+        except SupervisedProcessFailure as failure:
+            sys.stderr.write('[WARNING] POS tagger {0}, POS tagging disabled\n'.format(failure))
+            self.process = None
+            return None
+        if not reply:
+            return None
+        return [to_utf8(tags).split(' ') for tags in reply.split('\t')]
+
+    def tag(self, sentences):
+        """
+        tags of a batch of sentences (lists of tokens): one list of tags per sentence, None for the sentences that
+        could not be tagged
+        """
+
+        start_time = time.time()
+        tagged = None
+        if sentences:
+            if self.function is not None:
+                tagged = self._call_function(sentences)
+            else:
+                tagged = self._call_process(sentences)
+        if tagged is None or len(tagged) != len(sentences):
+            tagged = [None] * len(sentences)
+        tags_list = []
+        for tokens, tags in zip(sentences, tagged):
+            if tags is not None and len(tags) != len(tokens):
+                tags = None
+            if tags is None:
+                transcription_stats.count('pos_tagger_fallbacks')
+            tags_list.append(tags)
+        transcription_stats.add_time('pos_tagging', time.time() - start_time)
+        return tags_list
+
+    def close(self):
+        if self.process is not None:
+            self.process.terminate()
+
+
+def get_pos_predictions(lines, yo_words, pos_tagger):
+    """
+    tag the tokenized sentences of the given lines with pos_tagger, in batches of pos_tagger.batch_size sentences.
+    Returns a dictionary tokenized sentence -> tags (None if the sentence could not be tagged)
+    """
+
+    null_log = logging.getLogger('nullLogger')
+    sentences = []
+    seen = set()
+    for line in lines:
+        # tokenized again when transcribing, where the tokenization statistics are collected
+        tokenized_sentence = tokenize_sentence(to_utf8(line).strip(), yo_words, null_log, stats=None)
+        if not tokenized_sentence or tokenized_sentence in seen:
+            continue
+        seen.add(tokenized_sentence)
+        sentences.append(tokenized_sentence)
+    pos_predictions = {}
+    for batch_start in range(0, len(sentences), pos_tagger.batch_size):
+        batch = sentences[batch_start:batch_start + pos_tagger.batch_size]
+        for tokenized_sentence, tags in zip(batch, pos_tagger.tag([sentence.split(' ') for sentence in batch])):
+            pos_predictions[tokenized_sentence] = tags
+    return pos_predictions
+
+
+def get_pos_prediction(tokenized_sentence, pos_predictions=None):
+    """
+    (word, POS tag) pairs of a tokenized sentence, with the tags predicted by get_pos_predictions if any, GEN_POS
+    otherwise. Punctuation symbols become SIL
+    """
+
     original_words = tokenized_sentence.split(' ')
     analyzed_words = []
     pos_predictor_status = 0
-    if pos_predictor_available:
-        # call external pos predictor passing to it the tokenized sentence, for example:
-        # pos_predictor_status, analyzed_words = call_pos_predictor(from_utf8(tokenized_sentence))
-        pass
-    # in case that no pos prediction was available or it failed, generate a "dummy" prediction
-    if not pos_predictor_available or pos_predictor_status > 0:
-        for word in original_words:
-            # generate SIL for punctuation symbols
-            if word in sil_punct_symbols:
-                word = SIL
-            analyzed_words.append((word, GEN_POS))
+    tags = None
+    if pos_predictions is not None:
+        tags = pos_predictions.get(tokenized_sentence)
+    if tags is None:
+        tags = [GEN_POS] * len(original_words)
+    for word, pos_feats in zip(original_words, tags):
+        # generate SIL for punctuation symbols
+        if word in sil_punct_symbols:
+            word = SIL
+        analyzed_words.append((word, pos_feats or GEN_POS))
     return analyzed_words, pos_predictor_status
 
 
-def transcribe_line(stress_prediction_process, g2p_process, user_entries, lex_entries, homograph_entries, yo_words,
-                    line, tlog=logging.getLogger('nullLogger')):
-    error_message = '**ERROR, COULD NOT TRANSCRIBE**'
-    line = to_utf8(line).strip()
+def get_line_to_transcribe(stress_prediction_process, user_entries, lex_entries, homograph_entries, yo_words, line,
+                           tlog=logging.getLogger('nullLogger'), stress_predictions=None, tokenized_sentence=None,
+                           trace=None, pos_predictions=None, stress_lexicon=None):
+    """
+    first part of the transcription of a line: tokenization (unless the tokenized sentence is given), POS tags (from
+    pos_predictions, see get_pos_predictions) and stress assignment of every word (words not found in the lexica are
+    looked up in the stress lexicon, if any, before their stress is predicted). Returns the string to be sent to the
+    G2P FSTs ('' if the POS analysis failed) or None if the line could not be tokenized. If a trace list is given, a
+    (word, normalized token, POS, source, stress string) record of every word is appended to it
+    """
+
     line_to_transcribe = ''
-    tokenized_sentence = tokenize_sentence(line, yo_words, tlog)
-    sentence_transcription = ''
+    if tokenized_sentence is None:
+        line = to_utf8(line).strip()
+        tokenized_sentence = tokenize_sentence(line, yo_words, tlog)
     if tokenized_sentence:
         tlog.info('[NORM]\t%s', from_utf8(tokenized_sentence))
-        pos_prediction, pos_predictor_status = get_pos_prediction(tokenized_sentence)
+        pos_prediction, pos_predictor_status = get_pos_prediction(tokenized_sentence, pos_predictions)
         if pos_predictor_status > 0:
             tlog.info('[INFO]\tPOS analysis failed, ignoring output')
         else:
+            tokens = tokenized_sentence.split(' ')
             word_pos = 0
             # iterate over all words in the input line
             for word, pos_feats in pos_prediction:
+                word_start_time = time.time()
+                prediction_time = 0
+                transcription_stats.count('words')
                 tlog.info('[WORD]\t%s', from_utf8(word))
                 if pos_feats:
                     if not pos_feats == GEN_POS:
@@ -447,6 +1907,7 @@ def transcribe_line(stress_prediction_process, g2p_process, user_entries, lex_en
                 # generate SIL for punctuation symbols
                 if word == SIL:
                     stress_str = SIL
+                    source = 'punctuation'
                 else:
                     # check whether the word is in the user lexicon
                     stress_str = user_entries.get_transcription(word)
@@ -454,6 +1915,7 @@ def transcribe_line(stress_prediction_process, g2p_process, user_entries, lex_en
                         # check if the word is in homographs dictionary
                         stress_str, best_feats = homograph_entries.get_transcription(word, pos_feats)
                         if stress_str:
+                            source = 'homographs'
                             if 'NOT_HOMOGRAPH' not in best_feats[0]:
                                 tlog.info('[DISA]\t%s', print_feats_list(best_feats))
                             else:
@@ -462,19 +1924,40 @@ def transcribe_line(stress_prediction_process, g2p_process, user_entries, lex_en
                             # check if the word is in simple dictionary
                             stress_str = lex_entries.get_transcription(word)
                             if not stress_str:
-                                # not found in any dictionary --> predict stress
-                                stress_str = get_stress_prediction(from_utf8(word), stress_prediction_process)
+                                # not found in any dictionary --> predict stress (unless it was already predicted)
+                                stress_str = None
+                                if stress_lexicon is not None:
+                                    stress_str = stress_lexicon.get_transcription(word)
+                                    source = 'stress_lexicon'
+                                if not stress_str and stress_predictions is not None:
+                                    stress_str = stress_predictions.get(word)
+                                    source = 'stress_prediction_precomputed'
+                                if not stress_str:
+                                    prediction_time = time.time()
+                                    stress_str = get_stress_prediction(from_utf8(word), stress_prediction_process)
+                                    prediction_time = time.time() - prediction_time
+                                    source = 'stress_prediction'
+                                    # a failed prediction ('') is not kept, the word is predicted again next time
+                                    if stress_predictions is not None and stress_str:
+                                        stress_predictions[word] = stress_str
                                 # check whether the word is monosyllabic and did not get any stress predicted
                                 if '+' not in stress_str:
                                     single_vowel = word_is_monosyllabic(stress_str)
                                     if single_vowel:
                                         stress_str = stress_str.replace(single_vowel, '+' + single_vowel)
+                                        transcription_stats.count_source('monosyllable_fix')
                                 tlog.info('[INFO]\tstress predicted')
                             else:
+                                source = 'lexicon'
                                 tlog.info('[INFO]\tentry found in lexicon')
                     else:
+                        source = 'user_lexicon'
                         tlog.info('[INFO]\tentry found in user lexicon')
+                transcription_stats.count_source(source)
                 tlog.info('[STRS]\t%s', from_utf8(stress_str))
+                if trace is not None:
+                    trace.append({'word': word, 'token': tokens[word_pos], 'pos': pos_feats, 'source': source,
+                                  'stress': stress_str})
                 # correct some possible prediction errors
                 stress_str = stress_str.replace(to_utf8('Х'), to_utf8(''))
                 # attach POS to the word for G2P purposes (currently only for verbs and adjectives)
@@ -484,15 +1967,320 @@ def transcribe_line(stress_prediction_process, g2p_process, user_entries, lex_en
                     stress_str = 'VERB' + stress_str
                 line_to_transcribe += stress_str + ' '
                 word_pos += 1
-            sentence_transcription = get_g2p_transcription(line_to_transcribe, g2p_process)
-            if not sentence_transcription:
-                sentence_transcription = error_message
+                # the stress prediction round trip has its own stage
+                transcription_stats.add_time('lookup', time.time() - word_start_time - prediction_time)
     else:
-        sentence_transcription = error_message
-    sentence_transcription = re.sub(r'  +', r' ', sentence_transcription.strip())
+        line_to_transcribe = None
+    return line_to_transcribe
+
+
+def get_sentence_transcription(line_to_transcribe, g2p_result):
+    """
+    second part of the transcription of a line: final sentence transcription from the output of the G2P FSTs
+    """
+
+    if line_to_transcribe is None:
+        sentence_transcription = transcription_error
+        transcription_stats.count('tokenization_errors')
+    elif line_to_transcribe:
+        sentence_transcription = g2p_result
+        if not sentence_transcription:
+            sentence_transcription = transcription_error
+            transcription_stats.count('g2p_errors')
+    else:
+        sentence_transcription = ''
+    sentence_transcription = multiple_spaces.sub(' ', sentence_transcription.strip())
     return sentence_transcription
 
 
+def transcribe_line(stress_prediction_process, g2p_process, user_entries, lex_entries, homograph_entries, yo_words,
+                    line, tlog=logging.getLogger('nullLogger'), stress_predictions=None):
+    line_to_transcribe = get_line_to_transcribe(stress_prediction_process, user_entries, lex_entries,
+                                                homograph_entries, yo_words, line, tlog=tlog,
+                                                stress_predictions=stress_predictions)
+    g2p_result = ''
+    if line_to_transcribe:
+        g2p_result = get_g2p_transcription(line_to_transcribe, g2p_process)
+    return get_sentence_transcription(line_to_transcribe, g2p_result)
+
+
+class SentenceLog(object):
+    """
+    keeps the log messages of one sentence until they can be written in order to the transcription log (used when
+    several sentences are being transcribed at the same time). A disabled log does not keep anything
+    """
+
+    def __init__(self, enabled=True):
+        super(SentenceLog, self).__init__()
+        self.messages = []
+        self.enabled = enabled
+
+    def info(self, msg, *args):
+        if not self.enabled:
+            return
+        if args:
+            msg = msg % args
+        self.messages.append(msg)
+
+    def write_to(self, tlog):
+        for msg in self.messages:
+            tlog.info(msg)
+
+
+class TraceWriter(object):
+    """
+    writer of the structured trace: one JSON record per sentence (line number, sentence, words with their POS, source
+    and stress string, final transcription) in a JSON lines file. The records are serialized and written by a
+    background thread. With sample_rate < 1 only that fraction of the sentences is traced, evenly spaced. Without a
+    file name the records are kept in the records list (used by the worker processes of --jobs)
+    """
+
+    def __init__(self, file_name=None, sample_rate=1.0):
+        super(TraceWriter, self).__init__()
+        self.sample_rate = sample_rate
+        self.sampled_num = 0
+        self.records = []
+        self.queue = None
+        if file_name:
+            self.out_file = open(file_name, 'w')
+            self.queue = queue.Queue(1000)
+            self.writer = threading.Thread(target=self._write_records)
+            self.writer.daemon = True
+            self.writer.start()
+
+    def _write_records(self):
+        for record in iter(self.queue.get, None):
+            self.out_file.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + '\n')
+        self.out_file.close()
+
+    def sample(self, line_num):
+        """
+        whether the sentence in this line has to be traced
+        """
+
+        if self.sample_rate >= 1:
+            return True
+        sampled_num = int(line_num * self.sample_rate)
+        if sampled_num != int((line_num - 1) * self.sample_rate):
+            return True
+        return False
+
+    def write(self, record):
+        if self.queue is None:
+            self.records.append(record)
+        else:
+            self.queue.put(record)
+
+    def close(self):
+        if self.queue is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.queue = None
+
+
+def get_trace_record(line_num, line, trace, sentence_transcription):
+    """
+    trace record of a sentence. The words of the sentences taken from the sentence cache are not known (None)
+    """
+
+    return {'line': line_num, 'sentence': to_utf8(line), 'words': trace,
+            'transcription': to_utf8(sentence_transcription)}
+
+
+# sources of the stress strings, stored by their index in the aligned output
+aligned_sources = ['punctuation', 'user_lexicon', 'homographs', 'lexicon', 'stress_prediction',
+                   'stress_prediction_precomputed', 'stress_lexicon']
+# source index, token length, stress string length, phones start and end of a word of the aligned output
+aligned_word = struct.Struct('<BHHii')
+
+
+def get_aligned_words(trace):
+    """
+    (normalized token, stress string, source) of every word of a trace list (see get_line_to_transcribe)
+    """
+
+    return [[word['token'], word['stress'], word['source']] for word in trace]
+
+
+def get_aligned_record(line_num, words, sentence_transcription):
+    """
+    aligned output record of a sentence: record length (of everything after it), line number, number of words, length
+    of the transcription, then for every word its source index, the lengths of its token and of its stress string, and
+    the start and end offsets of its phones in the transcription (-1 if the transcription does not have one word per
+    token), followed by the token and stress string of every word and by the transcription (UTF-8). All integers are
+    little-endian
+    """
+
+    word_phones = []
+    if sentence_transcription != transcription_error:
+        word_phones = sentence_transcription.split(' ') if sentence_transcription else []
+    fields = []
+    strings = []
+    start = 0
+    for word_idx, (token, stress_str, source) in enumerate(words):
+        phones_start = phones_end = -1
+        if len(word_phones) == len(words):
+            phones_start = start
+            phones_end = start + len(word_phones[word_idx])
+            start = phones_end + 1
+        token = from_utf8(token)
+        stress_str = from_utf8(stress_str)
+        fields.append(aligned_word.pack(aligned_sources.index(source), len(token), len(stress_str), phones_start,
+                                        phones_end))
+        strings.extend([token, stress_str])
+    record = struct.pack('<III', line_num, len(words), len(sentence_transcription)) + ''.join(fields) + \
+        ''.join(strings) + sentence_transcription
+    return struct.pack('<I', len(record)) + record
+
+
+class AlignedWriter(object):
+    """
+    writer of the aligned output (input file name + '.g2pa'): a header (ALIGNED_MAGIC, version and length of a JSON
+    header with the list of sources) followed by one length-prefixed binary record per sentence, with its normalized
+    tokens, their stress strings and sources, and its transcription with the offsets of the phones of every token (see
+    get_aligned_record). The offset of every record is written to an index (.g2pa.idx, one 64 bits little-endian
+    integer per sentence), so that the records can be read directly by sentence number (see AlignedReader). Without a
+    file name the records are kept in the records list (used by the worker processes of --jobs)
+    """
+
+    def __init__(self, file_name=None, mode='w'):
+        super(AlignedWriter, self).__init__()
+        self.records = []
+        self.out_file = None
+        self.index_file = None
+        if file_name:
+            self.out_file = open(file_name, mode + 'b')
+            self.index_file = open(file_name + '.idx', mode + 'b')
+            if mode == 'w':
+                header = json.dumps({'sources': aligned_sources})
+                self.out_file.write(ALIGNED_MAGIC + struct.pack('<II', ALIGNED_VERSION, len(header)) + header)
+            self.offset = self.out_file.tell() if mode == 'w' else os.path.getsize(file_name)
+
+    def write(self, line_num, words, sentence_transcription):
+        self.write_record(get_aligned_record(line_num, words, sentence_transcription))
+
+    def write_record(self, record):
+        if self.out_file is None:
+            self.records.append(record)
+            return
+        self.index_file.write(struct.pack('<Q', self.offset))
+        self.out_file.write(record)
+        self.offset += len(record)
+
+    def close(self):
+        for output_file in [self.out_file, self.index_file]:
+            if output_file is not None:
+                output_file.close()
+        self.out_file = self.index_file = None
+
+
+class AlignedReader(object):
+    """
+    read-only sequence view of an aligned output (see AlignedWriter), memory-mapped. reader[i] is the record of the
+    i-th sentence: a dictionary with its line number, its words as (token, stress string, source, phones start, phones
+    end) tuples and its transcription (UTF-8 strings)
+    """
+
+    def __init__(self, file_name):
+        super(AlignedReader, self).__init__()
+        with open(file_name, 'rb') as fp:
+            if fp.read(len(ALIGNED_MAGIC)) != ALIGNED_MAGIC:
+                raise ValueError('not an aligned output file: ' + file_name)
+            version, header_len = struct.unpack('<II', fp.read(8))
+            if version != ALIGNED_VERSION:
+                raise ValueError('unsupported aligned output version: ' + file_name)
+            self.sources = [str(source) for source in json.loads(fp.read(header_len))['sources']]
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(file_name + '.idx', 'rb') as fp:
+            self.index = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(file_name + '.idx') \
+                else ''
+
+    def __len__(self):
+        return len(self.index) // 8
+
+    def __getitem__(self, sentence_idx):
+        if not 0 <= sentence_idx < len(self):
+            raise IndexError(sentence_idx)
+        offset, = struct.unpack_from('<Q', self.index, 8 * sentence_idx)
+        line_num, words_num, transcription_len = struct.unpack_from('<III', self.mm, offset + 4)
+        fields_offset = offset + 16
+        strings_offset = fields_offset + words_num * aligned_word.size
+        words = []
+        for word_idx in range(words_num):
+            source_idx, token_len, stress_len, phones_start, phones_end = aligned_word.unpack_from(
+                self.mm, fields_offset + word_idx * aligned_word.size)
+            token = self.mm[strings_offset:strings_offset + token_len]
+            strings_offset += token_len
+            stress_str = self.mm[strings_offset:strings_offset + stress_len]
+            strings_offset += stress_len
+            words.append((token, stress_str, self.sources[source_idx], phones_start, phones_end))
+        return {'line': line_num, 'words': words,
+                'transcription': self.mm[strings_offset:strings_offset + transcription_len]}
+
+    def close(self):
+        self.mm.close()
+        if self.index:
+            self.index.close()
+
+
+def get_oov_words(lines, user_entries, lex_entries, homograph_entries, yo_words, stress_lexicon=None):
+    """
+    first pass of the batch mode: collect the unique words of the input lines that are not found in any dictionary
+    (nor in the stress lexicon, if given) and that will therefore need a stress prediction
+    """
+
+    start_time = time.time()
+    null_log = logging.getLogger('nullLogger')
+    oov_words = set()
+    for line in lines:
+        # tokenized again when transcribing, where the tokenization statistics are collected
+        tokenized_sentence = tokenize_sentence(to_utf8(line).strip(), yo_words, null_log, stats=None)
+        if not tokenized_sentence:
+            continue
+        for word in tokenized_sentence.split(' '):
+            if word in oov_words or word in sil_punct_symbols:
+                continue
+            if user_entries.get_transcription(word) or \
+                    homograph_entries.get_transcription(word, GEN_POS)[0] or \
+                    lex_entries.get_transcription(word) or \
+                    stress_lexicon is not None and stress_lexicon.get_transcription(word):
+                continue
+            oov_words.add(word)
+    transcription_stats.add_time('oov_collection', time.time() - start_time)
+    return oov_words
+
+
+def read_input_chunks(input_lines, chunk_size, lines_before=0):
+    """
+    generator returning the (line number, line) pairs of the input lines (file or any other iterable) that have to be
+    transcribed, grouped in lists of chunk_size elements. lines_before is the number of lines of the input that precede
+    input_lines (when resuming from a checkpoint)
+    """
+
+    chunk = []
+    line_num = lines_before
+    for line in input_lines:
+        line_num += 1
+        line = line.strip()
+        if not line.startswith('#'):  # ignore line comments
+            chunk.append((line_num, line))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def get_lines_to_transcribe(chunk, previous_transcriptions=None):
+    """
+    lines of a chunk of (line number, line) pairs that do not keep a previous transcription
+    """
+
+    if previous_transcriptions is None:
+        return [line for _, line in chunk]
+    return [line for line_num, line in chunk if line_num not in previous_transcriptions]
+
+
 def get_number_of_sentences(options_input):
     lines_to_be_processed_num = 0
     for line in open(options_input, 'r'):
@@ -501,33 +2289,870 @@ def get_number_of_sentences(options_input):
     return lines_to_be_processed_num
 
 
-def process_input(options_input, user_entries, lex_entries, homograph_entries, yo_words, stress_prediction_process,
-                  g2p_process):
-    sys.stdout.write('\n')
+class TranscriptionManifest(object):
+    """
+    manifest of the transcription of an input file (input file name + '.manifest.json', next to the .g2p output), for
+    incremental transcription. It keeps the hashes of the stress prediction model, of the G2P FSTs (and of the POS
+    tagger, if any) and the version of this script, and, for every sentence, the words whose lexicon entries its
+    transcription depends on, together with a digest of these entries. When the input is transcribed again, a sentence
+    keeps its previous transcription (and log messages) if the same line was transcribed before and the entries of none
+    of its words changed; all sentences are transcribed again if the model, the G2P FSTs, the tagger or the script
+    changed. The previous output files are moved aside (.previous) until the run is finished; the manifest is only
+    written at the end of a complete run. With aligned, the words of the previous aligned output are kept as well
+    """
+
+    def __init__(self, options_input, stress_prediction_file, options_g2p_fst, hash_dict, write_log=True,
+                 aligned=False):
+        super(TranscriptionManifest, self).__init__()
+        self.input_file = options_input
+        self.manifest_file = options_input + '.manifest.json'
+        self.g2p_file = options_input + '.g2p'
+        self.log_file = options_input + '.log'
+        self.aligned_file = options_input + '.g2pa'
+        model_path = os.path.realpath(stress_prediction_file)
+        model_hashes = dict((file_name, file_hash) for file_name, file_hash in hash_dict.items()
+                            if file_name == model_path or file_name.startswith(model_path + os.sep))
+        self.resources = {'stress_model': get_combined_hash(model_hashes),
+                          'g2p_fst': get_g2p_hash(options_g2p_fst, hash_dict),
+                          'script_version': SCRIPT_VERSION}
+        if 'pos_tagger' in hash_dict:
+            self.resources['pos_tagger'] = hash_dict['pos_tagger']
+        self.write_log = write_log
+        self.aligned = aligned
+        self.words = {}  # word -> digest of its lexicon entries
+        self.sentences = []  # (line digest, words) of every sentence of the input
+        # line number -> (.g2p offset, .log offset, sentence index) of a previous transcription that is still valid
+        self.previous = {}
+        self.previous_g2p = None
+        self.previous_log = None
+        self.previous_aligned = None
+
+    @staticmethod
+    def get_entries_digest(word, user_entries, lex_entries, homograph_entries, yo_words):
+        homograph = None
+        homograph_entry = homograph_entries.homograph_entries.get(word)
+        if homograph_entry is not None:
+            homograph = [[[pos_feats, homograph_entry.get_phono(idx)]
+                          for idx, pos_feats in enumerate(homograph_entry.get_pos_feats())],
+                         homograph_entry.get_most_frequent_phono()]
+        entries = [yo_words.get_transcription(word), user_entries.get_transcription(word), homograph,
+                   lex_entries.get_transcription(word)]
+        return hashlib.sha1(json.dumps(entries)).hexdigest()
+
+    @staticmethod
+    def get_words(line, yo_words, no_yo_words):
+        """
+        words of a line before and after the restoration of the letter <yo> (a change of the yo list may change both)
+        """
+
+        null_log = logging.getLogger('nullLogger')
+        words = set()
+        for restored_words in [yo_words, no_yo_words]:
+            words.update(tokenize_sentence(to_utf8(line).strip(), restored_words, null_log, stats=None).split())
+        return sorted(words - set(sil_punct_symbols))
+
+    def read(self):
+        """
+        previous manifest, None if there is none or if all sentences have to be transcribed again
+        """
+
+        if not os.path.exists(self.manifest_file):
+            return None
+        with open(self.manifest_file) as fp:
+            manifest = json.load(fp)
+        os.remove(self.manifest_file)  # not valid any more once the output is being rewritten
+        reason = None
+        if manifest.get('version') != MANIFEST_VERSION:
+            reason = 'the manifest format changed'
+        elif manifest['resources'] != self.resources:
+            reason = 'the stress prediction model, the G2P FSTs or the script changed'
+        elif self.write_log and not (manifest['log'] and os.path.exists(self.log_file)):
+            reason = 'there is no previous transcription log'
+        elif self.aligned and not (manifest.get('aligned') and os.path.exists(self.aligned_file) and
+                                   os.path.exists(self.aligned_file + '.idx')):
+            reason = 'there is no previous aligned output'
+        elif not os.path.exists(self.g2p_file):
+            reason = 'there is no previous output'
+        if reason:
+            sys.stdout.write('[INFO] transcribing all sentences: ' + reason + '\n')
+            return None
+        return manifest
+
+    def prepare(self, user_entries, lex_entries, homograph_entries, yo_words):
+        """
+        find the sentences of the input that keep their previous transcription, and move the previous output aside
+        """
+
+        manifest = self.read()
+        no_yo_words = LexEntries()
+        line_nums = []
+        for chunk in read_input_chunks(open(self.input_file, 'r'), 1):
+            line_num, line = chunk[0]
+            words = self.get_words(line, yo_words, no_yo_words)
+            for word in words:
+                if word not in self.words:
+                    self.words[word] = self.get_entries_digest(word, user_entries, lex_entries, homograph_entries,
+                                                               yo_words)
+            self.sentences.append((hashlib.sha1(line).hexdigest(), words))
+            line_nums.append(line_num)
+        if manifest is None:
+            return
+        changed = set()
+        for word_idx, (word, digest) in enumerate(manifest['words']):
+            if word not in self.words:
+                self.words[word] = self.get_entries_digest(word, user_entries, lex_entries, homograph_entries,
+                                                           yo_words)
+            if self.words[word] != digest:
+                changed.add(word_idx)
+        previous_sentences = {}
+        for sentence_idx, (line_digest, word_idxs) in enumerate(manifest['sentences']):
+            if line_digest not in previous_sentences and not changed.intersection(word_idxs):
+                previous_sentences[line_digest] = sentence_idx
+        reused = {}
+        for line_num, (line_digest, _) in zip(line_nums, self.sentences):
+            if line_digest in previous_sentences:
+                reused[line_num] = previous_sentences[line_digest]
+        g2p_offsets = self.get_offsets(self.g2p_file, lambda line: True)
+        log_offsets = []
+        if self.write_log:
+            log_offsets = self.get_offsets(self.log_file, lambda line: line.startswith('[SNUM]\t'))
+        aligned_num = len(manifest['sentences'])
+        if self.aligned:
+            aligned_num = os.path.getsize(self.aligned_file + '.idx') // 8
+        if len(g2p_offsets) != len(manifest['sentences']) or aligned_num != len(manifest['sentences']) or \
+                (self.write_log and len(log_offsets) != len(manifest['sentences'])):
+            sys.stdout.write('[INFO] transcribing all sentences: the previous output does not match its manifest\n')
+            return
+        for line_num, sentence_idx in reused.items():
+            self.previous[line_num] = (g2p_offsets[sentence_idx], log_offsets[sentence_idx] if self.write_log else None,
+                                       sentence_idx)
+        sys.stdout.write('[INFO] {0} of {1} sentences keep their previous transcription ({2} words changed)\n'.format(
+            len(self.previous), len(self.sentences), len(changed)))
+        os.rename(self.g2p_file, self.g2p_file + '.previous')
+        self.previous_g2p = open(self.g2p_file + '.previous', 'rb')
+        if self.write_log:
+            os.rename(self.log_file, self.log_file + '.previous')
+            self.previous_log = open(self.log_file + '.previous', 'rb')
+        if self.aligned:
+            os.rename(self.aligned_file, self.aligned_file + '.previous')
+            os.rename(self.aligned_file + '.idx', self.aligned_file + '.previous.idx')
+            self.previous_aligned = AlignedReader(self.aligned_file + '.previous')
+
+    @staticmethod
+    def get_offsets(file_name, starts_record):
+        offsets = []
+        offset = 0
+        with open(file_name, 'rb') as fp:
+            for line in fp:
+                if starts_record(line):
+                    offsets.append(offset)
+                offset += len(line)
+        return offsets
+
+    def __contains__(self, line_num):
+        return line_num in self.previous
+
+    def get(self, line_num, default=None):
+        """
+        (log messages, transcription) of the previous transcription of a sentence, as for a sentence cache hit, followed
+        by its words with aligned output
+        """
+
+        if line_num not in self.previous:
+            return default
+        g2p_offset, log_offset, sentence_idx = self.previous[line_num]
+        self.previous_g2p.seek(g2p_offset)
+        sentence_transcription = self.previous_g2p.readline().rstrip('\n')
+        messages = []
+        if log_offset is not None:
+            self.previous_log.seek(log_offset)
+            self.previous_log.readline()  # [SNUM] and [SENT] are written for the current line
+            self.previous_log.readline()
+            for line in iter(self.previous_log.readline, ''):
+                if line.startswith('[SPHO]\t'):
+                    break
+                messages.append(line.rstrip('\n'))
+        if self.previous_aligned is not None:
+            words = [[to_utf8(token), to_utf8(stress_str), source]
+                     for token, stress_str, source, _, _ in self.previous_aligned[sentence_idx]['words']]
+            return messages, sentence_transcription, words
+        return messages, sentence_transcription
+
+    def close(self):
+        """
+        write the manifest of the finished run and delete the previous output
+        """
+
+        word_idxs = {}
+        words = []
+        sentences = []
+        for line_digest, sentence_words in self.sentences:
+            for word in sentence_words:
+                if word not in word_idxs:
+                    word_idxs[word] = len(words)
+                    words.append((word, self.words[word]))
+            sentences.append((line_digest, [word_idxs[word] for word in sentence_words]))
+        tmp_file_name = self.manifest_file + '.' + str(os.getpid())
+        with open(tmp_file_name, 'w') as out_file:
+            json.dump({'version': MANIFEST_VERSION, 'resources': self.resources, 'log': self.write_log,
+                       'aligned': self.aligned, 'words': words, 'sentences': sentences}, out_file)
+        os.rename(tmp_file_name, self.manifest_file)
+        for previous_file in [self.previous_g2p, self.previous_log]:
+            if previous_file is not None:
+                previous_file.close()
+                os.remove(previous_file.name)
+        if self.previous_aligned is not None:
+            self.previous_aligned.close()
+            os.remove(self.aligned_file + '.previous')
+            os.remove(self.aligned_file + '.previous.idx')
+        self.previous_g2p = self.previous_log = self.previous_aligned = None
+
+
+class TranscriptionCheckpoint(object):
+    """
+    checkpoint of the transcription of an input file (input file name + '.checkpoint.json'), for resuming an
+    interrupted run. Every interval seconds, the output files are synced to disk and the checkpoint records the input
+    offset and the line number after the last sentence written, the number of sentences written and the sizes of the
+    output files (.g2p, .log and aligned output). A resumed run truncates the output files to these sizes and continues
+    with the next input line, so that its output is the same as the one of an uninterrupted run. The checkpoint of a
+    finished input file is marked as complete, and the input is not transcribed again when resuming a run over several
+    input files; the checkpoints are deleted (remove) once the whole run has finished. A checkpoint is only valid for
+    the same input file (size and modification time), resources, version of this script and output files
+    """
+
+    def __init__(self, options_input, hash_dict, write_log=True, resume=False, interval=CHECKPOINT_INTERVAL,
+                 aligned=False):
+        super(TranscriptionCheckpoint, self).__init__()
+        self.input_file = options_input
+        self.checkpoint_file = TranscriptionCheckpoint.get_checkpoint_file(options_input)
+        input_stat = os.stat(options_input)
+        self.identity = {'input_size': input_stat.st_size, 'input_mtime': input_stat.st_mtime,
+                         'resources': get_combined_hash(hash_dict), 'script_version': SCRIPT_VERSION,
+                         'log': write_log, 'aligned': aligned}
+        # (file name, state key of its size) of every output file
+        self.outputs = [(options_input + '.g2p', 'g2p_offset')]
+        if write_log:
+            self.outputs.append((options_input + '.log', 'log_offset'))
+        if aligned:
+            self.outputs.extend([(options_input + '.g2pa', 'aligned_offset'),
+                                 (options_input + '.g2pa.idx', 'aligned_index_offset')])
+        self.resume = resume
+        self.interval = interval
+        self.state = {'input_offset': 0, 'line_num': 0, 'sentences': 0, 'complete': False}
+        for _, offset_key in self.outputs:
+            self.state[offset_key] = 0
+        self.output_mode = 'w'
+        self.pending = collections.deque()  # (line number, input offset after the line) of the lines not written yet
+        self.last_write_time = time.time()
+
+    @staticmethod
+    def get_checkpoint_file(options_input):
+        return options_input + '.checkpoint.json'
+
+    @staticmethod
+    def remove_checkpoint(options_input):
+        """
+        delete the checkpoint of an input file, if any: it is not valid any more once the output is being rewritten
+        """
+
+        checkpoint_file = TranscriptionCheckpoint.get_checkpoint_file(options_input)
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+
+    def remove(self):
+        TranscriptionCheckpoint.remove_checkpoint(self.input_file)
+
+    def read(self):
+        """
+        state of the previous checkpoint, None if there is none or if it is not valid for this run
+        """
+
+        if not os.path.exists(self.checkpoint_file):
+            sys.stdout.write('[INFO] transcribing ' + self.input_file + ' from the beginning: there is no checkpoint\n')
+            return None
+        with open(self.checkpoint_file) as fp:
+            checkpoint = json.load(fp)
+        state = checkpoint.get('state')
+        reason = None
+        if checkpoint.get('version') != CHECKPOINT_VERSION:
+            reason = 'the checkpoint format changed'
+        elif checkpoint['identity'] != self.identity:
+            reason = 'the input, the resources, the script or the output options changed'
+        elif [file_name for file_name, offset_key in self.outputs
+              if not os.path.exists(file_name) or os.path.getsize(file_name) < state[offset_key]]:
+            reason = 'the output is shorter than its checkpoint'
+        if reason:
+            sys.stdout.write('[INFO] transcribing ' + self.input_file + ' from the beginning: ' + reason + '\n')
+            return None
+        return state
+
+    def start(self):
+        """
+        when resuming, continue from the previous checkpoint: the output files are truncated to their size at the
+        checkpoint and have to be opened in self.output_mode. Returns False if the input has been transcribed completely
+        already. Without resuming, the previous checkpoint is deleted
+        """
+
+        state = self.read() if self.resume else None
+        if state is None:
+            self.remove()
+            return True
+        if state['complete']:
+            sys.stdout.write('[INFO] ' + self.input_file + ' has been transcribed completely already\n')
+            return False
+        for file_name, offset_key in self.outputs:
+            with open(file_name, 'r+b') as fp:
+                fp.truncate(state[offset_key])
+        self.state = state
+        self.output_mode = 'a'
+        sys.stdout.write('[INFO] resuming the transcription of {0} after {1} sentences (line {2})\n'.format(
+            self.input_file, state['sentences'], state['line_num']))
+        return True
+
+    def open_input(self):
+        """
+        the input file, positioned after the last sentence of the checkpoint
+        """
+
+        input_file = open(self.input_file, 'r')
+        input_file.seek(self.state['input_offset'])
+        return input_file
+
+    def track(self, input_lines):
+        """
+        generator returning the input lines, while recording the input offset after every line that is transcribed
+        """
+
+        line_num = self.state['line_num']
+        offset = self.state['input_offset']
+        for line in input_lines:
+            line_num += 1
+            offset += len(line)
+            if not line.strip().startswith('#'):  # as in read_input_chunks
+                self.pending.append((line_num, offset))
+            yield line
+
+    def commit(self, out_file, log_stream=None, aligned_writer=None):
+        """
+        record the sentence just written, the checkpoint is written if the interval is over
+        """
+
+        self.state['line_num'], self.state['input_offset'] = self.pending.popleft()
+        self.state['sentences'] += 1
+        if time.time() - self.last_write_time >= self.interval:
+            self.write(out_file, log_stream, aligned_writer)
+
+    def write(self, out_file, log_stream=None, aligned_writer=None, complete=False):
+        """
+        sync the output files and write the checkpoint atomically
+        """
+
+        output_files = [(out_file, 'g2p_offset'), (log_stream, 'log_offset')]
+        if aligned_writer is not None:
+            output_files.extend([(aligned_writer.out_file, 'aligned_offset'),
+                                 (aligned_writer.index_file, 'aligned_index_offset')])
+        for output_file, offset_key in output_files:
+            if output_file is not None:
+                output_file.flush()
+                os.fsync(output_file.fileno())
+                self.state[offset_key] = os.fstat(output_file.fileno()).st_size
+        self.state['complete'] = complete
+        tmp_file_name = self.checkpoint_file + '.' + str(os.getpid())
+        with open(tmp_file_name, 'w') as checkpoint_file:
+            json.dump({'version': CHECKPOINT_VERSION, 'identity': self.identity, 'state': self.state},
+                      checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.rename(tmp_file_name, self.checkpoint_file)
+        self.last_write_time = time.time()
+
+
+def transcribe_sentences(sentences, stress_prediction_process, g2p_process, user_entries, lex_entries,
+                         homograph_entries, yo_words, stress_predictions=None, g2p_pipeline=None, sentence_cache=None,
+                         trace_writer=None, log_messages=True, g2p_word_cache=None, previous_transcriptions=None,
+                         aligned_writer=None, pos_predictions=None, stress_lexicon=None):
+    """
+    generator transcribing an iterable of (line number, line) pairs. It yields (sentence log, sentence transcription)
+    pairs in input order. Sentences found in the sentence cache (after tokenization) are not transcribed again, and
+    only the words not found in the G2P word cache are sent to the G2P FSTs. The sentences with a line number in
+    previous_transcriptions (see TranscriptionManifest) keep their previous transcription and log messages. The
+    sentences sampled by trace_writer are written to the trace, all sentences to aligned_writer (the sentence cache and
+    the previous transcriptions then keep the words of the aligned output as well). With log_messages = False the
+    sentence logs are empty (unless the sentence cache is used, which stores the log messages; sentences whose
+    transcription or the stress prediction of a word failed are not cached). pos_predictions are the POS tags of the
+    sentences (see get_pos_predictions); the sentences that could not be tagged are not cached. The stress lexicon
+    (see StressLexicon) is looked up before the stress of a word is predicted
+    """
+
+    log_messages = log_messages or sentence_cache is not None
+
+    def finish_sentence(sentence, g2p_result):
+        (sentence_log, line_to_transcribe, tokenized_sentence, first_msg_idx, cached_sentence, line_num, line, traced,
+         trace, g2p_data) = sentence
+        if g2p_data is not None:
+            g2p_word_result = g2p_word_cache.complete(g2p_data, g2p_result)
+            if g2p_word_result is None:
+                # the G2P output could not be split in words, transcribe the whole line instead
+                if g2p_pipeline:
+                    g2p_word_result = g2p_pipeline.transcribe_now(line_to_transcribe)
+                else:
+                    g2p_word_result = get_g2p_transcription(line_to_transcribe, g2p_process)
+            g2p_result = g2p_word_result
+        if cached_sentence:
+            messages, sentence_transcription = cached_sentence[:2]
+            sentence_log.messages.extend(messages)
+            words = cached_sentence[2] if len(cached_sentence) > 2 else None
+        else:
+            sentence_transcription = get_sentence_transcription(line_to_transcribe, g2p_result)
+            words = get_aligned_words(trace) if aligned_writer is not None else None
+            # failed transcriptions and stress predictions (given up, see SupervisedProcess) are not cached
+            if tokenized_sentence and sentence_cache is not None and sentence_transcription != transcription_error \
+                    and all(word['stress'] for word in trace):
+                cache_value = (sentence_log.messages[first_msg_idx:], sentence_transcription)
+                if aligned_writer is not None:
+                    cache_value += (words,)
+                sentence_cache[tokenized_sentence] = cache_value
+        if traced:
+            trace_writer.write(get_trace_record(line_num, line, trace, sentence_transcription))
+        if aligned_writer is not None:
+            aligned_writer.write(line_num, words, sentence_transcription)
+        return sentence_log, sentence_transcription
+
+    for line_num, line in sentences:
+        sentence_log = SentenceLog(log_messages)
+        sentence_log.info('[SNUM]\t%d', line_num)
+        sentence_log.info('[SENT]\t%s', line)
+        tokenized_sentence = None
+        cached_sentence = None
+        if previous_transcriptions is not None:
+            cached_sentence = previous_transcriptions.get(line_num)
+        if sentence_cache is not None and cached_sentence is None:
+            tokenized_sentence = tokenize_sentence(to_utf8(line).strip(), yo_words, sentence_log)
+            if tokenized_sentence:
+                cached_sentence = sentence_cache.get(tokenized_sentence)
+                if cached_sentence and aligned_writer is not None and len(cached_sentence) < 3:
+                    cached_sentence = None  # cached without the words of the aligned output
+        first_msg_idx = len(sentence_log.messages)
+        line_to_transcribe = ''
+        traced = trace_writer is not None and trace_writer.sample(line_num)
+        trace = None
+        transcription_stats.count('sentences')
+        if cached_sentence and tokenized_sentence is None:
+            transcription_stats.count('reused_sentences')
+        elif cached_sentence:
+            transcription_stats.count('sentence_cache_hits')
+        else:
+            if traced or aligned_writer is not None or sentence_cache is not None:
+                trace = []
+            line_to_transcribe = get_line_to_transcribe(stress_prediction_process, user_entries, lex_entries,
+                                                        homograph_entries, yo_words, line, tlog=sentence_log,
+                                                        stress_predictions=stress_predictions,
+                                                        tokenized_sentence=tokenized_sentence,
+                                                        trace=trace, pos_predictions=pos_predictions,
+                                                        stress_lexicon=stress_lexicon)
+            if pos_predictions is not None and pos_predictions.get(tokenized_sentence) is None:
+                tokenized_sentence = None  # not tagged (GEN_POS fallback): the transcription is not cached
+        str_to_transcribe = line_to_transcribe
+        g2p_data = None
+        if line_to_transcribe and g2p_word_cache is not None:
+            str_to_transcribe, g2p_data = g2p_word_cache.prepare(line_to_transcribe)
+        sentence = (sentence_log, line_to_transcribe, tokenized_sentence, first_msg_idx, cached_sentence, line_num,
+                    line, traced, trace, g2p_data)
+        if g2p_pipeline:
+            for finished_sentence, g2p_result in g2p_pipeline.submit(str_to_transcribe, sentence):
+                yield finish_sentence(finished_sentence, g2p_result)
+        else:
+            g2p_result = ''
+            if str_to_transcribe:
+                g2p_result = get_g2p_transcription(str_to_transcribe, g2p_process)
+            yield finish_sentence(sentence, g2p_result)
+    if g2p_pipeline:
+        for finished_sentence, g2p_result in g2p_pipeline.flush():
+            yield finish_sentence(finished_sentence, g2p_result)
+
+
+def get_transcription_log(log_file_name, mode='w'):
     tlog = logging.getLogger('transcription')
     tlog.setLevel(logging.INFO)
-    handler = logging.FileHandler(filename=options_input + '.log', mode='w')
+    for handler in list(tlog.handlers):  # the log of the previous input file
+        tlog.removeHandler(handler)
+        handler.close()
+    handler = logging.FileHandler(filename=log_file_name, mode=mode)
     tlog.addHandler(handler)
-    out_file = open(options_input + '.g2p', 'w')
+    return tlog
+
+
+def transcribe_stream(input_lines, stress_prediction_process, g2p_process, user_entries, lex_entries,
+                      homograph_entries, yo_words, stress_predictions=None, stress_prediction_file=None, batch_size=0,
+                      g2p_pipeline=None, sentence_cache=None, tlog=logging.getLogger('nullLogger'), trace_writer=None,
+                      g2p_word_cache=None, previous_transcriptions=None, lines_before=0, aligned_writer=None,
+                      pos_tagger=None, stress_lexicon=None):
+    """
+    generator transcribing the lines of any iterable (an open file, sys.stdin, a list of strings...) in one single
+    pass. It yields the transcription of every line that is not a comment, in input order. With batch_size > 0, the
+    stress of the unknown words of every chunk of batch_size lines is predicted in one Phonetisaurus run (except for
+    the lines in previous_transcriptions, see transcribe_sentences). The log messages are only generated if tlog is
+    enabled for INFO messages. lines_before is the number of input lines that precede input_lines. The aligned output
+    of every sentence is written to aligned_writer. With pos_tagger (see PosTagger), the sentences of every chunk are
+    tagged in batches before they are transcribed (in chunks of pos_tagger.batch_size lines if batch_size is 0). The
+    words found in the stress lexicon are not predicted
+    """
+
+    if batch_size > 0 and stress_predictions is None:
+        stress_predictions = {}
+    chunk_size = max(batch_size, 1)
+    pos_predictions = None
+    if pos_tagger is not None:
+        if batch_size <= 0:
+            chunk_size = pos_tagger.batch_size
+        pos_predictions = {}
+
+    def get_sentences():
+        for chunk in read_input_chunks(input_lines, chunk_size, lines_before):
+            if pos_tagger is not None:
+                # the sentences of the previous chunk have all been transcribed when the next chunk is read
+                pos_predictions.clear()
+                pos_predictions.update(get_pos_predictions(get_lines_to_transcribe(chunk, previous_transcriptions),
+                                                           yo_words, pos_tagger))
+            if batch_size > 0:
+                # first pass over the current chunk
+                oov_words = get_oov_words(get_lines_to_transcribe(chunk, previous_transcriptions),
+                                          user_entries, lex_entries, homograph_entries, yo_words, stress_lexicon)
+                oov_words = [word for word in oov_words if word not in stress_predictions]
+                stress_predictions.update(get_stress_predictions(sorted(oov_words), stress_prediction_file))
+            for sentence in chunk:
+                yield sentence
+
+    for sentence_log, sentence_transcription in transcribe_sentences(get_sentences(), stress_prediction_process,
+                                                                     g2p_process, user_entries, lex_entries,
+                                                                     homograph_entries, yo_words,
+                                                                     stress_predictions=stress_predictions,
+                                                                     g2p_pipeline=g2p_pipeline,
+                                                                     sentence_cache=sentence_cache,
+                                                                     trace_writer=trace_writer,
+                                                                     log_messages=tlog.isEnabledFor(logging.INFO),
+                                                                     g2p_word_cache=g2p_word_cache,
+                                                                     previous_transcriptions=previous_transcriptions,
+                                                                     aligned_writer=aligned_writer,
+                                                                     pos_predictions=pos_predictions,
+                                                                     stress_lexicon=stress_lexicon):
+        sentence_log.write_to(tlog)
+        tlog.info('[SPHO]\t%s\n', sentence_transcription)
+        yield sentence_transcription
+
+
+def process_input(options_input, user_entries, lex_entries, homograph_entries, yo_words, stress_prediction_process,
+                  g2p_process, stress_prediction_file=None, batch_mode=False, batch_size=0, stress_cache=None,
+                  pipeline_window=0, sentence_cache=None, stats_file=None, write_log=True, trace_writer=None,
+                  g2p_word_cache=None, manifest=None, checkpoint=None, aligned=False, pos_tagger=None,
+                  stress_lexicon=None):
+    """
+    transcribe all sentences of the input file. In batch mode the stress of all out-of-vocabulary words is predicted in
+    advance in one Phonetisaurus run, either for the whole input (batch_size = 0) or for chunks of batch_size sentences.
+    Words already predicted in a previous chunk or found in the stress prediction cache are not sent again to
+    Phonetisaurus. With pipeline_window > 0, up to pipeline_window sentences are kept in flight in the transduce process.
+    Sentences found in the sentence cache are not transcribed again, words found in the G2P word cache are not sent
+    again to the G2P FSTs. With a manifest (see TranscriptionManifest), only the sentences whose previous transcription
+    is not valid any more are transcribed. With a checkpoint (see TranscriptionCheckpoint), the progress of the run is
+    recorded periodically, and a resumed run continues after the last checkpoint. The statistics of the run are written
+    as JSON to stats_file (input file name + '.stats.json' by default) every STATS_INTERVAL seconds and at the end. The
+    transcription log is not written with write_log = False; the sentences sampled by trace_writer are written to its
+    trace. With aligned, the aligned output is written as well (see AlignedWriter). With pos_tagger, the sentences are
+    tagged in batches by the POS tagger (see PosTagger). The words found in the stress lexicon (see StressLexicon) are
+    not predicted
+    """
+
+    sys.stdout.write('\n')
+    if stats_file is None:
+        stats_file = options_input + '.stats.json'
+    transcription_stats.start()
+    if checkpoint is not None and not checkpoint.start():
+        return
+    if manifest is not None:
+        manifest.prepare(user_entries, lex_entries, homograph_entries, yo_words)
+    output_mode = checkpoint.output_mode if checkpoint is not None else 'w'
+    lines_before = checkpoint.state['line_num'] if checkpoint is not None else 0
+    tlog = logging.getLogger('nullLogger')
+    log_stream = None
+    if write_log:
+        tlog = get_transcription_log(options_input + '.log', output_mode)
+        log_stream = tlog.handlers[0].stream
+    out_file = open(options_input + '.g2p', output_mode)
+    aligned_writer = AlignedWriter(options_input + '.g2pa', output_mode) if aligned else None
     lines_to_be_processed_num = get_number_of_sentences(options_input)
-    line_num = 0
+    stress_predictions = stress_cache
+    if batch_mode:
+        if stress_predictions is None:
+            stress_predictions = {}
+        if batch_size <= 0:
+            # first pass over the whole input
+            input_lines = checkpoint.open_input() if checkpoint is not None else open(options_input, 'r')
+            oov_words = get_oov_words((line for chunk in read_input_chunks(input_lines, 1, lines_before)
+                                       for line in get_lines_to_transcribe(chunk, manifest)),
+                                      user_entries, lex_entries, homograph_entries, yo_words, stress_lexicon)
+            oov_words = [word for word in oov_words if word not in stress_predictions]
+            stress_predictions.update(get_stress_predictions(sorted(oov_words), stress_prediction_file))
+    g2p_pipeline = None
+    if pipeline_window > 0:
+        g2p_pipeline = G2PPipeline(g2p_process, pipeline_window)
     sent_num = 0
+    input_lines = open(options_input, 'r')
+    if checkpoint is not None:
+        sent_num = checkpoint.state['sentences']
+        input_lines = checkpoint.track(checkpoint.open_input())
     # iterate over all input lines
-    for line in open(options_input, 'r'):
-        line_num += 1
-        line = line.strip()
-        if not line.startswith('#'):  # ignore line comments
-            sent_num += 1
-            sys.stdout.write("\rProcessing sentence: {0}/{1}".format(sent_num, lines_to_be_processed_num))
-            tlog.info('[SNUM]\t%d', line_num)
-            tlog.info('[SENT]\t%s', line)
-            sentence_transcription = transcribe_line(stress_prediction_process, g2p_process, user_entries,
-                                                     lex_entries, homograph_entries, yo_words, line, tlog=tlog)
+    for sentence_transcription in transcribe_stream(input_lines, stress_prediction_process, g2p_process,
+                                                    user_entries, lex_entries, homograph_entries, yo_words,
+                                                    stress_predictions=stress_predictions,
+                                                    stress_prediction_file=stress_prediction_file,
+                                                    batch_size=batch_size if batch_mode else 0,
+                                                    g2p_pipeline=g2p_pipeline, sentence_cache=sentence_cache,
+                                                    tlog=tlog, trace_writer=trace_writer,
+                                                    g2p_word_cache=g2p_word_cache, previous_transcriptions=manifest,
+                                                    lines_before=lines_before, aligned_writer=aligned_writer,
+                                                    pos_tagger=pos_tagger, stress_lexicon=stress_lexicon):
+        sent_num += 1
+        sys.stdout.write("\rProcessing sentence: {0}/{1}".format(sent_num, lines_to_be_processed_num))
+        out_file.write(sentence_transcription + '\n')
+        out_file.flush()
+        if checkpoint is not None:
+            checkpoint.commit(out_file, log_stream, aligned_writer)
+        transcription_stats.write_periodically(stats_file)
+    sys.stdout.write('\n')
+    if checkpoint is not None:
+        checkpoint.write(out_file, log_stream, aligned_writer, complete=True)
+    out_file.close()
+    if aligned_writer is not None:
+        aligned_writer.close()
+    if manifest is not None:
+        manifest.close()
+    transcription_stats.write(stats_file)
+
+
+# resources of a worker process in --jobs mode (see init_worker)
+worker_resources = {}
+
+
+def init_worker(stress_prediction_file, options_g2p_fst, general_lexicon, homographs_lexicon, user_lexicon, yo_list,
+                batch_mode, pipeline_window, snapshot_file, compact_lexica, sentence_cache_size, write_log=True,
+                trace_sample_rate=0, g2p_word_cache_size=0, g2p_library=None, process_timeout=PROCESS_TIMEOUT,
+                process_retries=PROCESS_RETRIES, hash_dict=None, aligned=False, pos_tagger_spec=None,
+                pos_batch_size=POS_BATCH_SIZE, pos_timeout=POS_TIMEOUT, stress_lexicon_file=None,
+                stress_max_score=None):
+    """
+    initializer of the worker processes: every worker owns its own subprocesses (POS tagger included) and lexica, and
+    its own sentence and G2P word caches (kept in memory only). The stress lexicon, checked by the parent process, is
+    mapped by every worker. The trace records and the aligned output records of the
+    worker are sent back to the parent process with the results. A lexica snapshot has been brought up to date by the
+    parent process: the workers only attach it, and take the resources hashes (hash_dict) from the parent as well
+    """
+
+    sys.stdout = open(os.devnull, 'w')  # the progress is written by the parent process
+    (stress_prediction_process, g2p_process, lex_entries, homograph_entries, user_entries,
+     yo_words, hash_dict) = initialize_resources(stress_prediction_file, options_g2p_fst, general_lexicon,
+                                                 homographs_lexicon, user_lexicon, yo_list, snapshot_file,
+                                                 compact_lexica, g2p_library, process_timeout, process_retries,
+                                                 attach_snapshot=True, hash_dict=hash_dict)
+    pos_tagger = None
+    if pos_tagger_spec:
+        pos_tagger = PosTagger(pos_tagger_spec, pos_batch_size, pos_timeout)
+    stress_lexicon = None
+    if stress_lexicon_file:
+        stress_lexicon = StressLexicon(stress_lexicon_file, stress_max_score)
+    worker_resources.update(stress_prediction_file=stress_prediction_file,
+                            stress_prediction_process=stress_prediction_process,
+                            g2p_process=g2p_process,
+                            lex_entries=lex_entries,
+                            homograph_entries=homograph_entries,
+                            user_entries=user_entries,
+                            yo_words=yo_words,
+                            batch_mode=batch_mode,
+                            stress_predictions={} if batch_mode else None,
+                            g2p_pipeline=G2PPipeline(g2p_process, pipeline_window) if pipeline_window > 0 else None,
+                            sentence_cache=SentenceCache(max_size=sentence_cache_size) if sentence_cache_size else None,
+                            write_log=write_log,
+                            trace_writer=TraceWriter(sample_rate=trace_sample_rate) if trace_sample_rate > 0 else None,
+                            g2p_word_cache=G2PWordCache(max_size=g2p_word_cache_size) if g2p_word_cache_size else None,
+                            aligned_writer=AlignedWriter() if aligned else None,
+                            pos_tagger=pos_tagger,
+                            stress_lexicon=stress_lexicon)
+
+
+def transcribe_chunk(chunk, cached_predictions=None, previous_transcriptions=None):
+    """
+    transcribe a chunk of (line number, line) pairs in a worker process. cached_predictions contains the predictions
+    found in the stress prediction cache of the parent process for the unknown words of the chunk (None if no cache is
+    used), previous_transcriptions the (log messages, transcription) pairs of the lines of the chunk that keep their
+    previous transcription, by line number (None without a manifest). Returns the list of (log messages, sentence
+    transcription, aligned output record) tuples of the chunk (the record is None without aligned output), the stress
+    predictions that were not in cached_predictions, the trace records and the statistics of the chunk
+    """
+
+    r = worker_resources
+    stress_predictions = r['stress_predictions']
+    if cached_predictions is not None:
+        stress_predictions = dict(cached_predictions)
+    if r['batch_mode']:
+        oov_words = get_oov_words(get_lines_to_transcribe(chunk, previous_transcriptions), r['user_entries'],
+                                  r['lex_entries'], r['homograph_entries'], r['yo_words'], r['stress_lexicon'])
+        oov_words = [word for word in oov_words if word not in stress_predictions]
+        stress_predictions.update(get_stress_predictions(sorted(oov_words), r['stress_prediction_file']))
+    pos_predictions = None
+    if r['pos_tagger'] is not None:
+        pos_predictions = get_pos_predictions(get_lines_to_transcribe(chunk, previous_transcriptions), r['yo_words'],
+                                              r['pos_tagger'])
+    results = []
+    for sentence_log, sentence_transcription in transcribe_sentences(chunk, r['stress_prediction_process'],
+                                                                     r['g2p_process'], r['user_entries'],
+                                                                     r['lex_entries'], r['homograph_entries'],
+                                                                     r['yo_words'],
+                                                                     stress_predictions=stress_predictions,
+                                                                     g2p_pipeline=r['g2p_pipeline'],
+                                                                     sentence_cache=r['sentence_cache'],
+                                                                     trace_writer=r['trace_writer'],
+                                                                     log_messages=r['write_log'],
+                                                                     g2p_word_cache=r['g2p_word_cache'],
+                                                                     previous_transcriptions=previous_transcriptions,
+                                                                     aligned_writer=r['aligned_writer'],
+                                                                     pos_predictions=pos_predictions,
+                                                                     stress_lexicon=r['stress_lexicon']):
+        aligned_record = None
+        if r['aligned_writer'] is not None:
+            aligned_record = r['aligned_writer'].records.pop()
+        results.append((sentence_log.messages, sentence_transcription, aligned_record))
+    trace_records = []
+    if r['trace_writer'] is not None:
+        trace_records, r['trace_writer'].records = r['trace_writer'].records, []
+    new_predictions = {}
+    if cached_predictions is not None:
+        for word, stress_str in stress_predictions.items():
+            if word not in cached_predictions:
+                new_predictions[word] = stress_str
+    return results, new_predictions, trace_records, transcription_stats.pop_state()
+
+
+def process_input_parallel(options_input, jobs, stress_prediction_file, options_g2p_fst, general_lexicon=None,
+                           homographs_lexicon=None, user_lexicon=None, yo_list=None, batch_mode=False, batch_size=0,
+                           stress_cache=None, pipeline_window=0, snapshot_file=None, hash_dict=None,
+                           compact_lexica=False, sentence_cache_size=0, stats_file=None, write_log=True,
+                           trace_writer=None, g2p_word_cache_size=0, g2p_library=None,
+                           process_timeout=PROCESS_TIMEOUT, process_retries=PROCESS_RETRIES, attach_snapshot=False,
+                           manifest=None, checkpoint=None, aligned=False, pos_tagger_spec=None,
+                           pos_batch_size=POS_BATCH_SIZE, pos_timeout=POS_TIMEOUT, stress_lexicon_file=None,
+                           stress_max_score=None):
+    """
+    transcribe all sentences of the input file with several worker processes. The input is split in chunks of
+    batch_size sentences (1000 if batch_size is 0) that are distributed to the workers; the results are written in
+    the original order. The stress prediction cache is owned by this process: the cached predictions of the unknown
+    words of a chunk are sent to the worker together with the chunk, the new predictions are stored when the chunk
+    comes back. If a lexica snapshot is used, it is brought up to date (unless attach_snapshot is set) before the
+    workers are started, and all workers map the same snapshot. The statistics of the workers are added to the ones
+    of this process, and their trace records written to trace_writer (see process_input for stats_file, write_log,
+    manifest, checkpoint and aligned; the previous transcriptions are sent to the workers together with the chunks).
+    With pos_tagger_spec (see PosTagger), every worker runs its own POS tagger. The stress lexicon (see
+    open_stress_lexicon) is checked here and mapped by all workers
+    """
+
+    sys.stdout.write('\n')
+    if stats_file is None:
+        stats_file = options_input + '.stats.json'
+    transcription_stats.start()
+    if checkpoint is not None and not checkpoint.start():
+        return
+    if snapshot_file and not attach_snapshot:
+        update_lexica_snapshot(snapshot_file, hash_dict, general_lexicon, homographs_lexicon, user_lexicon, yo_list)
+    stress_lexicon = open_stress_lexicon(stress_lexicon_file, stress_prediction_file, hash_dict, stress_max_score)
+    if stress_lexicon is None:
+        stress_lexicon_file = None
+    lexica = None
+    if stress_cache or manifest is not None:
+        lexica = load_lexica(general_lexicon, homographs_lexicon, user_lexicon, yo_list, snapshot_file, hash_dict,
+                             compact_lexica, attach_snapshot=True)
+    if manifest is not None:
+        lex_entries, homograph_entries, user_entries, yo_words = lexica
+        manifest.prepare(user_entries, lex_entries, homograph_entries, yo_words)
+    output_mode = checkpoint.output_mode if checkpoint is not None else 'w'
+    tlog = logging.getLogger('nullLogger')
+    log_stream = None
+    if write_log:
+        tlog = get_transcription_log(options_input + '.log', output_mode)
+        log_stream = tlog.handlers[0].stream
+    out_file = open(options_input + '.g2p', output_mode)
+    aligned_writer = AlignedWriter(options_input + '.g2pa', output_mode) if aligned else None
+    lines_to_be_processed_num = get_number_of_sentences(options_input)
+    chunk_size = batch_size if batch_size > 0 else 1000
+    pool = multiprocessing.Pool(jobs, init_worker, (stress_prediction_file, options_g2p_fst, general_lexicon,
+                                                    homographs_lexicon, user_lexicon, yo_list, batch_mode,
+                                                    pipeline_window, snapshot_file, compact_lexica,
+                                                    sentence_cache_size, write_log,
+                                                    trace_writer.sample_rate if trace_writer is not None else 0,
+                                                    g2p_word_cache_size, g2p_library, process_timeout,
+                                                    process_retries, hash_dict, aligned, pos_tagger_spec,
+                                                    pos_batch_size, pos_timeout, stress_lexicon_file,
+                                                    stress_max_score))
+    sent_num = 0
+    input_lines = open(options_input, 'r')
+    lines_before = 0
+    if checkpoint is not None:
+        sent_num = checkpoint.state['sentences']
+        input_lines = checkpoint.track(checkpoint.open_input())
+        lines_before = checkpoint.state['line_num']
+    pending = collections.deque()
+
+    def write_chunk(async_result):
+        results, new_predictions, trace_records, chunk_stats = async_result.get()
+        transcription_stats.merge(chunk_stats)
+        for record in trace_records:
+            trace_writer.write(record)
+        if stress_cache:
+            stress_cache.update(new_predictions)
+        sent_num_in_chunk = sent_num
+        for messages, sentence_transcription, aligned_record in results:
+            sent_num_in_chunk += 1
+            sys.stdout.write("\rProcessing sentence: {0}/{1}".format(sent_num_in_chunk, lines_to_be_processed_num))
+            for msg in messages:
+                tlog.info(msg)
             out_file.write(sentence_transcription + '\n')
-            out_file.flush()
             tlog.info('[SPHO]\t%s\n', sentence_transcription)
+            if aligned_writer is not None:
+                aligned_writer.write_record(aligned_record)
+            if checkpoint is not None:
+                checkpoint.commit(out_file, log_stream, aligned_writer)
+        out_file.flush()
+        transcription_stats.write_periodically(stats_file)
+        return sent_num_in_chunk
+
+    for chunk in read_input_chunks(input_lines, chunk_size, lines_before):
+        cached_predictions = None
+        if stress_cache:
+            cached_predictions = {}
+            lex_entries, homograph_entries, user_entries, yo_words = lexica
+            for word in get_oov_words(get_lines_to_transcribe(chunk, manifest), user_entries, lex_entries,
+                                      homograph_entries, yo_words, stress_lexicon):
+                stress_str = stress_cache.get(word)
+                if stress_str is not None:
+                    cached_predictions[word] = stress_str
+        previous_transcriptions = None
+        if manifest is not None:
+            previous_transcriptions = dict((line_num, manifest.get(line_num)) for line_num, _ in chunk
+                                           if line_num in manifest)
+        pending.append(pool.apply_async(transcribe_chunk, (chunk, cached_predictions, previous_transcriptions)))
+        # keep a bounded number of chunks in flight
+        if len(pending) >= 2 * jobs:
+            sent_num = write_chunk(pending.popleft())
+    while pending:
+        sent_num = write_chunk(pending.popleft())
+    pool.close()
+    pool.join()
     sys.stdout.write('\n')
+    if checkpoint is not None:
+        checkpoint.write(out_file, log_stream, aligned_writer, complete=True)
     out_file.close()
+    if aligned_writer is not None:
+        aligned_writer.close()
+    if manifest is not None:
+        manifest.close()
+    transcription_stats.write(stats_file)
 
 
 class PhonetisaurusInitializationError(Exception):
@@ -545,6 +3170,16 @@ class ResourcesNotFound(Exception):
         sys.stderr.write('[ERROR] path does not exist: ' + resources_name + '\n')
 
 
+class SnapshotNotFound(Exception):
+    def __init__(self, snapshot_file):
+        sys.stderr.write('[ERROR] no valid lexica snapshot: ' + snapshot_file + '\n')
+
+
+class StressLexiconNotFound(Exception):
+    def __init__(self, stress_lexicon_file):
+        sys.stderr.write('[ERROR] no valid stress lexicon: ' + stress_lexicon_file + '\n')
+
+
 def get_hash_code(file_name):
     with open(file_name, "rb") as fp:
         contents = fp.read()
@@ -553,17 +3188,53 @@ def get_hash_code(file_name):
     return h.hexdigest()
 
 
-def initialize_resources(stress_prediction_file, options_g2p_fst, general_lexicon=None, homographs_lexicon=None,
-                         user_lexicon=None, yo_list=None):
-    dev_null = open(os.devnull, 'wb')
+def get_resources_hashes(stress_prediction_file, options_g2p_fst, general_lexicon=None, homographs_lexicon=None,
+                         user_lexicon=None, yo_list=None, attached_snapshot=None, pos_tagger_spec=None):
+    """
+    content hashes of all resource files. With attached_snapshot, the hashes of the lexica are taken from the header
+    of the snapshot, and the lexicon files are not read. With pos_tagger_spec, the hash of the POS tagger is added
+    (key 'pos_tagger', see get_pos_tagger_hash)
+    """
+
     hash_dict = {}
+    if attached_snapshot:
+        hash_dict.update(get_snapshot_hashes(attached_snapshot))
+        general_lexicon = homographs_lexicon = user_lexicon = yo_list = None
     options_g2p_fst = options_g2p_fst.replace(' ', '')
     for g2p_fst in options_g2p_fst.split(','):
         if not os.path.exists(g2p_fst):
             raise ResourcesNotFound(g2p_fst)
         else:
             hash_dict[os.path.realpath(g2p_fst)] = get_hash_code(g2p_fst)
-    for resources in [stress_prediction_file, general_lexicon, homographs_lexicon, user_lexicon, yo_list]:
+    hash_dict.update(get_files_hashes([stress_prediction_file, general_lexicon, homographs_lexicon, user_lexicon,
+                                       yo_list]))
+    if pos_tagger_spec:
+        hash_dict['pos_tagger'] = get_pos_tagger_hash(pos_tagger_spec)
+    return hash_dict
+
+
+def get_pos_tagger_hash(pos_tagger_spec):
+    """
+    hash of a POS tagger: its specification and the contents of the files named in its command line (a change of the
+    tagger that touches neither is not detected)
+    """
+
+    h = hashlib.sha1()
+    h.update(pos_tagger_spec)
+    if not pos_tagger_spec.startswith('python:'):
+        for argument in shlex.split(pos_tagger_spec):
+            if os.path.isfile(argument):
+                h.update(get_hash_code(argument))
+    return h.hexdigest()
+
+
+def get_files_hashes(resources_list):
+    """
+    content hashes of the given files (or of all files of the given directories), None entries are skipped
+    """
+
+    hash_dict = {}
+    for resources in resources_list:
         if resources:
             if not os.path.exists(resources):
                 raise ResourcesNotFound(resources)
@@ -574,37 +3245,79 @@ def initialize_resources(stress_prediction_file, options_g2p_fst, general_lexico
                         hash_dict[os.path.realpath(f)] = get_hash_code(f)
                 else:
                     hash_dict[os.path.realpath(resources)] = get_hash_code(resources)
+    return hash_dict
 
-    # initialize Phonetisaurus process
-    try:
-        stress_prediction_process = subprocess.Popen(
-            ['phonetisaurus-g2p-omega', '--decoder_type=fst_phi', '--model=' + stress_prediction_file, '--isfile',
-             '--input=/dev/stdin'],
-            stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=dev_null)
-    except OSError:
-        raise PhonetisaurusInitializationError
 
-    # initialize lexica
-    user_entries = LexEntries()
+def load_lexica(general_lexicon=None, homographs_lexicon=None, user_lexicon=None, yo_list=None, snapshot_file=None,
+                hash_dict=None, compact=False, attach_snapshot=False):
+    """
+    load the lexica from their source files, or from snapshot_file. The snapshot is brought up to date first, unless
+    attach_snapshot is set: then it is only mapped, as published by another process (--publish)
+    """
+
+    if snapshot_file:
+        if not attach_snapshot:
+            update_lexica_snapshot(snapshot_file, hash_dict, general_lexicon, homographs_lexicon, user_lexicon,
+                                   yo_list)
+        return load_lexica_snapshot(snapshot_file)
+    lex_entries_class = CompactLexEntries if compact else LexEntries
+    user_entries = lex_entries_class()
     if user_lexicon:
         user_entries.load_dictionary(user_lexicon)
-    lex_entries = LexEntries()
+    lex_entries = lex_entries_class()
     if general_lexicon:
         lex_entries.load_dictionary(general_lexicon)
-    yo_words = LexEntries()
+    yo_words = lex_entries_class()
     if yo_list:
         yo_words.load_dictionary(yo_list)
-    homograph_entries = HomographEntries()
+    homograph_entries = CompactHomographEntries() if compact else HomographEntries()
     if homographs_lexicon:
         homograph_entries.load_homographs(homographs_lexicon)
+    return lex_entries, homograph_entries, user_entries, yo_words
 
-    # initialize transduce process
+
+def initialize_resources(stress_prediction_file, options_g2p_fst, general_lexicon=None, homographs_lexicon=None,
+                         user_lexicon=None, yo_list=None, snapshot_file=None, compact_lexica=False, g2p_library=None,
+                         process_timeout=PROCESS_TIMEOUT, process_retries=PROCESS_RETRIES, attach_snapshot=False,
+                         hash_dict=None):
+    """
+    start the Phonetisaurus and transduce processes (supervised, see SupervisedProcess for process_timeout and
+    process_retries) and load the lexica. With g2p_library (the path of libutf8transducer.so), the G2P FSTs are applied
+    in this process by an InProcessTransducer, which takes the place of the transduce process. With attach_snapshot,
+    the lexica snapshot is mapped as published by another process, without reading the lexicon files. hash_dict
+    (the resources hashes already computed by the caller, if any) saves hashing the resources again
+    """
+
+    start_time = time.time()
+    if hash_dict is None:
+        hash_dict = get_resources_hashes(stress_prediction_file, options_g2p_fst, general_lexicon, homographs_lexicon,
+                                         user_lexicon, yo_list, snapshot_file if attach_snapshot else None)
+    options_g2p_fst = options_g2p_fst.replace(' ', '')
+
+    # initialize Phonetisaurus process
     try:
-        g2p_process = subprocess.Popen(['transduce', '--fst=' + options_g2p_fst], stdout=subprocess.PIPE,
-                                       stdin=subprocess.PIPE, stderr=dev_null)
+        stress_prediction_process = SupervisedProcess(get_stress_prediction_command(stress_prediction_file),
+                                                      'phonetisaurus', process_timeout, process_retries,
+                                                      check_reply=is_stress_prediction_reply)
     except OSError:
+        raise PhonetisaurusInitializationError
+
+    # initialize lexica
+    lex_entries, homograph_entries, user_entries, yo_words = load_lexica(general_lexicon, homographs_lexicon,
+                                                                         user_lexicon, yo_list, snapshot_file,
+                                                                         hash_dict, compact_lexica, attach_snapshot)
+
+    # initialize transduce process
+    try:
+        if g2p_library:
+            g2p_process = InProcessTransducer(options_g2p_fst, g2p_library)
+        else:
+            g2p_process = SupervisedProcess(['transduce', '--fst=' + options_g2p_fst], 'transduce', process_timeout,
+                                            process_retries, sentinel=G2P_SENTINEL)
+    except (OSError, SupervisedProcessFailure):
         raise TransducerInitializationError
 
+    transcription_stats.add_time('resources_loading', time.time() - start_time)
     return (stress_prediction_process,
             g2p_process,
             lex_entries,
@@ -614,6 +3327,46 @@ def initialize_resources(stress_prediction_file, options_g2p_fst, general_lexico
             hash_dict)
 
 
+def get_combined_hash(hash_dict):
+    h = hashlib.sha1()
+    for file_name in sorted(hash_dict):
+        h.update(hash_dict[file_name])
+    return h.hexdigest()
+
+
+def get_g2p_hash(options_g2p_fst, hash_dict):
+    """
+    hash of the chain of G2P FSTs (in order)
+    """
+
+    h = hashlib.sha1()
+    for g2p_fst in options_g2p_fst.replace(' ', '').split(','):
+        h.update(hash_dict[os.path.realpath(g2p_fst)])
+    return h.hexdigest()
+
+
+def open_stress_cache(cache_dir, stress_prediction_file, hash_dict, cache_size=100000):
+    if not cache_dir:
+        return None
+    return StressPredictionCache(cache_dir, hash_dict[os.path.realpath(stress_prediction_file)], cache_size)
+
+
+def open_stress_lexicon(stress_lexicon_file, stress_prediction_file, hash_dict, max_score=None):
+    """
+    compiled stress lexicon (see StressLexicon), None if it was compiled with another stress prediction model than the
+    current one: its predictions would differ from the live ones
+    """
+
+    if not stress_lexicon_file:
+        return None
+    stress_lexicon = StressLexicon(stress_lexicon_file, max_score)
+    if stress_lexicon.model_hash != hash_dict[os.path.realpath(stress_prediction_file)]:
+        sys.stderr.write('[WARNING] stress lexicon compiled with another stress prediction model, not used: ' +
+                         stress_lexicon_file + '\n')
+        return None
+    return stress_lexicon
+
+
 def close_resources(stress_prediction_process, g2p_process):
     """
     function to close the subprocesses opened and to remove files that are not needed after exiting from the
@@ -623,40 +3376,469 @@ def close_resources(stress_prediction_process, g2p_process):
 
     if stress_prediction_process:
         stress_prediction_process.terminate()
-    if g2p_process:
+    if isinstance(g2p_process, InProcessTransducer):
+        g2p_process.close()
+    elif g2p_process:
         g2p_process.terminate()
 
 
+class Transcriber(object):
+    """
+    owner of all transcription resources (Phonetisaurus and transduce processes, lexica and caches), to transcribe
+    many requests without starting the processes and loading the lexica every time. The transcriptions of one
+    Transcriber object are serialized with a lock; use several objects for transcribing in parallel. With g2p_library,
+    the G2P FSTs are applied in this process without holding the GIL (see InProcessTransducer). With pos_tagger_spec,
+    the object runs its own POS tagger (see PosTagger). The stress lexicon (see StressLexicon) can be shared by several
+    objects
+    """
+
+    def __init__(self, stress_prediction_file, options_g2p_fst, general_lexicon=None, homographs_lexicon=None,
+                 user_lexicon=None, yo_list=None, snapshot_file=None, compact_lexica=False, pipeline_window=0,
+                 stress_cache=None, sentence_cache=None, trace_writer=None, g2p_word_cache=None, g2p_library=None,
+                 process_timeout=PROCESS_TIMEOUT, process_retries=PROCESS_RETRIES, attach_snapshot=False,
+                 hash_dict=None, pos_tagger_spec=None, pos_batch_size=POS_BATCH_SIZE, pos_timeout=POS_TIMEOUT,
+                 stress_lexicon=None):
+        super(Transcriber, self).__init__()
+        (self.stress_prediction_process, self.g2p_process, self.lex_entries, self.homograph_entries,
+         self.user_entries, self.yo_words, self.hash_dict) = initialize_resources(stress_prediction_file,
+                                                                                  options_g2p_fst, general_lexicon,
+                                                                                  homographs_lexicon, user_lexicon,
+                                                                                  yo_list, snapshot_file,
+                                                                                  compact_lexica, g2p_library,
+                                                                                  process_timeout, process_retries,
+                                                                                  attach_snapshot, hash_dict)
+        self.g2p_pipeline = None
+        if pipeline_window > 0:
+            self.g2p_pipeline = G2PPipeline(self.g2p_process, pipeline_window)
+        self.pos_tagger = None
+        if pos_tagger_spec:
+            self.pos_tagger = PosTagger(pos_tagger_spec, pos_batch_size, pos_timeout)
+        self.stress_cache = stress_cache
+        self.stress_lexicon = stress_lexicon
+        self.sentence_cache = sentence_cache
+        self.trace_writer = trace_writer
+        self.g2p_word_cache = g2p_word_cache
+        self.sentences_num = 0
+        self.lock = threading.Lock()
+
+    def transcribe(self, sentence, tlog=logging.getLogger('nullLogger')):
+        return self.transcribe_many([sentence], tlog)[0]
+
+    def transcribe_many(self, sentences, tlog=logging.getLogger('nullLogger')):
+        """
+        transcribe a list of sentences, returning one transcription per sentence (comment lines are not skipped here).
+        The sentences are numbered (in the log and in the trace) across all calls. With a POS tagger, the sentences of
+        the list are tagged in batches first
+        """
+
+        transcriptions = []
+        with self.lock:
+            pos_predictions = None
+            if self.pos_tagger is not None:
+                pos_predictions = get_pos_predictions(sentences, self.yo_words, self.pos_tagger)
+            numbered_sentences = enumerate(sentences, self.sentences_num + 1)
+            self.sentences_num += len(sentences)
+            for sentence_log, sentence_transcription in transcribe_sentences(numbered_sentences,
+                                                                             self.stress_prediction_process,
+                                                                             self.g2p_process, self.user_entries,
+                                                                             self.lex_entries, self.homograph_entries,
+                                                                             self.yo_words,
+                                                                             stress_predictions=self.stress_cache,
+                                                                             g2p_pipeline=self.g2p_pipeline,
+                                                                             sentence_cache=self.sentence_cache,
+                                                                             trace_writer=self.trace_writer,
+                                                                             log_messages=tlog.isEnabledFor(
+                                                                                 logging.INFO),
+                                                                             g2p_word_cache=self.g2p_word_cache,
+                                                                             pos_predictions=pos_predictions,
+                                                                             stress_lexicon=self.stress_lexicon):
+                sentence_log.write_to(tlog)
+                tlog.info('[SPHO]\t%s\n', sentence_transcription)
+                transcriptions.append(sentence_transcription)
+        return transcriptions
+
+    @staticmethod
+    def get_stats():
+        """
+        summary of the statistics of all transcriptions done by this process (see TranscriptionStats)
+        """
+
+        return transcription_stats.get_summary()
+
+    def close(self):
+        close_resources(self.stress_prediction_process, self.g2p_process)
+        if self.pos_tagger is not None:
+            self.pos_tagger.close()
+
+
+class TranscriptionRequestHandler(socketserver.StreamRequestHandler):
+    """
+    line based protocol of the transcription server: every line received is answered with its transcription. The
+    request is served by the first free Transcriber object of the server
+    """
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            transcriber = self.server.transcribers.get()
+            try:
+                sentence_transcription = transcriber.transcribe(line.strip())
+            finally:
+                self.server.transcribers.put(transcriber)
+            self.wfile.write(sentence_transcription + '\n')
+            self.wfile.flush()
+            transcription_stats.write_periodically(self.server.stats_file)
+
+
+class TranscriptionServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class UnixTranscriptionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(address, transcribers, stats_file=None):
+    """
+    run the transcription server until it is interrupted. The address is either HOST:PORT or the path of a Unix socket.
+    The statistics are written to stats_file (if given) every STATS_INTERVAL seconds while serving and at the end
+    """
+
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        server = TranscriptionServer((host, int(port)), TranscriptionRequestHandler)
+    else:
+        if os.path.exists(address):
+            os.unlink(address)
+        server = UnixTranscriptionServer(address, TranscriptionRequestHandler)
+    server.transcribers = queue.Queue()
+    server.stats_file = stats_file
+    transcription_stats.start()
+    for transcriber in transcribers:
+        server.transcribers.put(transcriber)
+    sys.stdout.write('Serving transcriptions on ' + address + '\n')
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if ':' not in address and os.path.exists(address):
+            os.unlink(address)
+        for transcriber in transcribers:
+            transcriber.close()
+        if stats_file:
+            transcription_stats.write(stats_file)
+
+
 def main():
-    options_parser = optparse.OptionParser()
-    options_parser.add_option('--input', '-i', help='The file containing the words to transcribe')
+    options_parser = optparse.OptionParser(usage='%prog [options] [MORE_INPUT_FILES]')
+    options_parser.add_option('--input', '-i', help='The file containing the words to transcribe ("-" for stdin), more '
+                                                    'input files can be given as arguments')
     options_parser.add_option('--yo_list', '-y', help='List of words that contain the letter <yo> (OPT)')
     options_parser.add_option('--dictionary', '-l', help='A simple dictionary file (OPT)')
     options_parser.add_option('--user', '-u', help='A user lexicon file in the same format as simple dictionary (OPT)')
     options_parser.add_option('--homographs', '-a', help='A file with homographs (OPT)')
     options_parser.add_option('--model_file', '-m', help='Read g2p model from FILE (for stress prediction)')
     options_parser.add_option('--g2p_fst', '-g', help='Path to the G2P FST(s)')
+    options_parser.add_option('--batch', '-b', action='store_true', default=False,
+                              help='Predict the stress of all unknown words in one Phonetisaurus run (OPT)')
+    options_parser.add_option('--batch_size', type='int', default=0,
+                              help='Number of sentences per chunk in batch mode, 0 for the whole input (OPT)')
+    options_parser.add_option('--cache_dir', '-c',
+                              help='Directory of the persistent stress prediction, sentence and G2P word caches '
+                                   '(OPT)')
+    options_parser.add_option('--cache_size', type='int', default=100000,
+                              help='Maximum number of stress predictions kept in memory (OPT)')
+    options_parser.add_option('--stress_lexicon',
+                              help='Compiled lexicon of precomputed stress predictions, looked up before the stress '
+                                   'prediction model (OPT)')
+    options_parser.add_option('--stress_max_score', type='float',
+                              help='Highest score (Phonetisaurus cost) of a precomputed stress prediction that is '
+                                   'stored or taken, the other words are predicted live (OPT)')
+    options_parser.add_option('--precompute',
+                              help='Only predict the stress of all words of this list in one run and compile them '
+                                   'into the stress lexicon (--stress_lexicon) (OPT)')
+    options_parser.add_option('--pipeline', '-p', type='int', default=0,
+                              help='Number of sentences kept in flight in the G2P transducer, 0 to disable (OPT)')
+    options_parser.add_option('--jobs', '-j', type='int', default=1,
+                              help='Number of worker processes (OPT)')
+    options_parser.add_option('--snapshot', '-s',
+                              help='Binary lexica snapshot, rebuilt when a lexicon changes (OPT)')
+    options_parser.add_option('--attach', action='store_true', default=False,
+                              help='Map the lexica snapshot as published by another process, without reading the '
+                                   'lexica (OPT)')
+    options_parser.add_option('--publish', action='store_true', default=False,
+                              help='Only bring the lexica snapshot up to date, for processes using --attach (OPT)')
+    options_parser.add_option('--compact', action='store_true', default=False,
+                              help='Keep the lexica in a compact low-memory representation (OPT)')
+    options_parser.add_option('--log', help='Transcription log file when reading from stdin (OPT)')
+    options_parser.add_option('--sentence_cache', type='int', default=0,
+                              help='Number of sentence transcriptions kept in memory, 0 to disable (OPT)')
+    options_parser.add_option('--word_cache', type='int', default=0,
+                              help='Number of G2P word transcriptions kept in memory, 0 to disable (OPT)')
+    options_parser.add_option('--g2p_library',
+                              help='Apply the G2P FSTs in this process with this library (src/build/'
+                                   'libutf8transducer.so) instead of running transduce (OPT)')
+    options_parser.add_option('--timeout', type='float', default=PROCESS_TIMEOUT,
+                              help='Seconds Phonetisaurus and transduce have to answer a request before they are '
+                                   'restarted, 0 for no limit (OPT)')
+    options_parser.add_option('--retries', type='int', default=PROCESS_RETRIES,
+                              help='Restarts of Phonetisaurus or transduce for one request before giving it up (OPT)')
+    options_parser.add_option('--pos_tagger',
+                              help='POS tagger for the homographs and the G2P FSTs: python:MODULE.FUNCTION or the '
+                                   'command line of a tagger process (OPT)')
+    options_parser.add_option('--pos_batch', type='int', default=POS_BATCH_SIZE,
+                              help='Number of sentences sent to the POS tagger in one request (OPT)')
+    options_parser.add_option('--pos_timeout', type='float', default=POS_TIMEOUT,
+                              help='Seconds the POS tagger has to tag a batch before its sentences get the generic '
+                                   'POS, 0 for no limit (OPT)')
+    options_parser.add_option('--server', help='Serve transcriptions on HOST:PORT or on a Unix socket path (OPT)')
+    options_parser.add_option('--stats', help='Statistics file, updated during the run (default: INPUT.stats.json) '
+                                              '(OPT)')
+    options_parser.add_option('--trace', help='Write a JSON lines trace (one record per sentence) to this file (OPT)')
+    options_parser.add_option('--trace_sample', type='float', default=1.0,
+                              help='Fraction of the sentences written to the trace, default 1 (OPT)')
+    options_parser.add_option('--no_log', action='store_true', default=False,
+                              help='Do not write the transcription log (OPT)')
+    options_parser.add_option('--aligned', action='store_true', default=False,
+                              help='Write the aligned binary output INPUT.g2pa (tokens, stress, sources and phones of '
+                                   'every word) (OPT)')
+    options_parser.add_option('--incremental', action='store_true', default=False,
+                              help='Transcribe again only the sentences affected by changed resources since the last '
+                                   'run (OPT)')
+    options_parser.add_option('--checkpoint', action='store_true', default=False,
+                              help='Record the progress of the run in INPUT.checkpoint.json, deleted when the run '
+                                   'has finished, for continuing it with --resume if it is interrupted (OPT)')
+    options_parser.add_option('--resume', action='store_true', default=False,
+                              help='Continue an interrupted run from its last checkpoint, skip the input files that '
+                                   'have been transcribed completely (implies --checkpoint) (OPT)')
 
     options, arguments = options_parser.parse_args()
     script_name = os.path.basename(os.path.splitext(inspect.getfile(inspect.currentframe()))[0])
 
-    if options.input and options.model_file and options.g2p_fst:
+    if (options.attach or options.publish) and not options.snapshot:
+        options_parser.error('--attach and --publish need the lexica snapshot (--snapshot)')
+    if options.attach and (options.dictionary or options.homographs or options.user or options.yo_list):
+        sys.stderr.write('[WARNING] the lexica of the attached snapshot are used, the lexicon options are ignored\n')
+    attached_snapshot = options.snapshot if options.attach else None
 
-        if not os.path.exists(options.input):
-            sys.stderr.write("[ERROR] path does not exist: '" + options.input + "'\n")
+    if options.publish:
+        try:
+            hash_dict = get_files_hashes([options.dictionary, options.homographs, options.user, options.yo_list])
+            update_lexica_snapshot(options.snapshot, hash_dict, options.dictionary, options.homographs, options.user,
+                                   options.yo_list)
+        except ResourcesNotFound:
             sys.exit(1)
+        sys.stdout.write('Lexica snapshot published: ' + options.snapshot + '\n')
+
+    elif options.precompute:
+        if not options.model_file or not options.stress_lexicon:
+            options_parser.error('--precompute needs the stress prediction model (--model_file) and the stress lexicon '
+                                 '(--stress_lexicon)')
+        try:
+            hash_dict = get_files_hashes([options.precompute, options.model_file])
+            lexica = load_lexica(options.dictionary, options.homographs, options.user, options.yo_list)
+            compile_stress_lexicon(options.stress_lexicon, options.precompute, options.model_file,
+                                   hash_dict[os.path.realpath(options.model_file)], lexica, options.stress_max_score)
+        except (ResourcesNotFound, PhonetisaurusInitializationError):
+            sys.exit(1)
+
+    elif (options.input or options.server) and options.model_file and options.g2p_fst:
+
+        streaming = options.input == '-'
+        if streaming:
+            # the transcriptions are written to stdout, all other messages to stderr
+            output_stream = sys.stdout
+            sys.stdout = sys.stderr
+            if options.jobs > 1:
+                sys.stderr.write("[ERROR] --jobs cannot be used when reading from stdin\n")
+                sys.exit(1)
+            if options.incremental or options.checkpoint or options.resume or options.aligned or arguments:
+                sys.stderr.write("[ERROR] --incremental, --checkpoint, --resume, --aligned and more input files cannot "
+                                 "be used when reading from stdin\n")
+                sys.exit(1)
+        elif options.input:
+            for input_file in [options.input] + arguments:
+                if not os.path.exists(input_file):
+                    sys.stderr.write("[ERROR] path does not exist: '" + input_file + "'\n")
+                    sys.exit(1)
+        if options.incremental and (options.checkpoint or options.resume):
+            options_parser.error('--incremental cannot be used with --checkpoint or --resume')
+        # the checkpoints of the input files, deleted once all input files have been transcribed
+        checkpoints = [] if options.checkpoint or options.resume else None
 
         sys.stdout.write("\n'" + script_name + "' version " + SCRIPT_VERSION + "\n\n")
 
+        trace_writer = None
+        if options.trace:
+            trace_writer = TraceWriter(options.trace, options.trace_sample)
         try:
-            (stress_prediction_process, g2p_process, lex_entries, homograph_entries, user_entries,
-             yo_words, hash_dict) = initialize_resources(options.model_file, options.g2p_fst, options.dictionary,
-                                                         options.homographs, options.user, options.yo_list)
-            process_input(options.input, user_entries, lex_entries, homograph_entries, yo_words,
-                          stress_prediction_process, g2p_process)
-            close_resources(stress_prediction_process, g2p_process)
-        except (PhonetisaurusInitializationError, TransducerInitializationError, ResourcesNotFound):
+            if options.server:
+                # one Transcriber object per job; the persistent caches are used only by a single Transcriber
+                hash_dict = get_resources_hashes(options.model_file, options.g2p_fst, options.dictionary,
+                                                 options.homographs, options.user, options.yo_list, attached_snapshot,
+                                                 options.pos_tagger)
+                if options.snapshot and not options.attach:
+                    update_lexica_snapshot(options.snapshot, hash_dict, options.dictionary, options.homographs,
+                                           options.user, options.yo_list)
+                stress_lexicon = open_stress_lexicon(options.stress_lexicon, options.model_file, hash_dict,
+                                                     options.stress_max_score)
+                stress_cache = None
+                sentence_cache = None
+                g2p_word_cache = None
+                if options.jobs == 1:
+                    stress_cache = open_stress_cache(options.cache_dir, options.model_file, hash_dict,
+                                                     options.cache_size)
+                    if options.sentence_cache:
+                        sentence_cache = SentenceCache(options.cache_dir, get_combined_hash(hash_dict),
+                                                       options.sentence_cache)
+                    if options.word_cache:
+                        g2p_word_cache = G2PWordCache(options.cache_dir, get_g2p_hash(options.g2p_fst, hash_dict),
+                                                      options.word_cache)
+                transcribers = []
+                for _ in range(max(options.jobs, 1)):
+                    transcriber_sentence_cache = sentence_cache
+                    if options.jobs > 1 and options.sentence_cache:
+                        transcriber_sentence_cache = SentenceCache(max_size=options.sentence_cache)
+                    transcriber_g2p_word_cache = g2p_word_cache
+                    if options.jobs > 1 and options.word_cache:
+                        transcriber_g2p_word_cache = G2PWordCache(max_size=options.word_cache)
+                    transcribers.append(Transcriber(options.model_file, options.g2p_fst, options.dictionary,
+                                                    options.homographs, options.user, options.yo_list,
+                                                    options.snapshot, options.compact, options.pipeline,
+                                                    stress_cache, transcriber_sentence_cache, trace_writer,
+                                                    transcriber_g2p_word_cache, options.g2p_library,
+                                                    options.timeout, options.retries, attach_snapshot=True,
+                                                    hash_dict=hash_dict, pos_tagger_spec=options.pos_tagger,
+                                                    pos_batch_size=options.pos_batch,
+                                                    pos_timeout=options.pos_timeout, stress_lexicon=stress_lexicon))
+                serve(options.server, transcribers, options.stats)
+            elif options.jobs > 1:
+                hash_dict = get_resources_hashes(options.model_file, options.g2p_fst, options.dictionary,
+                                                 options.homographs, options.user, options.yo_list, attached_snapshot,
+                                                 options.pos_tagger)
+                stress_cache = open_stress_cache(options.cache_dir, options.model_file, hash_dict, options.cache_size)
+                for input_file in [options.input] + arguments:
+                    manifest = None
+                    if options.incremental:
+                        manifest = TranscriptionManifest(input_file, options.model_file, options.g2p_fst, hash_dict,
+                                                         not options.no_log, options.aligned)
+                    checkpoint = None
+                    if checkpoints is not None:
+                        checkpoint = TranscriptionCheckpoint(input_file, hash_dict, not options.no_log,
+                                                             options.resume, aligned=options.aligned)
+                        checkpoints.append(checkpoint)
+                    else:
+                        TranscriptionCheckpoint.remove_checkpoint(input_file)
+                    process_input_parallel(input_file, options.jobs, options.model_file, options.g2p_fst,
+                                           options.dictionary, options.homographs, options.user, options.yo_list,
+                                           batch_mode=options.batch, batch_size=options.batch_size,
+                                           stress_cache=stress_cache, pipeline_window=options.pipeline,
+                                           snapshot_file=options.snapshot, hash_dict=hash_dict,
+                                           compact_lexica=options.compact, sentence_cache_size=options.sentence_cache,
+                                           stats_file=options.stats, write_log=not options.no_log,
+                                           trace_writer=trace_writer, g2p_word_cache_size=options.word_cache,
+                                           g2p_library=options.g2p_library, process_timeout=options.timeout,
+                                           process_retries=options.retries, attach_snapshot=options.attach,
+                                           manifest=manifest, checkpoint=checkpoint, aligned=options.aligned,
+                                           pos_tagger_spec=options.pos_tagger, pos_batch_size=options.pos_batch,
+                                           pos_timeout=options.pos_timeout, stress_lexicon_file=options.stress_lexicon,
+                                           stress_max_score=options.stress_max_score)
+                sentence_cache = None
+                g2p_word_cache = None
+            else:
+                hash_dict = get_resources_hashes(options.model_file, options.g2p_fst, options.dictionary,
+                                                 options.homographs, options.user, options.yo_list, attached_snapshot,
+                                                 options.pos_tagger)
+                (stress_prediction_process, g2p_process, lex_entries, homograph_entries, user_entries,
+                 yo_words, hash_dict) = initialize_resources(options.model_file, options.g2p_fst, options.dictionary,
+                                                             options.homographs, options.user, options.yo_list,
+                                                             options.snapshot, options.compact, options.g2p_library,
+                                                             options.timeout, options.retries, options.attach,
+                                                             hash_dict)
+                pos_tagger = None
+                if options.pos_tagger:
+                    pos_tagger = PosTagger(options.pos_tagger, options.pos_batch, options.pos_timeout)
+                stress_cache = open_stress_cache(options.cache_dir, options.model_file, hash_dict, options.cache_size)
+                stress_lexicon = open_stress_lexicon(options.stress_lexicon, options.model_file, hash_dict,
+                                                     options.stress_max_score)
+                sentence_cache = None
+                if options.sentence_cache:
+                    sentence_cache = SentenceCache(options.cache_dir, get_combined_hash(hash_dict),
+                                                   options.sentence_cache)
+                g2p_word_cache = None
+                if options.word_cache:
+                    g2p_word_cache = G2PWordCache(options.cache_dir, get_g2p_hash(options.g2p_fst, hash_dict),
+                                                  options.word_cache)
+                if streaming:
+                    stress_predictions = stress_cache
+                    batch_size = 0
+                    if options.batch:
+                        # there is no first pass over the whole input when streaming
+                        batch_size = options.batch_size if options.batch_size > 0 else 1000
+                    g2p_pipeline = None
+                    if options.pipeline > 0:
+                        g2p_pipeline = G2PPipeline(g2p_process, options.pipeline)
+                    tlog = logging.getLogger('nullLogger')
+                    if options.log and not options.no_log:
+                        tlog = get_transcription_log(options.log)
+                    transcription_stats.start()
+                    for sentence_transcription in transcribe_stream(sys.stdin, stress_prediction_process,
+                                                                    g2p_process, user_entries, lex_entries,
+                                                                    homograph_entries, yo_words,
+                                                                    stress_predictions=stress_predictions,
+                                                                    stress_prediction_file=options.model_file,
+                                                                    batch_size=batch_size,
+                                                                    g2p_pipeline=g2p_pipeline,
+                                                                    sentence_cache=sentence_cache, tlog=tlog,
+                                                                    trace_writer=trace_writer,
+                                                                    g2p_word_cache=g2p_word_cache,
+                                                                    pos_tagger=pos_tagger,
+                                                                    stress_lexicon=stress_lexicon):
+                        output_stream.write(sentence_transcription + '\n')
+                        transcription_stats.write_periodically(options.stats)
+                    output_stream.flush()
+                    if options.stats:
+                        transcription_stats.write(options.stats)
+                else:
+                    for input_file in [options.input] + arguments:
+                        manifest = None
+                        if options.incremental:
+                            manifest = TranscriptionManifest(input_file, options.model_file, options.g2p_fst,
+                                                             hash_dict, not options.no_log, options.aligned)
+                        checkpoint = None
+                        if checkpoints is not None:
+                            checkpoint = TranscriptionCheckpoint(input_file, hash_dict, not options.no_log,
+                                                                 options.resume, aligned=options.aligned)
+                            checkpoints.append(checkpoint)
+                        else:
+                            TranscriptionCheckpoint.remove_checkpoint(input_file)
+                        process_input(input_file, user_entries, lex_entries, homograph_entries, yo_words,
+                                      stress_prediction_process, g2p_process,
+                                      stress_prediction_file=options.model_file, batch_mode=options.batch,
+                                      batch_size=options.batch_size, stress_cache=stress_cache,
+                                      pipeline_window=options.pipeline, sentence_cache=sentence_cache,
+                                      stats_file=options.stats, write_log=not options.no_log,
+                                      trace_writer=trace_writer, g2p_word_cache=g2p_word_cache, manifest=manifest,
+                                      checkpoint=checkpoint, aligned=options.aligned, pos_tagger=pos_tagger,
+                                      stress_lexicon=stress_lexicon)
+                close_resources(stress_prediction_process, g2p_process)
+                if pos_tagger is not None:
+                    pos_tagger.close()
+            for cache in [stress_cache, sentence_cache, g2p_word_cache]:
+                if cache:
+                    sys.stdout.write('[INFO] ' + cache.get_stats() + '\n')
+                    cache.close()
+            for checkpoint in checkpoints or []:
+                checkpoint.remove()
+        except (PhonetisaurusInitializationError, TransducerInitializationError, PosTaggerInitializationError,
+                ResourcesNotFound, SnapshotNotFound, StressLexiconNotFound):
             sys.exit(1)
+        finally:
+            if trace_writer:
+                trace_writer.close()
 
     else:
         options_parser.print_help()
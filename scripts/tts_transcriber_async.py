@@ -0,0 +1,196 @@
+# coding=utf-8
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Copyright 2014 Yandex LLC
+# All Rights Reserved.
+#
+# Author : Alexis Wilpert
+#
+#
+# asyncio interface (Python 3) to the transcription server of tts_transcriber.py
+#
+# This is only a client: it requires a running tts_transcriber.py --server (started by AsyncTranscriber.start with
+# python2, or already running), and it does not replace the subprocess layer of the transcriber. Phonetisaurus and
+# transduce are still driven by the server through its supervised pipes (SupervisedProcess), not by asyncio
+# subprocess streams.
+#
+# tts_transcriber.py runs on Python 2, which has no asyncio, so the transcriber is started as an asyncio subprocess in
+# server mode and the sentences are sent over asyncio streams. Every connection has one reader task that resolves the
+# pending requests in order (the server answers the lines of a connection in the order they are received), so any
+# number of coroutines can share the connections.
+
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+
+TRANSCRIBER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tts_transcriber.py')
+SERVER_READY = 'Serving transcriptions on '
+
+
+class TranscriberConnection(object):
+    """
+    one connection to the transcription server, with the futures of the requests waiting for their transcription
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = []
+        self.reader_task = asyncio.ensure_future(self.read_responses())
+
+    async def read_responses(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    raise ConnectionError('transcription server closed the connection')
+                future = self.pending.pop(0)
+                if not future.cancelled():
+                    future.set_result(line.decode('utf-8').rstrip('\n'))
+        except (Exception, asyncio.CancelledError) as error:
+            if isinstance(error, asyncio.CancelledError):
+                error = ConnectionError('transcription connection closed')
+            for future in self.pending:
+                if not future.done():
+                    future.set_exception(error)
+            self.pending = []
+
+    async def transcribe(self, sentence):
+        if self.reader_task.done():
+            raise ConnectionError('transcription server closed the connection')
+        future = asyncio.get_running_loop().create_future()
+        # the future is queued and the line written without awaiting in between, so requests and responses stay
+        # in the same order
+        self.pending.append(future)
+        self.writer.write(sentence.encode('utf-8') + b'\n')
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        # the server ends the connection once it has answered all the lines before the end of file
+        if not self.reader_task.done():
+            self.writer.write_eof()
+            await self.reader_task
+        self.writer.close()
+
+
+class AsyncTranscriber(object):
+    """
+    asyncio transcription API. Use start() to run tts_transcriber.py as a subprocess with the given resources, or
+    connect() to use an already running transcription server
+    """
+
+    def __init__(self, connections):
+        self.connections = connections
+        self.next_connection = itertools.cycle(connections)
+        self.process = None
+        self.socket_dir = None
+
+    @classmethod
+    async def connect(cls, address, connections=1):
+        """
+        connect to a transcription server listening on HOST:PORT or on a Unix socket path
+        """
+
+        transcriber_connections = []
+        for _ in range(connections):
+            if ':' in address:
+                host, port = address.rsplit(':', 1)
+                reader, writer = await asyncio.open_connection(host, int(port))
+            else:
+                reader, writer = await asyncio.open_unix_connection(address)
+            transcriber_connections.append(TranscriberConnection(reader, writer))
+        return cls(transcriber_connections)
+
+    @classmethod
+    async def start(cls, stress_prediction_file, options_g2p_fst, general_lexicon=None, homographs_lexicon=None,
+                    user_lexicon=None, yo_list=None, jobs=1, extra_options=None, python_executable='python2'):
+        """
+        start a transcription server subprocess on a private Unix socket and connect to it, with one connection per
+        job. extra_options is a list of other tts_transcriber.py options (e.g. ['--snapshot', 'lexica.snap'])
+        """
+
+        socket_dir = tempfile.mkdtemp(prefix='rusphonetizer-')
+        address = os.path.join(socket_dir, 'transcriber.sock')
+        command = [python_executable, TRANSCRIBER_SCRIPT, '--server', address, '-m', stress_prediction_file,
+                   '-g', options_g2p_fst, '--jobs', str(jobs)]
+        for option, value in [('-l', general_lexicon), ('-a', homographs_lexicon), ('-u', user_lexicon),
+                              ('-y', yo_list)]:
+            if value:
+                command.extend([option, value])
+        command.extend(extra_options or [])
+        process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE)
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                await process.wait()
+                os.rmdir(socket_dir)
+                raise RuntimeError('transcription server exited with code %d' % process.returncode)
+            if line.decode('utf-8').startswith(SERVER_READY):
+                break
+        # the server keeps writing its messages (cache statistics at exit) to stdout
+        asyncio.ensure_future(cls.drain_output(process.stdout))
+        transcriber = await cls.connect(address, jobs)
+        transcriber.process = process
+        transcriber.socket_dir = socket_dir
+        return transcriber
+
+    @staticmethod
+    async def drain_output(stream):
+        while await stream.readline():
+            pass
+
+    async def transcribe(self, sentence):
+        if '\n' in sentence or '\r' in sentence:
+            raise ValueError('sentence to transcribe contains a line break')
+        return await next(self.next_connection).transcribe(sentence)
+
+    async def transcribe_many(self, sentences):
+        return await asyncio.gather(*[self.transcribe(sentence) for sentence in sentences])
+
+    async def close(self):
+        for connection in self.connections:
+            await connection.close()
+        if self.process is not None:
+            if self.process.returncode is None:
+                self.process.send_signal(2)  # SIGINT, the server closes its resources and removes the socket
+                await self.process.wait()
+            if os.path.isdir(self.socket_dir):
+                for file_name in os.listdir(self.socket_dir):
+                    os.unlink(os.path.join(self.socket_dir, file_name))
+                os.rmdir(self.socket_dir)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+async def transcribe_file(input_file, address, connections):
+    transcriber = await AsyncTranscriber.connect(address, connections)
+    async with transcriber:
+        with open(input_file, encoding='utf-8') as input_lines:
+            sentences = [line.strip() for line in input_lines if not line.startswith('#')]
+        for sentence_transcription in await transcriber.transcribe_many(sentences):
+            sys.stdout.write(sentence_transcription + '\n')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.stderr.write('Usage: tts_transcriber_async.py INPUT_FILE SERVER_ADDRESS [CONNECTIONS]\n')
+        sys.exit(1)
+    asyncio.run(transcribe_file(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 1))
@@ -0,0 +1,113 @@
+/* Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ * Copyright 2014 Yandex LLC
+ * All Rights Reserved.
+ *
+ * Author : Alexis Wilpert
+ *
+ *
+ * Utf8TransducerC.cpp
+ */
+
+
+
+#include <stdlib.h>
+#include <string.h>
+#include <mutex>
+#include <stdexcept>
+#include "Utf8Transducer.h"
+#include "Utf8TransducerC.h"
+
+using std::string;
+using namespace yatts;
+
+namespace {
+
+struct TransducerHandle {
+    Utf8Transducer transducer;
+    // Utf8Transducer keeps its last message in a member: one call at a time per handle
+    std::mutex mutex;
+    string message;
+};
+
+char * copy_string(const string& s) {
+    char * copy = (char *) malloc(s.size() + 1);
+    if (copy) {
+        memcpy(copy, s.c_str(), s.size() + 1);
+    }
+    return copy;
+}
+
+} /* namespace */
+
+void * utf8transducer_new() {
+    try {
+        return new TransducerHandle();
+    } catch (std::exception& e) {
+        return 0;
+    }
+}
+
+int utf8transducer_append_fst(void * handle, const char * file_name) {
+    TransducerHandle * h = (TransducerHandle *) handle;
+    std::lock_guard<std::mutex> lock(h->mutex);
+    // a warning while loading means that the FST could not be read
+    if (h->transducer.appendFst(string(file_name), string(file_name)) != Utf8Transducer::OK) {
+        h->message = h->transducer.getMessage();
+        return 1;
+    }
+    return 0;
+}
+
+int utf8transducer_transduce_many(void * handle, const char ** texts, int texts_num, char ** results) {
+    TransducerHandle * h = (TransducerHandle *) handle;
+    std::lock_guard<std::mutex> lock(h->mutex);
+    int failed = 0;
+    for (int i = 0; i < texts_num; i++) {
+        string result;
+        try {
+            // as in transduce: the output of a warning is kept, the one of an error is empty
+            if (h->transducer.transduceText(string(texts[i]), result) == Utf8Transducer::ERROR) {
+                result.clear();
+            }
+        } catch (std::exception& e) {
+            h->message = e.what();
+            result.clear();
+        }
+        if (result.empty()) {
+            failed++;
+        }
+        results[i] = copy_string(result);
+    }
+    return failed;
+}
+
+void utf8transducer_free_results(char ** results, int results_num) {
+    for (int i = 0; i < results_num; i++) {
+        free(results[i]);
+        results[i] = 0;
+    }
+}
+
+const char * utf8transducer_message(void * handle) {
+    TransducerHandle * h = (TransducerHandle *) handle;
+    std::lock_guard<std::mutex> lock(h->mutex);
+    if (h->message.empty()) {
+        return h->transducer.getMessage();
+    }
+    return h->message.c_str();
+}
+
+void utf8transducer_delete(void * handle) {
+    delete (TransducerHandle *) handle;
+}
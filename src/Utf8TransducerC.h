@@ -0,0 +1,58 @@
+/* Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ * Copyright 2014 Yandex LLC
+ * All Rights Reserved.
+ *
+ * Author : Alexis Wilpert
+ *
+ *
+ * Utf8TransducerC.h
+ *
+ * C interface to Utf8Transducer, built as the shared library libutf8transducer.so
+ * and loaded by tts_transcriber.py (--g2p_library) with ctypes. The calls on one
+ * handle are serialized; use one handle per thread for parallel transduction.
+ */
+
+
+
+#ifndef UTF8TRANSDUCERC_H_
+#define UTF8TRANSDUCERC_H_
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+/* new transducer without any FST, NULL on failure */
+void * utf8transducer_new();
+
+/* append the FST read from file_name to the chain, 0 if it was loaded */
+int utf8transducer_append_fst(void * handle, const char * file_name);
+
+/* transduce texts_num strings: results[i] is set to a new string with the output of
+ * texts[i] (an empty string if it could not be transduced). Returns the number of
+ * strings that could not be transduced. The results must be released with
+ * utf8transducer_free_results */
+int utf8transducer_transduce_many(void * handle, const char ** texts, int texts_num, char ** results);
+
+void utf8transducer_free_results(char ** results, int results_num);
+
+/* message of the last warning or error */
+const char * utf8transducer_message(void * handle);
+
+void utf8transducer_delete(void * handle);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif /* UTF8TRANSDUCERC_H_ */
@@ -0,0 +1,251 @@
+# coding=utf-8
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Copyright 2014 Yandex LLC
+# All Rights Reserved.
+#
+# Author : Alexis Wilpert
+#
+#
+# End-to-end throughput benchmark: transcribes corpora made of copies of the test sentences through process_input
+# (or process_input_parallel) with several transcriber configurations. Every run is done in a fresh process, which
+# reports its startup time (loading of the resources), the time spent in every stage (from the statistics of the
+# transcriber), the throughput and its peak memory usage. By default the external tools are replaced by fake
+# phonetisaurus-g2p-omega and transduce executables with a configurable latency, so that the benchmark can run without
+# Phonetisaurus and Thrax
+
+
+import os
+import sys
+import optparse
+import collections
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, os.path.join(PACKAGE_DIR, 'scripts'))
+
+import tts_transcriber
+
+CONFIGURATIONS = collections.OrderedDict([
+    ('default', {}),
+    ('batch', {'batch_mode': True}),
+    ('pipeline', {'pipeline_window': 16}),
+    ('batch+pipeline', {'batch_mode': True, 'pipeline_window': 16}),
+    ('jobs', {'batch_mode': True, 'pipeline_window': 16, 'jobs': 2}),
+])
+
+# fake executables: they read one request per line and wait FAKE_LATENCY_MS milliseconds before answering it (after
+# waiting FAKE_STARTUP_MS milliseconds at startup). The stress of a word is put on its first vowel, and the
+# "transcription" of a sentence is the sentence itself
+FAKE_PHONETISAURUS = r'''
+import os, sys, time
+latency = float(os.environ.get('FAKE_LATENCY_MS', '0')) / 1000
+time.sleep(float(os.environ.get('FAKE_STARTUP_MS', '0')) / 1000)
+args = dict(arg.split('=', 1) for arg in sys.argv[1:] if '=' in arg)
+vowels = u'аеёиоуыэюя'
+in_file = open(args['--input'], 'rb')
+for line in iter(in_file.readline, b''):
+    word = line.strip().decode('utf-8')
+    if not word:
+        continue
+    time.sleep(latency)
+    stressed = []
+    for char in word:
+        if char in vowels and '+' not in stressed:
+            stressed.append('+')
+        stressed.append(char)
+    out = u'%s\t%.4f\t%s\n' % (word, 10.0, ' '.join(stressed))
+    getattr(sys.stdout, 'buffer', sys.stdout).write(out.encode('utf-8'))
+    sys.stdout.flush()
+'''
+
+FAKE_TRANSDUCE = r'''
+import os, sys, time
+latency = float(os.environ.get('FAKE_LATENCY_MS', '0')) / 1000
+time.sleep(float(os.environ.get('FAKE_STARTUP_MS', '0')) / 1000)
+stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+for line in iter(stdin.readline, b''):
+    line = line.strip()
+    if not line:
+        continue
+    time.sleep(latency)
+    getattr(sys.stdout, 'buffer', sys.stdout).write(line + b'\n')
+    sys.stdout.flush()
+'''
+
+
+def write_fake_executables(bin_dir):
+    for name, source in [('phonetisaurus-g2p-omega', FAKE_PHONETISAURUS), ('transduce', FAKE_TRANSDUCE)]:
+        file_name = os.path.join(bin_dir, name)
+        with open(file_name, 'w') as out_file:
+            out_file.write('#!' + sys.executable + '\n# coding=utf-8\n' + source)
+        os.chmod(file_name, 0o755)
+
+
+def write_corpus(input_file, corpus_file, scale):
+    with open(input_file) as in_file:
+        sentences = [line for line in in_file if not line.startswith('#')]
+    with open(corpus_file, 'w') as out_file:
+        for _ in range(scale):
+            out_file.writelines(sentences)
+    return scale * len(sentences)
+
+
+def run_configuration(configuration, corpus_file, options):
+    """
+    transcribe the corpus in this process and return the measurements
+    """
+
+    settings = CONFIGURATIONS[configuration]
+    stats_file = corpus_file + '.stats.json'
+    resources = (options.dictionary, options.homographs, None, options.yo_list)
+    start = time.time()
+    if settings.get('jobs', 1) > 1:
+        hash_dict = tts_transcriber.get_resources_hashes(options.model_file, options.g2p_fst, *resources)
+        startup_time = time.time() - start
+        start = time.time()
+        tts_transcriber.process_input_parallel(corpus_file, settings['jobs'], options.model_file, options.g2p_fst,
+                                               *resources, batch_mode=settings.get('batch_mode', False),
+                                               pipeline_window=settings.get('pipeline_window', 0),
+                                               hash_dict=hash_dict, stats_file=stats_file)
+    else:
+        (stress_prediction_process, g2p_process, lex_entries, homograph_entries, user_entries, yo_words,
+         hash_dict) = tts_transcriber.initialize_resources(options.model_file, options.g2p_fst, *resources)
+        startup_time = time.time() - start
+        start = time.time()
+        tts_transcriber.process_input(corpus_file, user_entries, lex_entries, homograph_entries, yo_words,
+                                      stress_prediction_process, g2p_process, options.model_file,
+                                      batch_mode=settings.get('batch_mode', False),
+                                      pipeline_window=settings.get('pipeline_window', 0), stats_file=stats_file)
+        tts_transcriber.close_resources(stress_prediction_process, g2p_process)
+    total_time = time.time() - start
+    # statistics collected by the transcriber (in --jobs mode, the sum over all workers)
+    with open(stats_file) as in_file:
+        stats = json.load(in_file)
+    stages = dict((stage, stage_stats['total_s']) for stage, stage_stats in stats['stages'].items())
+    return {'startup_s': round(startup_time, 4),
+            'total_s': round(total_time, 4),
+            'stages_s': stages,
+            'sources': stats['sources'],
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'peak_rss_children_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+
+
+def main():
+    options_parser = optparse.OptionParser()
+    options_parser.add_option('--input', '-i', default=os.path.join(PACKAGE_DIR, 'test', 'rus_sentences.txt'),
+                              help='Sentences the corpora are made of')
+    options_parser.add_option('--yo_list', '-y', default=os.path.join(PACKAGE_DIR, 'dictionaries',
+                                                                        'tts-dict-yo-list.txt'),
+                              help='List of words that contain the letter <yo>')
+    options_parser.add_option('--dictionary', '-l', default=os.path.join(PACKAGE_DIR, 'dictionaries',
+                                                                           'tts-dict-simple.pruned.txt'),
+                              help='A simple dictionary file')
+    options_parser.add_option('--homographs', '-a', default=os.path.join(PACKAGE_DIR, 'dictionaries',
+                                                                           'tts-dict-homographs.txt'),
+                              help='A file with homographs')
+    options_parser.add_option('--model_file', '-m', help='Stress prediction model, only with --real')
+    options_parser.add_option('--g2p_fst', '-g', help='G2P FSTs, only with --real')
+    options_parser.add_option('--real', action='store_true', default=False,
+                              help='Use the phonetisaurus-g2p-omega and transduce executables found in PATH')
+    options_parser.add_option('--latency', type='float', default=0.1,
+                              help='Latency of the fake executables per request, in milliseconds')
+    options_parser.add_option('--startup_latency', type='float', default=0,
+                              help='Startup time of the fake executables, in milliseconds')
+    options_parser.add_option('--scales', default='1,10',
+                              help='Comma separated list of corpus sizes, in copies of the input sentences')
+    options_parser.add_option('--configurations', '-c', default=','.join(CONFIGURATIONS),
+                              help='Comma separated list of configurations (' + ', '.join(CONFIGURATIONS) + ')')
+    options_parser.add_option('--run', '-r', help='Run this configuration on the --corpus file (internal use)')
+    options_parser.add_option('--corpus', help='Corpus file (internal use)')
+    options_parser.add_option('--output', '-o', help='Write the results as JSON to this file (OPT)')
+    options, arguments = options_parser.parse_args()
+
+    if options.run:
+        sys.stdout = open(os.devnull, 'w')  # keep the progress messages out of the result
+        result = run_configuration(options.run, options.corpus, options)
+        sys.__stdout__.write(json.dumps(result) + '\n')
+        return
+
+    if options.real and not (options.model_file and options.g2p_fst):
+        options_parser.error('--real needs the stress prediction model (-m) and the G2P FSTs (-g)')
+    configurations = options.configurations.split(',')
+    for configuration in configurations:
+        if configuration not in CONFIGURATIONS:
+            options_parser.error('unknown configuration: ' + configuration)
+
+    work_dir = tempfile.mkdtemp(prefix='rusphonetizer-benchmark-')
+    environment = dict(os.environ)
+    try:
+        if not options.real:
+            write_fake_executables(work_dir)
+            environment['PATH'] = work_dir + os.pathsep + environment.get('PATH', '')
+            environment['FAKE_LATENCY_MS'] = str(options.latency)
+            environment['FAKE_STARTUP_MS'] = str(options.startup_latency)
+            # the fakes ignore the models, which only have to exist
+            options.model_file = os.path.join(work_dir, 'model.fst')
+            options.g2p_fst = os.path.join(work_dir, 'g2p.fst')
+            for file_name in [options.model_file, options.g2p_fst]:
+                open(file_name, 'w').close()
+        results = []
+        sys.stdout.write('{0:<16} {1:>9} {2:>11} {3:>10} {4:>13} {5:>12}\n'.format(
+            'configuration', 'sentences', 'startup (s)', 'total (s)', 'sentences/s', 'peak RSS (KB)'))
+        for scale in [int(scale) for scale in options.scales.split(',')]:
+            corpus_file = os.path.join(work_dir, 'corpus-{0}.txt'.format(scale))
+            sentences_num = write_corpus(options.input, corpus_file, scale)
+            for configuration in configurations:
+                command = [sys.executable, os.path.abspath(__file__), '-r', configuration, '--corpus', corpus_file,
+                           '-m', options.model_file, '-g', options.g2p_fst, '-l', options.dictionary,
+                           '-a', options.homographs, '-y', options.yo_list]
+                start = time.time()
+                p = subprocess.Popen(command, stdout=subprocess.PIPE, env=environment)
+                output = p.communicate()[0]
+                if p.returncode:
+                    sys.stderr.write('Benchmark run failed: {0} x{1}\n'.format(configuration, scale))
+                    sys.exit(1)
+                result = json.loads(output.decode('utf-8'))
+                result.update({'configuration': configuration,
+                               'scale': scale,
+                               'sentences': sentences_num,
+                               'process_s': round(time.time() - start, 4),
+                               'sentences_per_s': round(sentences_num / max(result['total_s'], 1e-9), 1),
+                               'fake_tools': not options.real,
+                               'latency_ms': None if options.real else options.latency})
+                results.append(result)
+                sys.stdout.write('{0:<16} {1:>9} {2:>11} {3:>10} {4:>13} {5:>12}\n'.format(
+                    configuration, sentences_num, result['startup_s'], result['total_s'],
+                    result['sentences_per_s'], max(result['peak_rss_kb'], result['peak_rss_children_kb'])))
+    finally:
+        shutil.rmtree(work_dir)
+
+    if options.output:
+        with open(options.output, 'w') as out_file:
+            json.dump({'script_version': tts_transcriber.SCRIPT_VERSION,
+                       'python': sys.version.split()[0],
+                       'results': results}, out_file, indent=2, sort_keys=True)
+
+
+# call the main() function to start the program.
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+# coding=utf-8
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Copyright 2014 Yandex LLC
+# All Rights Reserved.
+#
+# Author : Alexis Wilpert
+#
+#
+# Check of the G2P word cache (--word_cache) on the test sentences: the stress strings of the log and the
+# transcriptions of rus_sentences.txt.g2p give the output of the G2P FSTs for every word in its sentence. The check
+# verifies that words with the same cache key (stress string and cross-word contexts) always have the same output, and
+# that every sentence put together from a cache filled with all other sentences has its reference transcription.
+# With --real and -g the installed transduce executable is used as well, comparing whole-sentence transduction with
+# transduction through the cache on several passes over the sentences
+
+
+import os
+import sys
+import optparse
+import random
+import subprocess
+import collections
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, os.path.join(PACKAGE_DIR, 'scripts'))
+
+import tts_transcriber
+from tts_transcriber import to_utf8, from_utf8, G2PWordCache, get_g2p_contexts
+
+
+def read_reference(log_file, g2p_file):
+    """
+    (line to transcribe, reference output) pairs of the test sentences, from the stress strings of the log
+    """
+
+    sentences = []
+    lines_to_transcribe = []
+    for line in open(log_file):
+        line = to_utf8(line).rstrip('\n')
+        if line.startswith('[SNUM]'):
+            lines_to_transcribe.append('')
+        elif line.startswith('[STRS]'):
+            stress_str = line.split('\t', 1)[1].replace(to_utf8('Х'), '')
+            lines_to_transcribe[-1] += stress_str + ' '
+    for line_to_transcribe, g2p_line in zip(lines_to_transcribe, open(g2p_file)):
+        sentences.append((line_to_transcribe, g2p_line.strip()))
+    return sentences
+
+
+def get_sentence_keys(line_to_transcribe):
+    tokens = line_to_transcribe.split()
+    return G2PWordCache.get_keys(tokens, get_g2p_contexts(tokens))
+
+
+def check_keys(sentences):
+    outputs = collections.defaultdict(set)
+    tokens_num = 0
+    for line_to_transcribe, reference in sentences:
+        keys = get_sentence_keys(line_to_transcribe)
+        if len(keys) != len(reference.split()):
+            sys.stderr.write('Words and transcription not aligned: ' + from_utf8(line_to_transcribe) + '\n')
+            continue
+        for key, output in zip(keys, reference.split()):
+            outputs[key].add(output)
+            tokens_num += 1
+    conflicts = [key for key, key_outputs in outputs.items() if len(key_outputs) > 1]
+    for key in conflicts:
+        sys.stderr.write('Different outputs for ' + from_utf8(key).replace('\t', ' | ') + ': ' +
+                         ', '.join(sorted(outputs[key])) + '\n')
+    return tokens_num, len(outputs), len(conflicts)
+
+
+def check_leave_one_out(sentences):
+    """
+    put every sentence together from a cache holding the words of all other sentences
+    """
+
+    cached_words = 0
+    cached_sentences = 0
+    mismatches = 0
+    for i, (line_to_transcribe, reference) in enumerate(sentences):
+        cache = G2PWordCache(max_size=10 ** 6)
+        for j, (other_line, other_reference) in enumerate(sentences):
+            if j != i:
+                str_to_transcribe, g2p_data = cache.prepare(other_line)
+                cache.complete(g2p_data, other_reference if str_to_transcribe else '')
+        keys = get_sentence_keys(line_to_transcribe)
+        for key, output in zip(keys, reference.split()):
+            cached_output = cache.get(key)
+            if cached_output is not None:
+                cached_words += 1
+                if cached_output != output:
+                    sys.stderr.write('Different cached output in ' + from_utf8(line_to_transcribe) + ': ' +
+                                     cached_output + ' instead of ' + output + '\n')
+                    mismatches += 1
+        str_to_transcribe, g2p_data = cache.prepare(line_to_transcribe)
+        if not str_to_transcribe:
+            cached_sentences += 1
+            if cache.complete(g2p_data, '') != reference:
+                mismatches += 1
+    return cached_words, cached_sentences, mismatches
+
+
+def transduce_lines(g2p_process, lines):
+    results = []
+    for line in lines:
+        results.append(tts_transcriber.get_g2p_transcription(line, g2p_process))
+    return results
+
+
+def check_real(sentences, options_g2p_fst, passes):
+    """
+    transcribe the sentences (and, on every pass, new sentences made of the words of two shuffled sentences) with
+    transduce, once whole and once through the G2P word cache
+    """
+
+    dev_null = open(os.devnull, 'wb')
+    g2p_process = subprocess.Popen(['transduce', '--fst=' + options_g2p_fst.replace(' ', '')],
+                                   stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=dev_null)
+    lines = [line_to_transcribe for line_to_transcribe, _ in sentences]
+    rand = random.Random(0)
+    for _ in range(passes - 1):
+        shuffled = list(lines)
+        rand.shuffle(shuffled)
+        lines.extend(first.rstrip() + ' ' + second for first, second in zip(shuffled[::2], shuffled[1::2]))
+    expected = transduce_lines(g2p_process, lines)
+    cache = G2PWordCache(max_size=10 ** 6)
+    mismatches = 0
+    for line, expected_result in zip(lines, expected):
+        str_to_transcribe, g2p_data = cache.prepare(line)
+        g2p_result = ''
+        if str_to_transcribe:
+            g2p_result = tts_transcriber.get_g2p_transcription(str_to_transcribe, g2p_process)
+        result = cache.complete(g2p_data, g2p_result)
+        if result is not None and result != expected_result:
+            sys.stderr.write('Different transcription of ' + from_utf8(line) + ': ' + result + '\n')
+            mismatches += 1
+    g2p_process.terminate()
+    return len(lines), cache.hits, cache.misses, mismatches
+
+
+def main():
+    options_parser = optparse.OptionParser()
+    options_parser.add_option('--log', default=os.path.join(PACKAGE_DIR, 'test', 'rus_sentences.txt.log'),
+                              help='Transcription log of the test sentences')
+    options_parser.add_option('--g2p', default=os.path.join(PACKAGE_DIR, 'test', 'rus_sentences.txt.g2p'),
+                              help='Transcriptions of the test sentences')
+    options_parser.add_option('--real', action='store_true', default=False,
+                              help='Compare with the transduce executable found in PATH as well')
+    options_parser.add_option('--g2p_fst', '-g', help='G2P FSTs, only with --real')
+    options_parser.add_option('--passes', type='int', default=3,
+                              help='Passes over the sentences with --real')
+    options_parser.add_option('--output', '-o', help='Write the results as JSON to this file (OPT)')
+    options, arguments = options_parser.parse_args()
+
+    if options.real and not options.g2p_fst:
+        options_parser.error('--real needs the G2P FSTs (-g)')
+    sentences = read_reference(options.log, options.g2p)
+    tokens_num, keys_num, conflicts = check_keys(sentences)
+    cached_words, cached_sentences, mismatches = check_leave_one_out(sentences)
+    results = {'sentences': len(sentences),
+               'words': tokens_num,
+               'keys': keys_num,
+               'key_conflicts': conflicts,
+               'leave_one_out_cached_words': cached_words,
+               'leave_one_out_cached_sentences': cached_sentences,
+               'leave_one_out_mismatches': mismatches}
+    sys.stdout.write('{0} sentences, {1} words, {2} distinct keys, {3} conflicts\n'.format(
+        len(sentences), tokens_num, keys_num, conflicts))
+    sys.stdout.write('leave one out: {0} words and {1} sentences from the cache, {2} mismatches\n'.format(
+        cached_words, cached_sentences, mismatches))
+    failed = conflicts or mismatches
+    if options.real:
+        lines_num, hits, misses, real_mismatches = check_real(sentences, options.g2p_fst, options.passes)
+        results.update({'real_sentences': lines_num,
+                        'real_hits': hits,
+                        'real_misses': misses,
+                        'real_mismatches': real_mismatches})
+        sys.stdout.write('transduce: {0} sentences, {1} words from the cache, {2} not cached, {3} mismatches\n'.format(
+            lines_num, hits, misses, real_mismatches))
+        failed = failed or real_mismatches
+    if options.output:
+        with open(options.output, 'w') as out_file:
+            json.dump(results, out_file, indent=2)
+    if failed:
+        sys.exit(1)
+
+
+# call the main() function to start the program.
+if __name__ == '__main__':
+    main()
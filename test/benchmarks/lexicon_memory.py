@@ -0,0 +1,144 @@
+# coding=utf-8
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Copyright 2014 Yandex LLC
+# All Rights Reserved.
+#
+# Author : Alexis Wilpert
+#
+#
+# Memory benchmark of the lexicon representations: every representation is loaded in a fresh process, which reports
+# its memory usage after loading and the time needed for loading and looking up all entries
+
+
+import os
+import sys
+import optparse
+import subprocess
+import tempfile
+import time
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, os.path.join(PACKAGE_DIR, 'scripts'))
+
+import tts_transcriber
+
+REPRESENTATIONS = ['text', 'compact', 'snapshot']
+
+
+def get_memory_usage():
+    """
+    current resident set size in KB (Linux), or the peak resident set size when /proc is not available
+    """
+
+    try:
+        for line in open('/proc/self/status'):
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    except IOError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(representation, lexica_args, snapshot_file):
+    words = []
+    for lexicon in [lexica_args[0], lexica_args[3]]:
+        if lexicon:
+            words.extend(ortho for ortho, _ in tts_transcriber.read_dictionary(lexicon))
+    homograph_words = []
+    if lexica_args[1]:
+        homograph_words = [entry[1] for entry in tts_transcriber.read_homographs(lexica_args[1])]
+    words.extend(word + tts_transcriber.to_utf8('ъ') for word in words[:1000])  # unknown words
+    memory_before = get_memory_usage()
+    start = time.time()
+    if representation == 'snapshot':
+        lexica = tts_transcriber.load_lexica_snapshot(snapshot_file)
+    else:
+        lexica = tts_transcriber.load_lexica(*lexica_args, compact=(representation == 'compact'))
+    load_time = time.time() - start
+    memory_after = get_memory_usage()
+    lex_entries, homograph_entries, user_entries, yo_words = lexica
+    start = time.time()
+    for word in words:
+        lex_entries.get_transcription(word)
+        yo_words.has_entry(word)
+    for word in homograph_words:
+        homograph_entries.get_transcription(word, tts_transcriber.GEN_POS)
+    lookup_time = time.time() - start
+    lookups_num = 2 * len(words) + len(homograph_words)
+    return {'representation': representation,
+            'memory_kb': memory_after - memory_before,
+            'load_s': round(load_time, 4),
+            'lookup_us': round(1e6 * lookup_time / max(lookups_num, 1), 3),
+            'lookups': lookups_num}
+
+
+def main():
+    options_parser = optparse.OptionParser()
+    options_parser.add_option('--yo_list', '-y', default=os.path.join(PACKAGE_DIR, 'dictionaries',
+                                                                        'tts-dict-yo-list.txt'),
+                              help='List of words that contain the letter <yo>')
+    options_parser.add_option('--dictionary', '-l', default=os.path.join(PACKAGE_DIR, 'dictionaries',
+                                                                           'tts-dict-simple.pruned.txt'),
+                              help='A simple dictionary file')
+    options_parser.add_option('--homographs', '-a', default=os.path.join(PACKAGE_DIR, 'dictionaries',
+                                                                           'tts-dict-homographs.txt'),
+                              help='A file with homographs')
+    options_parser.add_option('--representation', '-r', help='Measure only this representation (internal use)')
+    options_parser.add_option('--snapshot', '-s', help='Lexica snapshot used by the "snapshot" representation')
+    options_parser.add_option('--output', '-o', help='Write the results as JSON to this file (OPT)')
+    options, arguments = options_parser.parse_args()
+    lexica_args = (options.dictionary, options.homographs, None, options.yo_list)
+
+    if options.representation:
+        sys.stdout = sys.stderr  # keep the loading messages out of the result
+        result = measure(options.representation, lexica_args, options.snapshot)
+        sys.__stdout__.write(json.dumps(result) + '\n')
+        return
+
+    snapshot_file = tempfile.mktemp(suffix='.snapshot')
+    hash_dict = dict((os.path.realpath(f), tts_transcriber.get_hash_code(f)) for f in lexica_args if f)
+    dev_null = open(os.devnull, 'w')
+    sys.stdout, stdout = dev_null, sys.stdout
+    tts_transcriber.update_lexica_snapshot(snapshot_file, hash_dict, *lexica_args)
+    sys.stdout = stdout
+    results = []
+    try:
+        for representation in REPRESENTATIONS:
+            p = subprocess.Popen([sys.executable, os.path.abspath(__file__), '-r', representation,
+                                  '-s', snapshot_file, '-l', options.dictionary, '-a', options.homographs,
+                                  '-y', options.yo_list], stdout=subprocess.PIPE, stderr=dev_null)
+            results.append(json.loads(p.communicate()[0]))
+    finally:
+        os.unlink(snapshot_file)
+
+    sys.stdout.write('{0:<10} {1:>12} {2:>10} {3:>12}\n'.format('lexica', 'memory (KB)', 'load (s)', 'lookup (us)'))
+    for result in results:
+        sys.stdout.write('{0:<10} {1:>12} {2:>10} {3:>12}\n'.format(result['representation'], result['memory_kb'],
+                                                                   result['load_s'], result['lookup_us']))
+    if options.output:
+        with open(options.output, 'w') as out_file:
+            json.dump(results, out_file, indent=2)
+
+
+# call the main() function to start the program.
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+# coding=utf-8
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Copyright 2014 Yandex LLC
+# All Rights Reserved.
+#
+# Author : Alexis Wilpert
+#
+#
+# Micro-benchmark of the tokenizer: compares tokenize_sentence with the previous implementation (kept here as
+# reference_tokenize_sentence), checking that both produce the same output and log for every test sentence
+
+
+import os
+import sys
+import re
+import optparse
+import logging
+import time
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, os.path.join(PACKAGE_DIR, 'scripts'))
+
+import tts_transcriber
+from tts_transcriber import to_utf8, from_utf8, sil_punct_symbols, other_punct_symbols
+
+
+def reference_tokenize_sentence(sentence, yo_words, tlog):
+    russian_input = re.compile(to_utf8('[а-яА-ЯёЁ{0}]+').format(sil_punct_symbols + other_punct_symbols + ' -'))
+    m = russian_input.match(sentence)
+    if m:
+        tokenized_sentence = sentence.lower()
+        for sym in other_punct_symbols:
+            tokenized_sentence = tokenized_sentence.replace(sym, '')
+        tokenized_sentence = tokenized_sentence.replace(' - ', ' , ')
+        tokenized_sentence = re.sub(r'([{0}])'.format(sil_punct_symbols), r' \1 ', tokenized_sentence)
+        tokenized_sentence = re.sub(r'\s+', r' ', tokenized_sentence)
+        tokenized_sent_with_restored_yo = ''
+        word_pos = 0
+        for word in tokenized_sentence.split(' '):
+            if (not to_utf8('ё') in word) and \
+                    (to_utf8('е') in word) and \
+                    yo_words.has_entry(word):
+                word = yo_words.get_transcription(word)
+                tlog.info('[YOWR]\t%s', from_utf8(word))
+            tokenized_sent_with_restored_yo += word + ' '
+            word_pos += 1
+    else:
+        tokenized_sent_with_restored_yo = ''
+    return tokenized_sent_with_restored_yo.strip()
+
+
+class ListLog(object):
+    def __init__(self):
+        self.messages = []
+
+    def info(self, msg, *args):
+        self.messages.append(msg % args)
+
+
+def get_sentences(input_file):
+    sentences = []
+    for line in open(input_file):
+        if not line.startswith('#'):
+            sentences.append(to_utf8(line).strip())
+    # variants exercising the punctuation and whitespace normalization
+    sentences.extend([sentence.upper().replace(' ', '  -  ') for sentence in sentences])
+    sentences.extend([sentence.replace(' ', ' -\t;') + ' - ' for sentence in sentences])
+    return sentences
+
+
+def time_tokenizer(tokenizer, sentences, yo_words, repetitions):
+    null_log = logging.getLogger('nullLogger')
+    start = time.time()
+    for _ in range(repetitions):
+        for sentence in sentences:
+            tokenizer(sentence, yo_words, null_log)
+    return 1e6 * (time.time() - start) / (repetitions * len(sentences))
+
+
+def main():
+    options_parser = optparse.OptionParser()
+    options_parser.add_option('--input', '-i', default=os.path.join(PACKAGE_DIR, 'test', 'rus_sentences.txt'),
+                              help='Test sentences')
+    options_parser.add_option('--yo_list', '-y', default=os.path.join(PACKAGE_DIR, 'dictionaries',
+                                                                        'tts-dict-yo-list.txt'),
+                              help='List of words that contain the letter <yo>')
+    options_parser.add_option('--repetitions', '-n', type='int', default=20, help='Passes over the sentences')
+    options_parser.add_option('--output', '-o', help='Write the results as JSON to this file (OPT)')
+    options, arguments = options_parser.parse_args()
+
+    sys.stdout, stdout = sys.stderr, sys.stdout  # keep the loading messages out of the result
+    yo_words = tts_transcriber.LexEntries()
+    yo_words.load_dictionary(options.yo_list)
+    sys.stdout = stdout
+    sentences = get_sentences(options.input)
+
+    mismatches = 0
+    for sentence in sentences:
+        reference_log, log = ListLog(), ListLog()
+        expected = reference_tokenize_sentence(sentence, yo_words, reference_log)
+        if tts_transcriber.tokenize_sentence(sentence, yo_words, log) != expected or \
+                log.messages != reference_log.messages:
+            sys.stderr.write('Different tokenization: ' + from_utf8(sentence) + '\n')
+            mismatches += 1
+
+    results = {'sentences': len(sentences),
+               'mismatches': mismatches,
+               'reference_us': round(time_tokenizer(reference_tokenize_sentence, sentences, yo_words,
+                                                    options.repetitions), 2),
+               'tokenizer_us': round(time_tokenizer(tts_transcriber.tokenize_sentence, sentences, yo_words,
+                                                    options.repetitions), 2)}
+    sys.stdout.write('{0} sentences, {1} mismatches\n'.format(results['sentences'], results['mismatches']))
+    sys.stdout.write('reference tokenizer: {0} us/sentence\n'.format(results['reference_us']))
+    sys.stdout.write('tokenize_sentence:   {0} us/sentence\n'.format(results['tokenizer_us']))
+    if options.output:
+        with open(options.output, 'w') as out_file:
+            json.dump(results, out_file, indent=2)
+    if mismatches:
+        sys.exit(1)
+
+
+# call the main() function to start the program.
+if __name__ == '__main__':
+    main()